@@ -1,7 +1,7 @@
 import numpy as np
 from qiskit import QuantumRegister, QuantumCircuit
 from DiffusionProject.Algorithms.Coins import Coin, SU2Coin
-from DiffusionProject.Algorithms.Coins import AbsorbingControl
+from DiffusionProject.Algorithms.Coins import AbsorbingControl, controlled_gate_registry
 
 class Obstruction:
     """Represents a single obstructive point in  lattice"""
@@ -147,6 +147,10 @@ class BoundaryControl:
     def d_filter(self):
         return self._d_filter
 
+    @property
+    def n_resets(self):
+        return self._n_resets
+
     @property
     def x(self):
         qc = QuantumCircuit(1)
@@ -154,6 +158,13 @@ class BoundaryControl:
         directional_reversal_gate = qc.to_gate(label = "mct")
         return directional_reversal_gate
 
+    def x_control(self, num_ctrl_qubits, ctrl_state = None, label = None):
+        """returns the controlled `x` gate used to set ancillas from `controlled_gate_registry`"""
+        if ctrl_state == None:
+            ctrl_state = "1"*num_ctrl_qubits
+        key = ("mct", num_ctrl_qubits, ctrl_state, label)
+        return controlled_gate_registry.get(key, lambda: self.x.control(num_ctrl_qubits, ctrl_state = ctrl_state, label = label))
+
     def init_register_with_idx(self,idx):
         name = self.register.name + str(idx)
         self.init_register(name)
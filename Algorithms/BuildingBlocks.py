@@ -1,3 +1,4 @@
+from qiskit import QuantumCircuit
 from math import pi
 
 def qft_rotations(circuit, n_qubits):
@@ -44,4 +45,46 @@ def grover_diffuser(circuit, n_qubits):
         # Apply transformation |00..0> -> |s>
     circuit.h(qubit_indices)
     
-    return circuit
\ No newline at end of file
+    return circuit
+
+def ripple_increment(circuit, controls, register, carry):
+    """
+    Adds 1 to `register` (little endian) when every qubit in `controls` is set, in linear depth.
+    The carry into each bit is computed into the `carry` ancillas with a chain of toffolis and uncomputed as the bits are flipped
+    """
+    n_qubits = len(register)
+    if controls:
+        circuit.mct(controls, carry[0])
+    else:
+        circuit.x(carry[0])
+    for idx in range(1, n_qubits):
+        circuit.ccx(carry[idx-1], register[idx-1], carry[idx])
+
+    # flip from the top so each carry is uncomputed while the bit below is unchanged
+    for idx in reversed(range(1, n_qubits)):
+        circuit.cx(carry[idx], register[idx])
+        circuit.ccx(carry[idx-1], register[idx-1], carry[idx])
+    circuit.cx(carry[0], register[0])
+
+    if controls:
+        circuit.mct(controls, carry[0])
+    else:
+        circuit.x(carry[0])
+    return circuit
+
+
+def qft_increment(circuit, controls, register, value = 1):
+    """Adds `value` to `register` (little endian) modulo 2^n when every qubit in `controls` is set, as phases in the fourier basis"""
+    n_qubits = len(register)
+    qft_circuit = qft(QuantumCircuit(n_qubits, name = "QFT"), n_qubits)
+    qft_gate = qft_circuit.to_gate()
+
+    circuit.append(qft_gate, register[:])
+    for idx in range(n_qubits):
+        phase = 2*pi*value*2**idx/2**n_qubits
+        if controls:
+            circuit.mcp(phase, controls, register[idx])
+        else:
+            circuit.p(phase, register[idx])
+    circuit.append(qft_gate.inverse(), register[:])
+    return circuit
@@ -4,9 +4,43 @@ from qiskit.circuit import ControlledGate, Gate
 from DiffusionProject.Algorithms.BuildingBlocks import qft
 from qiskit.quantum_info.operators import Operator
 import numpy as np
+import hashlib
 from numpy import pi, cos, sin, exp
 
 
+class ControlledGateRegistry:
+    """Memoises controlled gates so that identical gates are synthesised once and shared between steps and walks"""
+
+    def __init__(self) -> None:
+        self._gates = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build) -> ControlledGate:
+        """returns the gate stored under `key`, calling `build` to synthesise it on a miss"""
+        gate = self._gates.get(key)
+        if gate is None:
+            self.misses += 1
+            gate = build()
+            self._gates[key] = gate
+        else:
+            self.hits += 1
+        return gate
+
+    @property
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._gates)}
+
+    def clear(self) -> None:
+        """removes every stored gate and resets the statistics"""
+        self._gates.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+controlled_gate_registry = ControlledGateRegistry()
+
+
 class Control:
 
     def __init__(self,n_qubits) -> None:
@@ -14,6 +48,7 @@ class Control:
         self._n_qubits = n_qubits
         self._control_circuit = QuantumCircuit(n_qubits)
         self._gate = self._control_circuit.to_gate(label = self._name)
+        self._key = None
         
     
     @property
@@ -24,10 +59,28 @@ class Control:
     def n_qubits(self) -> int:
         return self._n_qubits
 
+    @property
+    def unitary(self) -> np.ndarray:
+        """The unitary matrix of the control gate"""
+        return Operator(self._gate).data
+
+    @property
+    def key(self) -> tuple:
+        """A hashable identifier for the control, equal for controls with the same class and unitary"""
+        if self._key is None:
+            unitary_hash = hashlib.sha1((np.round(self.unitary, 12) + 0.0).tobytes()).hexdigest()
+            self._key = (type(self).__name__, self._n_qubits, unitary_hash)
+        return self._key
+
     def control(self, num_ctrl_qubits,ctrl_state = None, inverse = False, label = None) -> ControlledGate:
+        """returns the controlled gate from `controlled_gate_registry`, synthesising it on first use"""
         if ctrl_state == None:
             ctrl_state = "1"*num_ctrl_qubits
 
+        key = (self.key, num_ctrl_qubits, ctrl_state, inverse, label)
+        return controlled_gate_registry.get(key, lambda: self._build_control(num_ctrl_qubits, ctrl_state, inverse, label))
+
+    def _build_control(self, num_ctrl_qubits, ctrl_state, inverse, label) -> ControlledGate:
         base_gate = self._gate if not inverse else self.inverse()
         if inverse:
             base_gate.name = "${}$".format(self._name + r"^{-1}")
@@ -69,6 +122,14 @@ class Coin(Control):
         qc.x(-1)
         directional_reversal_gate = qc.to_gate(label = "Direction Reversal")
         return directional_reversal_gate
+
+    def d_reversal_control(self, num_ctrl_qubits, ctrl_state = None, label = None) -> ControlledGate:
+        """returns the controlled `DReversalGate` from `controlled_gate_registry`, synthesising it on first use"""
+        if ctrl_state == None:
+            ctrl_state = "1"*num_ctrl_qubits
+
+        key = ("Direction Reversal", self._n_qubits, num_ctrl_qubits, ctrl_state, label)
+        return controlled_gate_registry.get(key, lambda: self.DReversalGate.control(num_ctrl_qubits, ctrl_state = ctrl_state, label = label))
     
 class XCoin(Coin):
     def __init__(self, n_qubits) -> None:
@@ -0,0 +1,844 @@
+import time
+import itertools
+import numpy as np
+from scipy import sparse
+from qiskit import QuantumCircuit
+from qiskit.quantum_info import Operator, Statevector
+from DiffusionProject.Algorithms.Coins import CylicController, AbsorbingControl
+from DiffusionProject.Evaluation.CountsTable import CountsTable
+from DiffusionProject.Evaluation.DenseTensor import write_dense_tensor
+from DiffusionProject.Algorithms.Boundaries import Obstruction, AbsorbingBoundaryControl, ControlledDirectionalBoundaryControl, UniDirectionalBoundaryControl, NonDisruptiveBoundaryControl, EfficientBoundaryControl
+from numpy import pi
+
+
+class EngineResult:
+    """Mimics the parts of a qiskit `Result` used by `QuantumWalk`"""
+
+    def __init__(self, data: dict, time_taken: float) -> None:
+        self._data = data
+        self.time_taken = time_taken
+
+    def data(self, experiment = 0) -> dict:
+        return self._data
+
+    def get_counts(self, experiment = 0) -> CountsTable:
+        """native engines return their counts as a `CountsTable` over every state register"""
+        return self._data["counts"]
+
+
+class EngineJob:
+    """Mimics the parts of a qiskit `Job` used by `QuantumWalk` for results computed by a native engine"""
+
+    def __init__(self, result: EngineResult) -> None:
+        self._result = result
+
+    def result(self) -> EngineResult:
+        return self._result
+
+    def job_id(self):
+        return None
+
+
+class NumpyEngine:
+    """
+    Evolves a `QuantumWalk` as a position x coin amplitude tensor without building a quantum circuit.
+
+    Boundary control registers and ancillas are never held in the state. Soft boundary registers are only
+    ever used as controls before being reset, so their outcome is sampled classically each step. Ancillas
+    (absorption and efficient/directional boundary ancillas) record a function of the walker's basis state and
+    are reset on the next step, which is emulated by sampling that record and projecting the walker onto it.
+    Walks containing either of these (or a `CoinDecoherenceCycle`) are simulated as one trajectory per shot,
+    exactly as Aer does for circuits containing resets.
+    """
+
+    # whether `run_decoherence` applies restart decoherence as a channel in a single pass
+    exact_decoherence = False
+
+    def __init__(self, walk, max_batch_amplitudes = 2**24, seed = None) -> None:
+        """
+        Args:
+            walk (`DiffusionProject.Algorithms.Walks.QuantumWalk`): the walk to simulate\n
+            max_batch_amplitudes (int): upper bound on the number of amplitudes held at once when simulating trajectories\n
+            seed (int): seed for the random number generator used for sampling
+        """
+        self._walk = walk
+        self._max_batch_amplitudes = max_batch_amplitudes
+        self._rng = np.random.default_rng(seed)
+
+        self._n_qubits = list(walk.system_dimensions)
+        self._shape = tuple(2**n_qubits for n_qubits in self._n_qubits)
+        self._n_coin_bits = walk.n_shift_coin_bits
+        self._coin_dim = 2**self._n_coin_bits
+        self._coords = np.indices(self._shape)
+
+        # coin operators
+        self._coin = Operator(walk.shift_coin.gate).data
+        self._coin_inverse = self._coin.conj().T
+        self._d_reversal = np.arange(self._coin_dim) ^ (1 << (self._n_coin_bits-1))
+        # u(pi/2,pi/2,3pi/2)|0>, the state `QuantumWalk.decohere_coin` re-prepares
+        self._decoherence_state = np.array([np.cos(pi/4), np.exp(1j*pi/2)*np.sin(pi/4)])
+
+        # coin value -> (dimension, roll) for every shift in the walk's step
+        self._shifts = []
+        for direction, coin_bitstring, dimension in walk.shift_table:
+            roll = -1 if direction == "left" else 1
+            self._shifts.append((int(coin_bitstring, 2), dimension, roll))
+
+        self._build_boundary_maps()
+
+    @property
+    def is_stochastic(self) -> bool:
+        """True if the walk contains resets which require per-shot trajectories"""
+        has_records = self._absorption_labels is not None or any(labels is not None for labels in self._record_labels)
+        has_soft_boundaries = any(len(distribution[0]) > 1 for distribution in self._register_distributions if distribution is not None)
+        return has_records or has_soft_boundaries or self._walk.coin_decoherence_cycle is not None
+
+    def _boundary_mask(self, boundary) -> np.ndarray:
+        """boolean mask over lattice sites matching `boundary`"""
+        if type(boundary) == Obstruction:
+            # the controls are the concatenated registers, little endian over the joined bitstrings
+            bits = "".join(boundary.bitstrings)[::-1]
+            mask = np.ones(self._shape, dtype=bool)
+            offset = 0
+            for dimension in boundary.dimensions:
+                n_bits = self._n_qubits[dimension]
+                mask &= self._coords[dimension] == int(bits[offset:offset+n_bits][::-1], 2)
+                offset += n_bits
+            return mask
+
+        return self._coords[boundary.dimension] == int(boundary.bitstring, 2)
+
+    def _build_boundary_maps(self) -> None:
+        """precomputes the site masks, ancilla records and register distributions for each boundary control"""
+        coin_msb = (np.arange(self._coin_dim) >> (self._n_coin_bits-1)) & 1
+
+        self._masks = []
+        self._record_labels = []
+        self._register_distributions = []
+        absorption_parity = None
+
+        for boundary_control in self._walk.boundary_controls:
+            masks = [self._boundary_mask(boundary) for boundary in boundary_control.boundaries]
+            self._masks.append(masks)
+
+            parity = np.zeros(self._shape, dtype=int)
+            for mask in masks:
+                parity ^= mask
+
+            # ancilla records, labelled over position x coin
+            control_type = type(boundary_control)
+            if control_type == AbsorbingBoundaryControl:
+                absorption_parity = parity if absorption_parity is None else absorption_parity ^ parity
+                labels = None
+            elif control_type == EfficientBoundaryControl or control_type == NonDisruptiveBoundaryControl:
+                labels = np.repeat(parity[..., None], self._coin_dim, axis=-1)
+            elif control_type == ControlledDirectionalBoundaryControl or control_type == UniDirectionalBoundaryControl:
+                labels = np.zeros(self._shape + (self._coin_dim,), dtype=int)
+                for mask in masks:
+                    for ancilla_idx in range(2):
+                        labels ^= (mask[..., None] & (coin_msb == ancilla_idx)) << ancilla_idx
+            else:
+                labels = None
+            self._record_labels.append(labels)
+
+            # distribution of the boundary control register after its coin is applied to |0>
+            if control_type != AbsorbingBoundaryControl and boundary_control.register is not None:
+                ctrl = boundary_control.ctrl
+                if type(ctrl) == CylicController or type(ctrl) == AbsorbingControl:
+                    distribution = np.zeros(2**ctrl.n_qubits)
+                    distribution[0] = 1.0
+                else:
+                    distribution = np.abs(Operator(ctrl.gate).data[:, 0])**2
+                outcomes = np.flatnonzero(distribution > 1e-12)
+                self._register_distributions.append((outcomes, distribution[outcomes]/distribution[outcomes].sum()))
+            else:
+                self._register_distributions.append(None)
+
+        # absorption ancilla is set to |1> then flipped for every matching absorbing boundary
+        if absorption_parity is None:
+            self._absorption_labels = None
+        else:
+            self._absorption_labels = np.repeat((1 ^ absorption_parity)[..., None], self._coin_dim, axis=-1)
+
+    def _initial_state(self, initial_states, batch_size) -> np.ndarray:
+        """returns the initial amplitude tensor with shape (batch, *lattice, coin)"""
+        if initial_states is None:
+            initial_states = self._walk.initial_states
+
+        position = [0]*len(self._shape)
+        if initial_states is not None:
+            assert len(initial_states) == len(self._shape)
+            for idx, initial_state in enumerate(initial_states):
+                assert len(initial_state) == self._n_qubits[idx]
+                position[idx] = int(initial_state, 2)
+
+        state = np.zeros((batch_size,) + self._shape + (self._coin_dim,), dtype=complex)
+        state[(slice(None),) + tuple(position)] = self._initial_coin_state()
+        return state
+
+    def _initial_coin_state(self) -> np.ndarray:
+        """the coin state prepared by the walk's coin initialiser"""
+        coin_circuit = QuantumCircuit(self._walk.shift_coin_register)
+        self._walk._coin_initialiser.initialise(coin_circuit, self._walk.shift_coin_register)
+        return Statevector(coin_circuit).data
+
+    def _position_states(self, positions) -> np.ndarray:
+        """returns one trajectory for each lattice position in `positions` (shape (n, n_dims)), each in the initial coin state"""
+        positions = np.asarray(positions)
+        state = np.zeros((len(positions),) + self._shape + (self._coin_dim,), dtype=complex)
+        state[(np.arange(len(positions)),) + tuple(positions.T)] = self._initial_coin_state()
+        return state
+
+    def _expand(self, row_flags, site_mask = None) -> np.ndarray:
+        """combines per trajectory flags with a site mask into a mask broadcastable against the state"""
+        row_flags = np.asarray(row_flags).reshape((-1,) + (1,)*len(self._shape))
+        if site_mask is None:
+            return row_flags[..., None]
+        return (row_flags & site_mask[None])[..., None]
+
+    def _apply_coin(self, state, matrix, mask = None) -> np.ndarray:
+        updated = state @ matrix.T
+        return updated if mask is None else np.where(mask, updated, state)
+
+    def _apply_d_reversal(self, state, mask) -> np.ndarray:
+        return np.where(mask, state[..., self._d_reversal], state)
+
+    def _project(self, state, labels, record) -> np.ndarray:
+        """projects each trajectory onto the basis states whose ancilla label matches its record, without renormalising"""
+        return np.where(labels[None] == record.reshape((-1,) + (1,)*labels.ndim), state, 0)
+
+    def _sample_record(self, state, labels) -> np.ndarray:
+        """samples an ancilla record for each trajectory and projects the trajectory onto it"""
+        probabilities = np.abs(state)**2
+        n_labels = int(labels.max()) + 1
+        label_probabilities = np.stack([probabilities[:, labels == label].sum(axis=-1) for label in range(n_labels)], axis=-1)
+        label_probabilities /= label_probabilities.sum(axis=-1, keepdims=True)
+        draws = self._rng.random((state.shape[0], 1))
+        record = (label_probabilities.cumsum(axis=-1) < draws).sum(axis=-1)
+        record = np.minimum(record, n_labels-1)
+
+        state = self._project(state, labels, record)
+        norms = np.sqrt((np.abs(state)**2).reshape(state.shape[0], -1).sum(axis=-1))
+        return state/norms.reshape((-1,) + (1,)*(state.ndim-1)), record
+
+    def _sample_registers(self, batch_size) -> list:
+        """samples the value of each soft boundary control register for every trajectory"""
+        register_values = []
+        for distribution in self._register_distributions:
+            if distribution is None:
+                register_values.append(None)
+                continue
+            outcomes, probabilities = distribution
+            register_values.append(self._rng.choice(outcomes, size=batch_size, p=probabilities))
+        return register_values
+
+    def _apply_boundaries(self, state, records, register_values) -> np.ndarray:
+        """applies each boundary control in the same order as `QuantumWalk.apply_boundary`"""
+        batch_size = state.shape[0]
+        always = np.ones(batch_size, dtype=bool)
+
+        for control_idx, boundary_control in enumerate(self._walk.boundary_controls):
+            control_type = type(boundary_control)
+            masks = self._masks[control_idx]
+            register_value = register_values[control_idx]
+
+            if register_value is not None:
+                ctrl_active = register_value == int(boundary_control.ctrl_state, 2)
+            else:
+                ctrl_active = always
+
+            if control_type == AbsorbingBoundaryControl or control_type == UniDirectionalBoundaryControl:
+                continue
+
+            if control_type == ControlledDirectionalBoundaryControl:
+                record = records[control_idx]
+                for direction_idx in range(2):
+                    ancilla_active = ((record >> direction_idx) & 1) == 1
+                    register_active = ((register_value >> direction_idx) & 1) == 1
+                    if boundary_control.d_filter:
+                        state = self._apply_coin(state, self._coin_inverse, self._expand(ancilla_active))
+                    else:
+                        state = self._apply_coin(state, self._coin_inverse, self._expand(ancilla_active & register_active))
+                    state = self._apply_d_reversal(state, self._expand(ancilla_active & register_active))
+                continue
+
+            if control_type == EfficientBoundaryControl or control_type == NonDisruptiveBoundaryControl:
+                ancilla_active = records[control_idx] == 1
+                if boundary_control.d_filter:
+                    state = self._apply_coin(state, self._coin_inverse, self._expand(ancilla_active))
+                else:
+                    state = self._apply_coin(state, self._coin_inverse, self._expand(ancilla_active & ctrl_active))
+                state = self._apply_d_reversal(state, self._expand(ancilla_active & ctrl_active))
+                continue
+
+            for boundary, mask in zip(boundary_control.boundaries, masks):
+                if boundary_control.d_filter and type(boundary) != Obstruction:
+                    state = self._apply_coin(state, self._coin_inverse, self._expand(always, mask))
+                else:
+                    state = self._apply_coin(state, self._coin_inverse, self._expand(ctrl_active, mask))
+                state = self._apply_d_reversal(state, self._expand(ctrl_active, mask))
+
+        return state
+
+    def _apply_post_shift_operations(self, state, records, register_values) -> np.ndarray:
+        """emulates `QuantumWalk.apply_non_disruptive_boundary_cleanup`"""
+        for control_idx, boundary_control in enumerate(self._walk.boundary_controls):
+            if type(boundary_control) != NonDisruptiveBoundaryControl:
+                continue
+            ancilla_active = records[control_idx] == 1
+            register_value = register_values[control_idx]
+            if register_value is not None:
+                ctrl_active = ancilla_active & (register_value == int(boundary_control.ctrl_state, 2))
+            else:
+                ctrl_active = ancilla_active
+
+            if boundary_control.reflect_inertia == False:
+                state = self._apply_d_reversal(state, self._expand(ctrl_active))
+            if boundary_control.d_filter:
+                state = self._apply_coin(state, self._coin, self._expand(ancilla_active))
+            else:
+                state = self._apply_coin(state, self._coin, self._expand(ctrl_active))
+        return state
+
+    def _apply_shifts(self, state, absorption_record) -> np.ndarray:
+        """rolls each coin slice along its dimension, trajectories absorbed this step do not move"""
+        for coin_value, dimension, roll in self._shifts:
+            shifted = np.roll(state[..., coin_value], roll, axis=dimension+1)
+            if absorption_record is not None:
+                moving = absorption_record.reshape((-1,) + (1,)*len(self._shape)) == 1
+                shifted = np.where(moving, shifted, state[..., coin_value])
+            state[..., coin_value] = shifted
+        return state
+
+    def _decohere_coin(self, state, step_idx) -> np.ndarray:
+        """emulates `QuantumWalk.decohere_coin` by measuring and re-preparing the targeted coin qubits"""
+        cycle = self._walk.coin_decoherence_cycle
+        if cycle is None or (step_idx+1) % cycle.cycle_length != 0:
+            return state
+
+        for target_idx in cycle.target_qubits:
+            coin_values = np.arange(self._coin_dim)
+            zero_values = coin_values[(coin_values >> target_idx) & 1 == 0]
+            one_values = zero_values | (1 << target_idx)
+
+            labels = np.zeros(self._shape + (self._coin_dim,), dtype=int)
+            labels[..., one_values] = 1
+            state, outcome = self._sample_record(state, labels)
+            state = self._reprepare_coin_qubit(state, target_idx, outcome)
+        return state
+
+    def _reprepare_coin_qubit(self, state, target_idx, outcome) -> np.ndarray:
+        """maps coin qubit `target_idx` from |`outcome`> (given per trajectory) to the state `QuantumWalk.decohere_coin` prepares"""
+        coin_values = np.arange(self._coin_dim)
+        zero_values = coin_values[(coin_values >> target_idx) & 1 == 0]
+        one_values = zero_values | (1 << target_idx)
+
+        outcome = np.asarray(outcome).reshape((-1,) + (1,)*(len(self._shape)+1))
+        selected = np.where(outcome == 1, state[..., one_values], state[..., zero_values])
+        reprepared = np.empty_like(state)
+        reprepared[..., zero_values] = self._decoherence_state[0]*selected
+        reprepared[..., one_values] = self._decoherence_state[1]*selected
+        return reprepared
+
+    def _apply_step(self, state, records, absorption_record, register_values) -> np.ndarray:
+        """applies the coins, boundaries and shifts of a step given the ancilla records and register values of each trajectory"""
+        state = self._apply_coin(state, self._coin)
+        state = self._apply_boundaries(state, records, register_values)
+        state = self._apply_shifts(state, absorption_record)
+        return self._apply_post_shift_operations(state, records, register_values)
+
+    def step(self, state, step_idx = None) -> np.ndarray:
+        """applies a single step of the walk to a batch of trajectories"""
+        batch_size = state.shape[0]
+
+        records = []
+        for labels in self._record_labels:
+            if labels is None:
+                records.append(None)
+            else:
+                state, record = self._sample_record(state, labels)
+                records.append(record)
+
+        absorption_record = None
+        if self._absorption_labels is not None:
+            state, absorption_record = self._sample_record(state, self._absorption_labels)
+
+        register_values = self._sample_registers(batch_size)
+        state = self._apply_step(state, records, absorption_record, register_values)
+
+        if step_idx is not None:
+            state = self._decohere_coin(state, step_idx)
+        return state
+
+    def evolve(self, n_steps, initial_states = None, batch_size = 1) -> np.ndarray:
+        """returns the amplitude tensor of `batch_size` trajectories after `n_steps` steps"""
+        state = self._initial_state(initial_states, batch_size)
+        for step_idx in range(n_steps):
+            state = self.step(state, step_idx)
+        return state
+
+    def probabilities(self, state) -> np.ndarray:
+        """marginalises the coin out of an amplitude tensor, returning shape (batch, *lattice)"""
+        return (np.abs(state)**2).sum(axis=-1)
+
+    def position_to_bitstring(self, position) -> str:
+        """returns the state register bitstring for a lattice position, in qiskit ordering"""
+        return "".join(format(int(position[idx]), "0{}b".format(self._n_qubits[idx])) for idx in reversed(range(len(self._shape))))
+
+    def _counts_table(self, flat_indices, counts) -> CountsTable:
+        """the `CountsTable` holding `counts` at the flattened lattice indices `flat_indices`"""
+        positions = np.unravel_index(flat_indices, self._shape)
+        states = np.zeros(len(flat_indices), dtype=np.int64)
+        offset = 0
+        for idx, n_qubits in enumerate(self._n_qubits):
+            states |= positions[idx].astype(np.int64) << offset
+            offset += n_qubits
+        return CountsTable(states, counts, self._n_qubits)
+
+    def _sample_counts(self, probabilities, shots) -> CountsTable:
+        """samples `shots` positions from a single distribution over the lattice"""
+        flat = probabilities.ravel()
+        samples = self._rng.multinomial(shots, flat/flat.sum())
+        observed = np.flatnonzero(samples)
+        return self._counts_table(observed, samples[observed])
+
+    def _run_trajectories(self, n_steps, shots, initial_states) -> CountsTable:
+        """simulates one trajectory per shot and samples a single position from each"""
+        amplitudes_per_trajectory = int(np.prod(self._shape))*self._coin_dim
+        batch_limit = max(1, self._max_batch_amplitudes//amplitudes_per_trajectory)
+
+        samples = np.zeros(int(np.prod(self._shape)), dtype=np.int64)
+        remaining = shots
+        while remaining > 0:
+            batch_size = min(batch_limit, remaining)
+            probabilities = self.probabilities(self.evolve(n_steps, initial_states, batch_size)).reshape(batch_size, -1)
+            cumulative = probabilities.cumsum(axis=-1)
+            draws = self._rng.random((batch_size, 1))*cumulative[:, -1:]
+            flat_indices = np.minimum((cumulative < draws).sum(axis=-1), cumulative.shape[-1]-1)
+            samples += np.bincount(flat_indices, minlength=len(samples))
+            remaining -= batch_size
+        observed = np.flatnonzero(samples)
+        return self._counts_table(observed, samples[observed])
+
+    def to_qiskit_order(self, probabilities) -> np.ndarray:
+        """flattens a distribution over the lattice so that index bits follow the qiskit state register ordering"""
+        return probabilities.transpose(tuple(reversed(range(probabilities.ndim)))).ravel()
+
+    def _average_trajectory_probabilities(self, n_steps, n_trajectories, initial_states) -> np.ndarray:
+        """averages the position distribution over `n_trajectories` trajectories"""
+        amplitudes_per_trajectory = int(np.prod(self._shape))*self._coin_dim
+        batch_limit = max(1, self._max_batch_amplitudes//amplitudes_per_trajectory)
+
+        total = np.zeros(self._shape)
+        remaining = n_trajectories
+        while remaining > 0:
+            batch_size = min(batch_limit, remaining)
+            total += self.probabilities(self.evolve(n_steps, initial_states, batch_size)).sum(axis=0)
+            remaining -= batch_size
+        return total/n_trajectories
+
+    def run_sweep(self, step_numbers, shots = 1024, initial_states = None) -> EngineJob:
+        """
+        evolves once to the largest of `step_numbers`, recording the distribution after each of them under the same
+        labels as `QuantumWalk.run_sweep`. Stochastic walks are averaged over `shots` trajectories
+        """
+        start_time = time.perf_counter()
+        step_numbers = sorted(set(step_numbers))
+        batch_size = shots if self.is_stochastic else 1
+
+        totals = {n_steps: np.zeros(self._shape) for n_steps in step_numbers}
+        amplitudes_per_trajectory = int(np.prod(self._shape))*self._coin_dim
+        batch_limit = max(1, self._max_batch_amplitudes//amplitudes_per_trajectory)
+        remaining = batch_size
+        while remaining > 0:
+            chunk_size = min(batch_limit, remaining)
+            state = self._initial_state(initial_states, chunk_size)
+            if 0 in totals:
+                totals[0] += self.probabilities(state).sum(axis=0)
+            for step_idx in range(step_numbers[-1]):
+                state = self.step(state, step_idx)
+                if step_idx+1 in totals:
+                    totals[step_idx+1] += self.probabilities(state).sum(axis=0)
+            remaining -= chunk_size
+
+        data = {self._walk.sweep_label(n_steps): self.to_qiskit_order(total/batch_size) for n_steps, total in totals.items()}
+        return EngineJob(EngineResult(data, time.perf_counter() - start_time))
+
+    def position_distribution(self, n_steps, shots = 1024, initial_states = None) -> np.ndarray:
+        """
+        the position distribution after `n_steps`, indexed [x_0, x_1, ...]. This is exact unless the walk is stochastic,
+        in which case it is averaged over `shots` trajectories
+        """
+        if self.is_stochastic:
+            return self._average_trajectory_probabilities(n_steps, shots, initial_states)
+        return self.probabilities(self.evolve(n_steps, initial_states))[0]
+
+    def run_dense(self, n_steps, path = None, shots = 1024, initial_states = None) -> np.ndarray:
+        """writes the position distribution after `n_steps` as a dense float32 tensor, memory-mapped from the `.npy` file `path` if passed"""
+        return write_dense_tensor(self.position_distribution(n_steps, shots, initial_states), path)
+
+    def run(self, n_steps, shots = 1024, initial_states = None, mode = "counts") -> EngineJob:
+        """
+        runs the walk for `n_steps` and returns a job whose results only contain the state registers.
+        In "probabilities" mode the result holds the position distribution instead of sampled counts, this is exact
+        unless the walk is stochastic, in which case it is averaged over `shots` trajectories.
+        """
+        start_time = time.perf_counter()
+        if mode == "probabilities":
+            data = {"probabilities": self.to_qiskit_order(self.position_distribution(n_steps, shots, initial_states))}
+
+        elif self.is_stochastic:
+            data = {"counts": self._run_trajectories(n_steps, shots, initial_states)}
+        else:
+            probabilities = self.probabilities(self.evolve(n_steps, initial_states))[0]
+            data = {"counts": self._sample_counts(probabilities, shots)}
+        return EngineJob(EngineResult(data, time.perf_counter() - start_time))
+
+
+# cached powers of step operators: configuration key -> [U, U^2, U^4, ...]
+_step_operator_cache = {}
+
+
+def clear_step_operator_cache() -> None:
+    """removes every cached step operator power"""
+    _step_operator_cache.clear()
+
+
+class OperatorEngine(NumpyEngine):
+    """
+    Builds the one-step unitary of a walk over position x coin once and reaches step N by binary exponentiation.
+
+    Powers U^(2^k) are cached by `QuantumWalk.configuration_key` so that every walk in a sweep with the same configuration
+    reuses them, making step N cost O(log N) matrix products. Only walks without resets have a step unitary; stochastic
+    walks fall back to stepwise evolution.
+    """
+
+    def _step_operator_powers(self) -> list:
+        key = self._walk.configuration_key()
+        if key not in _step_operator_cache:
+            dimension = int(np.prod(self._shape))*self._coin_dim
+            basis_states = np.eye(dimension, dtype=complex).reshape((dimension,) + self._shape + (self._coin_dim,))
+            # column j of U is the step applied to basis state j
+            step_operator = self.step(basis_states).reshape(dimension, dimension).T
+            _step_operator_cache[key] = [step_operator]
+        return _step_operator_cache[key]
+
+    def step_operator_power(self, exponent_bit) -> np.ndarray:
+        """returns U^(2^`exponent_bit`), squaring and caching any missing powers"""
+        powers = self._step_operator_powers()
+        while len(powers) <= exponent_bit:
+            powers.append(powers[-1] @ powers[-1])
+        return powers[exponent_bit]
+
+    def evolve(self, n_steps, initial_states = None, batch_size = 1) -> np.ndarray:
+        if self.is_stochastic:
+            return super().evolve(n_steps, initial_states, batch_size)
+
+        state = self._initial_state(initial_states, batch_size)
+        flat_state = state.reshape(batch_size, -1).T
+        exponent_bit = 0
+        while n_steps >> exponent_bit:
+            if (n_steps >> exponent_bit) & 1:
+                flat_state = self.step_operator_power(exponent_bit) @ flat_state
+            exponent_bit += 1
+        return flat_state.T.reshape(state.shape)
+
+
+# sparse step operators: configuration key -> U
+_sparse_step_operator_cache = {}
+
+
+def clear_sparse_step_operator_cache() -> None:
+    """removes every cached sparse step operator"""
+    _sparse_step_operator_cache.clear()
+
+
+class SparseEngine(NumpyEngine):
+    """
+    Builds the one-step unitary of a walk over position x coin as a scipy.sparse matrix and applies it by mat-vec each step.
+
+    The operator is composed from the shift coin's unitary, the `BoundaryControl`/`Obstruction` site masks and the shift
+    permutations, so memory scales with lattice sites x coin dimension and never with the boundary or ancilla qubits.
+    Operators are cached by `QuantumWalk.configuration_key`. Only walks without resets have a step unitary; stochastic walks
+    fall back to stepwise trajectory evolution.
+    """
+
+    @property
+    def _dimension(self) -> int:
+        return int(np.prod(self._shape))*self._coin_dim
+
+    def _site_operator(self, mask, matrix) -> sparse.csr_matrix:
+        """applies `matrix` to the coin at the sites in `mask`, or at every site if `mask` is None"""
+        n_sites = int(np.prod(self._shape))
+        matrix = sparse.csr_matrix(matrix)
+        if mask is None:
+            return sparse.kron(sparse.identity(n_sites, format="csr"), matrix, format="csr")
+        mask = mask.ravel().astype(float)
+        return (sparse.kron(sparse.diags(mask), matrix) + sparse.kron(sparse.diags(1-mask), sparse.identity(self._coin_dim))).tocsr()
+
+    def _permutation_operator(self, source_indices) -> sparse.csr_matrix:
+        """the operator mapping amplitude `source_indices[i]` to amplitude i"""
+        dimension = self._dimension
+        return sparse.csr_matrix((np.ones(dimension, dtype=complex), (np.arange(dimension), source_indices.ravel())), shape=(dimension, dimension))
+
+    def _build_step_operator(self) -> sparse.csr_matrix:
+        """composes the coin, boundary and shift operators of a step without resets, in the order `NumpyEngine.step` applies them"""
+        d_reversal = np.eye(self._coin_dim)[self._d_reversal]
+        step_operator = self._site_operator(None, self._coin)
+
+        for control_idx, boundary_control in enumerate(self._walk.boundary_controls):
+            distribution = self._register_distributions[control_idx]
+            ctrl_active = distribution is None or distribution[0][0] == int(boundary_control.ctrl_state, 2)
+
+            for boundary, mask in zip(boundary_control.boundaries, self._masks[control_idx]):
+                if ctrl_active or (boundary_control.d_filter and type(boundary) != Obstruction):
+                    step_operator = self._site_operator(mask, self._coin_inverse) @ step_operator
+                if ctrl_active:
+                    step_operator = self._site_operator(mask, d_reversal) @ step_operator
+
+        source_indices = np.arange(self._dimension).reshape(self._shape + (self._coin_dim,))
+        for coin_value, dimension, roll in self._shifts:
+            source_indices[..., coin_value] = np.roll(source_indices[..., coin_value], roll, axis=dimension)
+        return (self._permutation_operator(source_indices) @ step_operator).tocsr()
+
+    def step_operator(self) -> sparse.csr_matrix:
+        """returns the cached sparse step operator of the walk"""
+        key = self._walk.configuration_key()
+        if key not in _sparse_step_operator_cache:
+            _sparse_step_operator_cache[key] = self._build_step_operator()
+        return _sparse_step_operator_cache[key]
+
+    def evolve(self, n_steps, initial_states = None, batch_size = 1) -> np.ndarray:
+        if self.is_stochastic:
+            return super().evolve(n_steps, initial_states, batch_size)
+
+        state = self._initial_state(initial_states, batch_size)
+        step_operator = self.step_operator()
+        flat_state = state.reshape(batch_size, -1).T
+        for _ in range(n_steps):
+            flat_state = step_operator @ flat_state
+        return flat_state.T.reshape(state.shape)
+
+
+class FourierEngine(NumpyEngine):
+    """
+    Evolves walks without boundary controls in momentum space.
+
+    Without boundaries every step is the shift coin on each site followed by cyclic shifts of the lattice, so the walk is
+    translation invariant and a Fourier transform over the lattice diagonalises the shifts. Each momentum k then evolves under
+    the coin-sized step U(k) = D(k) C, where D(k) holds the phase of the shifts applied to each coin value, and step N is reached
+    with one FFT, U(k)^N and an inverse FFT in O(sites log(sites)) for any N. Walks with boundaries or coin decoherence fall back
+    to stepwise evolution.
+    """
+
+    @property
+    def _lattice_axes(self) -> tuple:
+        """the lattice axes of a batch of amplitude tensors"""
+        return tuple(range(1, len(self._shape)+1))
+
+    def _momentum_step_operators(self) -> np.ndarray:
+        """the step U(k) of every momentum k, with shape (*lattice, coin, coin)"""
+        phases = np.ones(self._shape + (self._coin_dim,), dtype=complex)
+        for coin_value, dimension, roll in self._shifts:
+            # rolling by `roll` along a dimension of length L multiplies momentum k by exp(-2 pi i k roll / L)
+            momenta = np.fft.fftfreq(self._shape[dimension])
+            axis_shape = [1]*len(self._shape)
+            axis_shape[dimension] = -1
+            phases[..., coin_value] *= np.exp(-2j*pi*roll*momenta).reshape(axis_shape)
+        return phases[..., None]*self._coin
+
+    def evolve(self, n_steps, initial_states = None, batch_size = 1) -> np.ndarray:
+        if not self._walk.is_translation_invariant:
+            return super().evolve(n_steps, initial_states, batch_size)
+
+        state = self._initial_state(initial_states, batch_size)
+        momentum_state = np.fft.fftn(state, axes=self._lattice_axes)
+        step_power = np.linalg.matrix_power(self._momentum_step_operators(), n_steps)
+        momentum_state = np.einsum("...ij,b...j->b...i", step_power, momentum_state)
+        return np.fft.ifftn(momentum_state, axes=self._lattice_axes)
+
+    def run_sweep(self, step_numbers, shots = 1024, initial_states = None) -> EngineJob:
+        """computes the distribution after each of `step_numbers` directly rather than stepping to the largest"""
+        if not self._walk.is_translation_invariant:
+            return super().run_sweep(step_numbers, shots, initial_states)
+
+        start_time = time.perf_counter()
+        data = {}
+        for n_steps in sorted(set(step_numbers)):
+            data[self._walk.sweep_label(n_steps)] = self.to_qiskit_order(self.probabilities(self.evolve(n_steps, initial_states))[0])
+        return EngineJob(EngineResult(data, time.perf_counter() - start_time))
+
+
+class DensityMatrixEngine(NumpyEngine):
+    """
+    Evolves a `QuantumWalk` as a density matrix over position x coin, applying every reset as a channel instead of sampling it.
+
+    A step is the sum of K rho K^dagger over every combination of ancilla records and soft boundary register values, where K
+    projects onto the records and applies the step conditioned on them. A `CoinDecoherenceCycle` re-prepares its target
+    qubits as a reset channel. Restart decoherence measures the walker's position, so between cycles the walker is held as a
+    distribution over positions, and within a cycle only walks with resets need a density matrix. All results are exact.
+    """
+
+    exact_decoherence = True
+
+    @property
+    def _dimension(self) -> int:
+        return int(np.prod(self._shape))*self._coin_dim
+
+    def _full(self, value, batch_size):
+        return None if value is None else np.full(batch_size, value)
+
+    def _branches(self, batch_size) -> list:
+        """every combination of ancilla records and register values, as (weight, records, absorption record, register values)"""
+        record_choices = [[None] if labels is None else list(np.unique(labels)) for labels in self._record_labels]
+        absorption_choices = [None] if self._absorption_labels is None else list(np.unique(self._absorption_labels))
+        register_choices = [[(None, 1.0)] if distribution is None else list(zip(*distribution)) for distribution in self._register_distributions]
+
+        branches = []
+        for records in itertools.product(*record_choices):
+            for absorption_record in absorption_choices:
+                for register_outcomes in itertools.product(*register_choices):
+                    weight = np.prod([probability for _, probability in register_outcomes])
+                    branches.append((weight,
+                        [self._full(record, batch_size) for record in records],
+                        self._full(absorption_record, batch_size),
+                        [self._full(register_value, batch_size) for register_value, _ in register_outcomes]))
+        return branches
+
+    def _apply_branch(self, state, branch) -> np.ndarray:
+        """applies the Kraus operator of a single branch to a batch of vectors"""
+        weight, records, absorption_record, register_values = branch
+        for labels, record in zip(self._record_labels, records):
+            if labels is not None:
+                state = self._project(state, labels, record)
+        if absorption_record is not None:
+            state = self._project(state, self._absorption_labels, absorption_record)
+        return np.sqrt(weight)*self._apply_step(state.copy(), records, absorption_record, register_values)
+
+    def _apply_channel(self, rho, kraus_operators) -> np.ndarray:
+        """returns the sum of K rho K^dagger, each K given as a function acting on a batch of vectors"""
+        dimension = rho.shape[0]
+        vector_shape = (dimension,) + self._shape + (self._coin_dim,)
+        updated = np.zeros_like(rho)
+        for kraus_operator in kraus_operators:
+            # the rows of rho.T are the columns of rho, and the rows of conj(K rho) are the columns of (K rho)^dagger
+            k_rho = kraus_operator(rho.T.reshape(vector_shape)).reshape(dimension, dimension).T
+            updated += kraus_operator(k_rho.conj().reshape(vector_shape)).reshape(dimension, dimension).T
+        return updated
+
+    def _decohere_coin_channel(self, rho, step_idx) -> np.ndarray:
+        """applies `QuantumWalk.decohere_coin` as a reset channel on the targeted coin qubits"""
+        cycle = self._walk.coin_decoherence_cycle
+        if cycle is None or (step_idx+1) % cycle.cycle_length != 0:
+            return rho
+
+        dimension = rho.shape[0]
+        for target_idx in cycle.target_qubits:
+            kraus_operators = [lambda state, target_idx=target_idx, outcome=outcome: self._reprepare_coin_qubit(state, target_idx, np.full(dimension, outcome)) for outcome in range(2)]
+            rho = self._apply_channel(rho, kraus_operators)
+        return rho
+
+    def density_step(self, rho, step_idx = None) -> np.ndarray:
+        """applies a single step of the walk to a density matrix over position x coin"""
+        kraus_operators = [lambda state, branch=branch: self._apply_branch(state, branch) for branch in self._branches(rho.shape[0])]
+        rho = self._apply_channel(rho, kraus_operators)
+        if step_idx is not None:
+            rho = self._decohere_coin_channel(rho, step_idx)
+        return rho
+
+    def density_matrix(self, state) -> np.ndarray:
+        """mixes a batch of (unnormalised) trajectories into a single density matrix"""
+        assert self._dimension**2 <= self._max_batch_amplitudes, "a density matrix of dimension {} exceeds `max_batch_amplitudes`".format(self._dimension)
+        flat_state = state.reshape(state.shape[0], -1)
+        return flat_state.T @ flat_state.conj()
+
+    def density_probabilities(self, rho) -> np.ndarray:
+        """the position distribution of a density matrix, with shape (*lattice)"""
+        return np.real(np.diagonal(rho)).reshape(self._shape + (self._coin_dim,)).sum(axis=-1)
+
+    def evolve_density(self, n_steps, initial_states = None) -> np.ndarray:
+        """returns the density matrix after `n_steps` steps"""
+        rho = self.density_matrix(self._initial_state(initial_states, 1))
+        for step_idx in range(n_steps):
+            rho = self.density_step(rho, step_idx)
+        return rho
+
+    def exact_probabilities(self, n_steps, initial_states = None) -> np.ndarray:
+        """the position distribution after `n_steps` steps, walks without resets are evolved as a pure state"""
+        if self.is_stochastic:
+            return self.density_probabilities(self.evolve_density(n_steps, initial_states))
+        return self.probabilities(self.evolve(n_steps, initial_states))[0]
+
+    def _restart_cycle(self, position_probabilities, n_steps) -> np.ndarray:
+        """measures the position, re-prepares the coin and evolves for `n_steps`, returning the new position distribution"""
+        support = np.flatnonzero(position_probabilities)
+        positions = np.stack(np.unravel_index(support, self._shape), axis=-1)
+        weights = position_probabilities.ravel()[support]
+
+        if self.is_stochastic:
+            state = self._position_states(positions)*np.sqrt(weights).reshape((-1,) + (1,)*(len(self._shape)+1))
+            rho = self.density_matrix(state)
+            for step_idx in range(n_steps):
+                rho = self.density_step(rho, step_idx)
+            return self.density_probabilities(rho)
+
+        # without resets every restart stays pure, so the cycle is a mixture of pure evolutions
+        batch_limit = max(1, self._max_batch_amplitudes//self._dimension)
+        updated = np.zeros(self._shape)
+        for batch_start in range(0, len(support), batch_limit):
+            state = self._position_states(positions[batch_start:batch_start+batch_limit])
+            for step_idx in range(n_steps):
+                state = self.step(state, step_idx)
+            updated += np.tensordot(weights[batch_start:batch_start+batch_limit], self.probabilities(state), axes=1)
+        return updated
+
+    def _result_data(self, probabilities, shots, mode) -> dict:
+        if mode == "probabilities":
+            return {"probabilities": self.to_qiskit_order(probabilities)}
+        return {"counts": self._sample_counts(probabilities, shots)}
+
+    def run_decoherence(self, n_steps, decoherence_intervals, shots = 1024, initial_states = None, mode = "counts") -> EngineJob:
+        """
+        runs a restart decoherence experiment in a single pass, measuring the position every `decoherence_intervals` steps
+        exactly as `QuantumWalk.run_decoherence_experiment` does. Counts are sampled from the exact final distribution
+        """
+        start_time = time.perf_counter()
+        position_probabilities = self.probabilities(self._initial_state(initial_states, 1))[0]
+
+        cycle_lengths = [decoherence_intervals]*(n_steps//decoherence_intervals)
+        if n_steps % decoherence_intervals:
+            cycle_lengths.append(n_steps % decoherence_intervals)
+        for n_cycle_steps in cycle_lengths:
+            position_probabilities = self._restart_cycle(position_probabilities, n_cycle_steps)
+
+        return EngineJob(EngineResult(self._result_data(position_probabilities, shots, mode), time.perf_counter() - start_time))
+
+    def run_sweep(self, step_numbers, shots = 1024, initial_states = None) -> EngineJob:
+        start_time = time.perf_counter()
+        step_numbers = sorted(set(step_numbers))
+
+        if self.is_stochastic:
+            state = self.density_matrix(self._initial_state(initial_states, 1))
+            advance, probabilities = self.density_step, self.density_probabilities
+        else:
+            state = self._initial_state(initial_states, 1)
+            advance, probabilities = self.step, lambda state: self.probabilities(state)[0]
+
+        data = {}
+        if 0 in step_numbers:
+            data[self._walk.sweep_label(0)] = self.to_qiskit_order(probabilities(state))
+        for step_idx in range(step_numbers[-1]):
+            state = advance(state, step_idx)
+            if step_idx+1 in step_numbers:
+                data[self._walk.sweep_label(step_idx+1)] = self.to_qiskit_order(probabilities(state))
+        return EngineJob(EngineResult(data, time.perf_counter() - start_time))
+
+    def position_distribution(self, n_steps, shots = 1024, initial_states = None) -> np.ndarray:
+        """the exact position distribution after `n_steps`, `shots` is unused"""
+        return self.exact_probabilities(n_steps, initial_states)
+
+    def run(self, n_steps, shots = 1024, initial_states = None, mode = "counts") -> EngineJob:
+        """runs the walk for `n_steps`, counts are sampled from the exact distribution rather than per trajectory"""
+        start_time = time.perf_counter()
+        probabilities = self.exact_probabilities(n_steps, initial_states)
+        return EngineJob(EngineResult(self._result_data(probabilities, shots, mode), time.perf_counter() - start_time))
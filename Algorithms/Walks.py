@@ -1,27 +1,57 @@
 
 import math
-from qiskit import QuantumCircuit, QuantumRegister, transpile, assemble
+from qiskit import QuantumCircuit, QuantumRegister, ClassicalRegister, transpile, assemble
+from qiskit.circuit import ParameterVector
 from qiskit.tools.visualization import circuit_drawer
+from qiskit.providers.aer import AerSimulator
 import pandas as pd
 from DiffusionProject.Algorithms.Coins import HadamardCoin, CylicController, AbsorbingControl
 from DiffusionProject.Algorithms.Boundaries import Boundary, BoundaryControl, AbsorbingBoundaryControl, Obstruction, ControlledDirectionalBoundaryControl, UniDirectionalBoundaryControl, NonDisruptiveBoundaryControl, EfficientBoundaryControl
 
 from DiffusionProject.Backends.backend import Backend
+from DiffusionProject.Backends.transpile_cache import transpile_cache
 from DiffusionProject.Algorithms.Decoherence import CoinDecoherenceCycle
 from DiffusionProject.Algorithms.Initialisers import SymetricInitialiser
-
+from DiffusionProject.Algorithms.Engines import NumpyEngine, OperatorEngine, SparseEngine, FourierEngine, DensityMatrixEngine, EngineJob
+from DiffusionProject.Algorithms.BuildingBlocks import ripple_increment, qft_increment
+from DiffusionProject.Evaluation.CostEval import calculate_circuit_cost
+from DiffusionProject.Evaluation.CountsTable import CountsTable
+from DiffusionProject.Evaluation.DenseTensor import qiskit_order_to_dense, write_dense_tensor
+from DiffusionProject.Utils.instrumentation import instrumentation, aer_metadata
+
+import numpy as np
 from numpy import pi
 
     
 class QuantumWalk:
 
-    def __init__(self,backend: Backend ,system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class = None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None) -> None:
+    # (direction, coin bitstring, dimension) for every shift applied in `step`
+    shift_table = []
+
+    shift_syntheses = ["mct", "ripple", "qft"]
+
+    # saved probabilities below this are rounding error, e.g. from the RX(pi) layer of templates, and are not kept as counts
+    probability_cutoff = 1e-20
+
+    engines = {
+        "qiskit": None,
+        "numpy": NumpyEngine,
+        "operator": OperatorEngine,
+        "sparse": SparseEngine,
+        "fourier": FourierEngine,
+        "density": DensityMatrixEngine
+    }
+
+    def __init__(self,backend: Backend ,system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class = None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None, engine = None, shift_synthesis = None, measured_dimensions = None) -> None:
         """
         Create a new `QuantumWalk` Object
         Args:
             backend (`DiffusionProject.Algorithms.Walks.Backend`): The Qiskit backend to run the simulation on\n
             system_dimensions ([int]): a list of the number of qubits used to represent each succesive dimension. e.g for a 2qubitx3qubit system pass in [2,3]\n
-            initial_states ([str]) a list of bitsrings to represent the initial state of the system. e.g ["100","110"]. If no arguments are passed the system will start in all 0 states
+            initial_states ([str]) a list of bitsrings to represent the initial state of the system. e.g ["100","110"]. If no arguments are passed the system will start in all 0 states\n
+            engine (str): the simulation engine, one of `QuantumWalk.engines` or "auto" for "fourier" on walks without boundaries and "qiskit" otherwise. Defaults to "qiskit", which builds and simulates the full circuit\n
+            shift_synthesis (str): how the +-1 shifts are built, one of `QuantumWalk.shift_syntheses` or "auto" to pick the cheapest by `calculate_circuit_cost`. Defaults to "mct"\n
+            measured_dimensions ([int]): the dimensions whose state registers are measured, results hold the marginal distribution over them. Defaults to every dimension
 
         
         """
@@ -40,6 +70,11 @@ class QuantumWalk:
             register_name = "dimension{}".format(idx)
             self.state_registers.append(QuantumRegister(n_qubits,register_name))
 
+        if measured_dimensions is not None:
+            measured_dimensions = sorted(set(measured_dimensions))
+            assert all(0 <= dimension < self.n_system_dimensions for dimension in measured_dimensions), "measured dimensions must be between 0 and {}".format(self.n_system_dimensions-1)
+        self.measured_dimensions = measured_dimensions
+
         # initialise boundary control registers:
         self.boundary_controls = boundary_controls
         self.boundary_control_registers = []
@@ -85,11 +120,27 @@ class QuantumWalk:
 
         # initialise Quantum Registers
         self.shift_coin_register = QuantumRegister( self.n_shift_coin_bits,"coin")
+
+        # shift synthesis
+        if shift_synthesis is None:
+            shift_synthesis = "mct"
+        if shift_synthesis == "auto":
+            shift_synthesis = self.select_shift_synthesis()
+        assert shift_synthesis in self.shift_syntheses, "shift_synthesis must be 'auto' or one of {}".format(self.shift_syntheses)
+        self.shift_synthesis = shift_synthesis
+
+        # carry ancillas for the ripple incrementer, shared by every register
+        self.carry_register = None
+        if self.shift_synthesis == "ripple":
+            self.carry_register = QuantumRegister(max(self.system_dimensions), "carry")
+            self.ancilla_registers.append(self.carry_register)
         
         # self.state_register = QuantumRegister(self.n_state_bits,"state")
         # self.logic_register = QuantumRegister(self.n_logic_bits,"logic")
 
         # build quantum circuit
+        self.n_steps_applied = 0
+        self._pending_build = None
         self.build_ciruit()
 
         # initialise state
@@ -104,11 +155,42 @@ class QuantumWalk:
 
         self.initialise_coin_register()
 
+        # RX angles selecting the initial state of run time templates, one per state qubit
+        self.initial_state_parameters = ParameterVector("initial_state", sum(self.system_dimensions))
+
+        # simulation engine
+        if engine is None:
+            engine = "qiskit"
+        self.set_engine(engine)
+
         #store results
         self.results = None
 
+    def configuration_key(self) -> tuple:
+        """A hashable description of everything that determines a single step of the walk"""
+        boundary_control_keys = []
+        for boundary_control in self.boundary_controls:
+            boundary_keys = []
+            for boundary in boundary_control.boundaries:
+                if type(boundary) == Obstruction:
+                    boundary_keys.append(("Obstruction", tuple(boundary.bitstrings), tuple(boundary.dimensions)))
+                else:
+                    boundary_keys.append((type(boundary).__name__, boundary.bitstring, boundary.dimension))
+
+            ctrl_key = boundary_control.ctrl.key if boundary_control.ctrl is not None else None
+            boundary_control_keys.append((
+                type(boundary_control).__name__,
+                ctrl_key,
+                boundary_control.ctrl_state,
+                boundary_control.d_filter,
+                getattr(boundary_control, "reflect_inertia", None),
+                tuple(boundary_keys)))
+
+        return (type(self).__name__, tuple(self.system_dimensions), self.shift_coin.key, tuple(boundary_control_keys))
+
     def initialise_states(self, initial_states = None) -> None:
         """initialises the quantum circuit to the values defines in `self.initial_states`"""
+        self._n_initial_state_gates = 0
         if initial_states is not None:
             assert len(initial_states) == len(self.system_dimensions)
 
@@ -118,15 +200,32 @@ class QuantumWalk:
                 for bit_idx, bit in enumerate(initial_state[::-1]):
                     if bit != '0':
                         self.quantum_circuit.x(self.state_registers[idx][bit_idx])
+                        self._n_initial_state_gates += 1
 
     def initialise_coin_register(self):
         self._coin_initialiser.initialise(self.quantum_circuit, self.shift_coin_register)
 
+    @property
+    def quantum_circuit(self) -> QuantumCircuit:
+        """the walk's circuit, built on first access after `run_experiment` ran a template instead"""
+        if self._pending_build is not None:
+            initial_states, n_steps = self._pending_build
+            self._pending_build = None
+            self.reset_circuit(initial_states)
+            self.add_n_steps(n_steps)
+        return self._quantum_circuit
+
+    @quantum_circuit.setter
+    def quantum_circuit(self, quantum_circuit) -> None:
+        self._pending_build = None
+        self._quantum_circuit = quantum_circuit
+
     def build_ciruit(self) -> None:
         self.quantum_circuit = QuantumCircuit(self.shift_coin_register,*self.ancilla_registers,*self.boundary_control_registers,*self.state_registers)
 
     def step(self) -> None:
         """Adds one more step to the quantum walk"""
+        self.n_steps_applied += 1
         self.reset_absorption_register()
         self.update_boundary_ancillas()
 
@@ -162,7 +261,7 @@ class QuantumWalk:
                     for ancilla_idx in range(2):
                         # Dreversal gate is just mct. here we apply to the ancilla qubit
                         ancilla_activation_state = ctrl_state + str(ancilla_idx)
-                        ancilla_activator = boundary_control.x.control(n_control_bits,ctrl_state=ancilla_activation_state, label = boundary.label)
+                        ancilla_activator = boundary_control.x_control(n_control_bits,ctrl_state=ancilla_activation_state, label = boundary.label)
                         self.quantum_circuit.append(ancilla_activator,[self.shift_coin_register[-1]]+register[:]+[ancilla_register[ancilla_idx]])
                 
                 continue
@@ -175,7 +274,7 @@ class QuantumWalk:
                     n_control_bits = register.size
                     ancilla_activation_state = boundary.bitstring
                     ancilla_register = boundary_control.ancilla_register
-                    ancilla_activator = boundary_control.x.control(n_control_bits,ctrl_state=ancilla_activation_state, label = boundary.label)
+                    ancilla_activator = boundary_control.x_control(n_control_bits,ctrl_state=ancilla_activation_state, label = boundary.label)
                     self.quantum_circuit.append(ancilla_activator,register[:]+[ancilla_register[:]])
 
 
@@ -185,7 +284,7 @@ class QuantumWalk:
         # need to refactor this
         n_control_bits = 2
         ctrl_state = "11"
-        DReversalGate = self.shift_coin.DReversalGate.control(n_control_bits,ctrl_state=ctrl_state)
+        DReversalGate = self.shift_coin.d_reversal_control(n_control_bits,ctrl_state=ctrl_state)
 
         if boundary_control.d_filter:
             Inverse_coin_gate = self.shift_coin.control(1,ctrl_state="1", inverse = True)
@@ -219,7 +318,7 @@ class QuantumWalk:
         ctrl_state = "1" + boundary_control.ctrl_state
         n_control_bits = boundary_control.ctrl_size+1
 
-        DReversalGate = self.shift_coin.DReversalGate.control(n_control_bits,ctrl_state=ctrl_state)
+        DReversalGate = self.shift_coin.d_reversal_control(n_control_bits,ctrl_state=ctrl_state)
         if boundary_control.d_filter:
             Inverse_coin_gate = self.shift_coin.control(boundary_control.ctrl_size,ctrl_state=boundary_control.ctrl_state, inverse = True)
             self.quantum_circuit.append(Inverse_coin_gate,[ancilla_register[:]]+self.shift_coin_register[:])
@@ -244,7 +343,7 @@ class QuantumWalk:
                 ctrl_state = "1" + boundary_control.ctrl_state
                 n_control_bits = boundary_control.ctrl_size+1
 
-                DReversalGate = self.shift_coin.DReversalGate.control(n_control_bits,ctrl_state=ctrl_state)
+                DReversalGate = self.shift_coin.d_reversal_control(n_control_bits,ctrl_state=ctrl_state)
                     # self.quantum_circuit.append(DReversalGate,[boundary_control.register[:]]+[ancilla_register[:]]+self.shift_coin_register[:])
 
                 # do not reflect inertia if false
@@ -286,7 +385,7 @@ class QuantumWalk:
                 registers = [self.state_registers[dim] for dim in boundary.dimensions]
                 n_control_bits = sum([reg.size for reg in registers]) + boundary_control.ctrl_size
                 ctrl_state = "".join(boundary.bitstrings) + boundary_control.ctrl_state
-                DReversalGate = self.shift_coin.DReversalGate.control(n_control_bits,ctrl_state=ctrl_state, label = boundary.label)
+                DReversalGate = self.shift_coin.d_reversal_control(n_control_bits,ctrl_state=ctrl_state, label = boundary.label)
                 Inverse_coin_gate = self.shift_coin.control(n_control_bits,ctrl_state=ctrl_state, inverse = True, label = boundary.label)
 
                 state_qubits = []
@@ -309,7 +408,7 @@ class QuantumWalk:
             ctrl_state = boundary.bitstring + boundary_control.ctrl_state
 
             # construct boundary logic
-            DReversalGate = self.shift_coin.DReversalGate.control(n_control_bits,ctrl_state=ctrl_state, label = boundary.label)
+            DReversalGate = self.shift_coin.d_reversal_control(n_control_bits,ctrl_state=ctrl_state, label = boundary.label)
 
             if boundary_control.d_filter:
                 Inverse_coin_gate = self.shift_coin.control(register.size,ctrl_state=boundary.bitstring, inverse = True, label = boundary.label)
@@ -374,31 +473,68 @@ class QuantumWalk:
 
 
         
-    def add_left_shift(self,dimension):
-        """Performs the left shift (-1) operator on the target register specified by its `dimension`"""
-        register = self.state_registers[dimension]
+    @property
+    def shift_controls(self) -> list:
+        """the qubits controlling every shift: the coin and, if present, the absorption ancilla"""
+        if self.absorption_register:
+            return self.shift_coin_register[:]+self.absorption_register[:]
+        return self.shift_coin_register[:]
+
+    @staticmethod
+    def append_shift(quantum_circuit, shift_synthesis, controls, register, direction, carry_register = None):
+        """Appends a controlled -1 ("left") or +1 ("right") shift on `register` built with `shift_synthesis`"""
         n_register_bits = register.size
+
+        if shift_synthesis == "ripple":
+            carry = carry_register[:n_register_bits]
+            # x - 1 = ~(~x + 1)
+            if direction == "left":
+                quantum_circuit.x(register[:])
+            ripple_increment(quantum_circuit, controls, register[:], carry)
+            if direction == "left":
+                quantum_circuit.x(register[:])
+
+        elif shift_synthesis == "qft":
+            qft_increment(quantum_circuit, controls, register[:], -1 if direction == "left" else 1)
+
         # Apply sequential CX gates
-        for idx in range(n_register_bits):
+        elif direction == "left":
+            for idx in range(n_register_bits):
+                quantum_circuit.mct(controls+register[:idx],register[idx])
+        else:
+            for idx in range(n_register_bits)[::-1]:
+                quantum_circuit.mct(controls+register[:idx],register[idx])
+
+    def select_shift_synthesis(self, cost_dict = None) -> str:
+        """returns the shift synthesis whose shifts for a single step have the lowest `calculate_circuit_cost`"""
+        costs = {}
+        for shift_synthesis in self.shift_syntheses:
+            registers = [self.shift_coin_register] + [QuantumRegister(n_qubits) for n_qubits in self.system_dimensions]
+            controls = self.shift_coin_register[:]
             if self.absorption_register:
-                self.quantum_circuit.mct(self.shift_coin_register[:]+self.absorption_register[:]+register[:idx],register[idx])
-            else:
-                self.quantum_circuit.mct(self.shift_coin_register[:]+register[:idx],register[idx])
+                registers.append(QuantumRegister(1))
+                controls = controls + registers[-1][:]
+            carry_register = None
+            if shift_synthesis == "ripple":
+                carry_register = QuantumRegister(max(self.system_dimensions))
+                registers.append(carry_register)
 
-            
+            quantum_circuit = QuantumCircuit(*registers)
+            for direction, _, dimension in self.shift_table:
+                self.append_shift(quantum_circuit, shift_synthesis, controls, registers[1+dimension], direction, carry_register)
+            costs[shift_synthesis] = calculate_circuit_cost(quantum_circuit, cost_dict)
+
+        return min(costs, key=costs.get)
+
+    def add_left_shift(self,dimension):
+        """Performs the left shift (-1) operator on the target register specified by its `dimension`"""
+        self.append_shift(self.quantum_circuit, self.shift_synthesis, self.shift_controls, self.state_registers[dimension], "left", self.carry_register)
         # readability barrier
         self.quantum_circuit.barrier()
 
     def add_right_shift(self,dimension):
         """Performs the right shift (+1) operator on the target register specified by it's `dimension`"""
-        register = self.state_registers[dimension]
-        n_register_bits = register.size
-        # Apply sequential CX gates
-        for idx in range(n_register_bits)[::-1]:
-            if self.absorption_register:
-                self.quantum_circuit.mct(self.shift_coin_register[:]+self.absorption_register[:]+register[:idx],register[idx])
-            else:
-                self.quantum_circuit.mct(self.shift_coin_register[:]+register[:idx],register[idx])
+        self.append_shift(self.quantum_circuit, self.shift_synthesis, self.shift_controls, self.state_registers[dimension], "right", self.carry_register)
         # readability barrier
         self.quantum_circuit.barrier()
 
@@ -418,13 +554,25 @@ class QuantumWalk:
 
         self.quantum_circuit.barrier()
 
-    def get_state_register_indices(self)-> list:
-        """Returns a list of dictionaries decsribing the start and end qubits of each state register"""
+    def add_shifts(self):
+        """Adds every shift in `shift_table` to the quantum walk"""
+        shift_operators = {
+            "left": self.add_left_shift,
+            "right": self.add_right_shift
+        }
+        for direction, coin_bitstring, dimension in self.shift_table:
+            self.wrap_shift(operator = shift_operators[direction],coin_bitstring = coin_bitstring,dimension=dimension)
+
+    def get_state_register_indices(self, dimensions = None)-> list:
+        """Returns a list of dictionaries decsribing the start and end bits of each state register in a bitstring over `dimensions` (every dimension by default)"""
         indices = []
         last_idx = 0
+        if dimensions is None:
+            dimensions = list(range(self.n_system_dimensions))
 
-        for idx, dimension_len in reversed(list(enumerate (self.system_dimensions))):
-            dimension_start_idx = sum(self.system_dimensions[idx+1:])
+        for position, idx in reversed(list(enumerate(dimensions))):
+            dimension_len = self.system_dimensions[idx]
+            dimension_start_idx = sum(self.system_dimensions[dimension] for dimension in dimensions[position+1:])
             dimension_end_idx = dimension_start_idx + dimension_len - 1
             indices.append({
                 "dimension" : idx,
@@ -435,8 +583,48 @@ class QuantumWalk:
 
         return indices, last_idx
 
+    @property
+    def measured_dimension_indices(self) -> list:
+        """the dimensions whose state registers are measured, in ascending order"""
+        if self.measured_dimensions is None:
+            return list(range(self.n_system_dimensions))
+        return self.measured_dimensions
+
+    @property
+    def measured_qubits(self) -> list:
+        """the qubits of the measured state registers, in dimension order"""
+        return [qubit for idx in self.measured_dimension_indices for qubit in self.state_registers[idx]]
+
+    def measure_state_registers(self, quantum_circuit) -> None:
+        """measures the measured state registers of `quantum_circuit` into a single classical register, counts are keyed by the state bits alone"""
+        measured_qubits = self.measured_qubits
+        classical_register = ClassicalRegister(len(measured_qubits), "state")
+        quantum_circuit.add_register(classical_register)
+        quantum_circuit.measure(measured_qubits, classical_register)
+
+    def _table_registers(self, n_bits) -> tuple:
+        """the register sizes and dimensions of counts over `n_bits` state bits, either every dimension or the measured ones"""
+        if n_bits == sum(self.system_dimensions):
+            return self.system_dimensions, list(range(self.n_system_dimensions))
+        dimensions = self.measured_dimension_indices
+        return [self.system_dimensions[dimension] for dimension in dimensions], dimensions
+
+    def counts_to_table(self, counts) -> CountsTable:
+        """converts a qiskit counts dictionary over the state registers into a `CountsTable`, tables are returned unchanged"""
+        if isinstance(counts, CountsTable):
+            return counts
+        n_bits = len(next(iter(counts)).replace(" ", "")) if counts else sum(self.system_dimensions)
+        return CountsTable.from_dict(counts, *self._table_registers(n_bits))
+
+    def marginalise_counts(self, counts) -> CountsTable:
+        """
+        sums `counts` over the full state onto the `measured_dimensions`, as native engines always return the full state.
+        Counts already over the measured dimensions are returned unchanged
+        """
+        return self.counts_to_table(counts).marginalise(self.measured_dimension_indices)
+
     def discard_non_state_bits(self,counts : dict, inplace = False) -> dict:
-        """discards the non state bits from a sim run and recreates the `counts` dictionary"""
+        """discards the non state bits from counts over every qubit (e.g from `measure_all`) and recreates the `counts` dictionary"""
         _ , last_state_idx = self.get_state_register_indices()
         
         counts_new = {}
@@ -463,121 +651,396 @@ class QuantumWalk:
         return self.get_results(job, return_elapsed_time)
 
     def process_counts(self,counts,shots):
-        """Processes raw count data from qiskit into data relating to physical space"""
-        state_register_indices, _ = self.get_state_register_indices()
-        displacement_tensors = {}
-        for idx in range(self.n_system_dimensions):
-            displacement_tensors["dimension_{}".format(idx)] = []
-        
-        displacement_tensors["probability_density"] = []
-        for key, value in counts.items():
-            for dimension_params in state_register_indices:
-                dimensional_displacement = int(key[dimension_params['start_idx']:1+dimension_params['end_idx']], 2)
-                displacement_tensors["dimension_{}".format(dimension_params["dimension"])].append(dimensional_displacement)
+        """Processes raw count data from qiskit (a dictionary or `CountsTable`) into data relating to physical space, with a column for each measured dimension"""
+        displacement_tensors = self.marginalise_counts(counts).to_displacement_tensors(shots)
+        self.results = displacement_tensors
+        return displacement_tensors
 
-            displacement_tensors["probability_density"].append(1.0*value/shots)
+    def probabilities_to_counts(self, probabilities) -> CountsTable:
+        """converts saved probabilities over the state registers into a `CountsTable` over a single shot"""
+        n_state_bits = len(probabilities).bit_length() - 1
+        return CountsTable.from_probabilities(probabilities, *self._table_registers(n_state_bits), cutoff = self.probability_cutoff)
 
+    def get_state_counts(self, results, experiment = 0) -> tuple:
+        """
+        returns the state register counts and total number of shots of a Qiskit result.
+        Exact probabilities (from `mode = "probabilities"`) are returned as counts over a single shot
+        """
+        probabilities = results.data(experiment).get("probabilities")
+        if probabilities is not None:
+            return self.marginalise_counts(self.probabilities_to_counts(probabilities)), 1
 
-        self.results = displacement_tensors
-        return displacement_tensors
+        counts = self.marginalise_counts(results.get_counts(experiment))
+        return counts, counts.total
 
     def get_results(self,job, return_elapsed_time = False) -> dict:
         """processes results from a Qiskit job"""
 
-        results = job.result()
-        counts = results.get_counts()
-        counts = self.discard_non_state_bits(counts, False)
-        shots = results.results[0].shots
-        displacement_tensors = self.process_counts(counts=counts, shots=shots)
+        results = self._job_result(job)
+        with instrumentation.span("post_process"):
+            counts, shots = self.get_state_counts(results)
+            displacement_tensors = self.process_counts(counts=counts, shots=shots)
         return (displacement_tensors, results.time_taken) if return_elapsed_time else displacement_tensors
 
-    def run_experiment(self,n_steps,shots = 1024, initial_states = None):
-        """runs a quantum walk of `n_steps` """
-        # reset_circuit
-        self.reset_circuit(initial_states)
+    @staticmethod
+    def _job_result(job):
+        """waits for the result of a simulator `job` in a "run" span holding the simulator metadata"""
+        # native engines compute their results before returning the job, in a span of their own
+        if isinstance(job, EngineJob):
+            return job.result()
+        with instrumentation.span("run") as span:
+            results = job.result()
+            span.set(**aer_metadata(results))
+        return results
+
+    @property
+    def is_translation_invariant(self) -> bool:
+        """True if every step is the same on every site: the walk has no boundary controls and no coin decoherence"""
+        return not self.boundary_controls and self.coin_decoherence_cycle is None
+
+    def set_engine(self, engine) -> None:
+        """switches the simulation engine to `engine`, one of `QuantumWalk.engines` or "auto" for the momentum space fast path when the walk is translation invariant"""
+        if engine == "auto":
+            engine = "fourier" if self.is_translation_invariant else "qiskit"
+        assert engine in self.engines, "engine must be one of {}".format(list(self.engines.keys()))
+        self.engine = engine
+        self._native_engine = None
+
+    @property
+    def native_engine(self):
+        """The native engine selected by `self.engine`, or None if the walk is simulated as a circuit"""
+        engine_class = self.engines[self.engine]
+        if engine_class is None:
+            return None
+        if self._native_engine is None:
+            self._native_engine = engine_class(self)
+        return self._native_engine
+
+    def run_experiment(self,n_steps,shots = 1024, initial_states = None, mode = "counts"):
+        """
+        runs a quantum walk of `n_steps`
+        Args:
+            mode (str): "counts" to sample `shots` measurements, or "probabilities" to return the exact distribution over the state registers
+        """
+        assert mode in ["counts", "probabilities"], "mode must be 'counts' or 'probabilities'"
 
-        # add n_steps
-        self.add_n_steps(n_steps=n_steps)
+        # native engines never build the circuit
+        if self.native_engine is not None:
+            with instrumentation.span("run", engine=self.engine, n_steps=n_steps, mode=mode):
+                return self.native_engine.run(n_steps, shots=shots, initial_states=initial_states, mode=mode)
 
         # if on IBM submit job
         if self.backend.is_on_IBM:
+            assert mode == "counts", "exact probabilities are only available on local simulators"
+            self.reset_circuit(initial_states)
+            self.add_n_steps(n_steps=n_steps)
             return self._submit_job_on_IBM(shots)
 
-        return self.run_job_locally(shots)
+        # local simulators bind the initial states into a shared template, `quantum_circuit` is only built if accessed
+        if initial_states is None:
+            initial_states = self.initial_states
+        job = self.run_template([initial_states], n_steps, shots, mode)
+        self._pending_build = (initial_states, n_steps)
+        return job
+
+    def run_dense(self, n_steps, path = None, shots = 1024, initial_states = None) -> np.ndarray:
+        """
+        runs a walk of `n_steps` and returns the probability distribution over the measured dimensions as a dense float32 tensor
+        indexed [dimension_0, dimension_1, ...], written to and memory-mapped from the `.npy` file `path` if passed.
+        Native engines write their distribution directly, circuits save the exact probabilities of a local simulation
+        """
+        if self.native_engine is not None:
+            with instrumentation.span("run", engine=self.engine, n_steps=n_steps, mode="dense"):
+                if self.measured_dimensions is None:
+                    return self.native_engine.run_dense(n_steps, path, shots, initial_states)
+                distribution = self.native_engine.position_distribution(n_steps, shots, initial_states)
+            unmeasured_axes = tuple(axis for axis in range(self.n_system_dimensions) if axis not in self.measured_dimension_indices)
+            with instrumentation.span("write", path_written=path):
+                return write_dense_tensor(distribution.sum(axis = unmeasured_axes), path)
+
+        assert not self.backend.is_on_IBM, "dense tensors are built from exact probabilities and are only available on local simulators"
+        probabilities = self._job_result(self.run_experiment(n_steps, shots, initial_states, mode = "probabilities")).data(0)["probabilities"]
+        register_sizes = [self.system_dimensions[dimension] for dimension in self.measured_dimension_indices]
+        with instrumentation.span("write", path_written=path):
+            return write_dense_tensor(qiskit_order_to_dense(probabilities, register_sizes), path)
 
     @staticmethod
     def merge_counts(total_counts, counts_appendage):
-        """Merge two count dictionaries"""
+        """Merge two count dictionaries, `CountsTable.merge` merges tables"""
  
         for bitstring, n_shots in counts_appendage.items():
             if total_counts.get(bitstring) is None:
                 total_counts[bitstring] = 0
             total_counts[bitstring]+=n_shots
 
-    def run_decoherence_experiment(self,n_steps: int,decoherence_intervals: int, shots=1024,initial_states = None, return_elapsed_time=False):
-        """Runs a decoherence experiment"""
-        state_register_indices, _ = self.get_state_register_indices()
+    def _run_decoherence_cycle_batched(self, restarts, n_steps, mode, max_parallel_experiments = 1):
+        """
+        runs every restart of a decoherence cycle as one job on a local simulator, binding each restart into the same template.
+        Returns the state counts of each restart and the simulator time
+        """
+        initial_states_list = [initial_states for initial_states, _ in restarts]
+        shots = [n_shots for _, n_shots in restarts]
+        results = self._job_result(self.run_template(initial_states_list, n_steps, shots, mode, max_parallel_experiments))
+
+        with instrumentation.span("post_process"):
+            restart_counts = [self.get_state_counts(results, experiment_idx)[0] for experiment_idx in range(len(restarts))]
+        return restart_counts, results.time_taken
+
+    def _run_decoherence_cycle(self, counts, n_steps, shots, mode, max_parallel_experiments = 1, batch_size = None):
+        """restarts the walk from every position in the `CountsTable` `counts` for `n_steps`, returning the merged counts and the simulator time"""
+        dimension_bitstrings = [counts.bitstrings(dimension) for dimension in range(self.n_system_dimensions)]
+        restart_shots = counts.counts.tolist() if mode == "probabilities" else [int(n_shots) for n_shots in counts.counts.tolist()]
+        restarts = [(list(initial_states), n_shots) for initial_states, n_shots in zip(zip(*dimension_bitstrings), restart_shots)]
 
+        restart_tables = []
+        total_time = 0
+        batch_size = batch_size if batch_size else len(restarts)
+        for batch_start in range(0, len(restarts), batch_size):
+            batch = restarts[batch_start:batch_start+batch_size]
+
+            if self.native_engine is None and not self.backend.is_on_IBM:
+                batch_counts, time_taken = self._run_decoherence_cycle_batched(batch, n_steps, mode, max_parallel_experiments)
+                total_time += time_taken
+            else:
+                batch_counts = []
+                for initial_states, n_shots in batch:
+                    results = self._job_result(self.run_experiment(n_steps = n_steps, shots=n_shots if mode == "counts" else shots, initial_states=initial_states, mode=mode))
+                    batch_counts.append(self.get_state_counts(results)[0])
+                    total_time += results.time_taken
+
+            for (_, n_shots), counts_appendage in zip(batch, batch_counts):
+                if mode == "probabilities":
+                    counts_appendage = counts_appendage.scale(n_shots)
+                restart_tables.append(counts_appendage)
+
+        return CountsTable.concatenate(restart_tables), total_time
+
+    def run_decoherence_experiment(self,n_steps: int,decoherence_intervals: int, shots=1024,initial_states = None, return_elapsed_time=False, mode = "counts", max_parallel_experiments = 1, batch_size = None):
+        """
+        Runs a decoherence experiment, in "probabilities" `mode` each restart is weighted by its exact probability.
+        On local simulators the restarts of each cycle are submitted together in batches of `batch_size` circuits (all at once by default),
+        with at most `max_parallel_experiments` simulated concurrently.
+        Engines with `exact_decoherence` apply the restarts as a channel and run in a single pass
+        """
+        assert self.measured_dimensions is None, "decoherence restarts need the position in every dimension, so every dimension must be measured"
+        if self.native_engine is not None and self.native_engine.exact_decoherence:
+            with instrumentation.span("run", engine=self.engine, n_steps=n_steps, mode=mode, decoherence_intervals=decoherence_intervals):
+                results = self.native_engine.run_decoherence(n_steps, decoherence_intervals, shots=shots, initial_states=initial_states, mode=mode).result()
+            with instrumentation.span("post_process"):
+                counts, n_shots = self.get_state_counts(results)
+                displacement_tensors = self.process_counts(counts=counts, shots=n_shots)
+            return (displacement_tensors, results.time_taken) if return_elapsed_time else displacement_tensors
         n_full_cycles = n_steps//decoherence_intervals
         remainder_steps = n_steps%decoherence_intervals
 
         # initialise counts to n_shots at initial position
-        counts = self.run_experiment(n_steps=0,shots=shots,initial_states=initial_states).result().get_counts()
-        counts = self.discard_non_state_bits(counts, False)
+        counts, _ = self.get_state_counts(self._job_result(self.run_experiment(n_steps=0,shots=shots,initial_states=initial_states, mode=mode)))
 
         total_time = 0
         # full cycles
         for cycle in range(n_full_cycles):
-            total_counts = {}
             print(f"decohenerence cycle {cycle+1}")
-            for bitstring, n_shots in counts.items():
-                initial_states = []
-                for dimension_params in state_register_indices:
-                        initial_states.append(bitstring[dimension_params['start_idx']:1+dimension_params['end_idx']])
-                job = self.run_experiment(n_steps = decoherence_intervals, shots=n_shots, initial_states=initial_states)
-                results = job.result()
-                counts_appendage = results.get_counts()
-                counts_appendage = self.discard_non_state_bits(counts_appendage, False)
-                self.merge_counts(total_counts=total_counts,counts_appendage=counts_appendage)
-                total_time+=results.time_taken
-
-            counts = total_counts
-
+            with instrumentation.span("decoherence_cycle", cycle=cycle+1, n_steps=decoherence_intervals, n_restarts=len(counts)):
+                counts, cycle_time = self._run_decoherence_cycle(counts, decoherence_intervals, shots, mode, max_parallel_experiments, batch_size)
+            total_time += cycle_time
 
         # remainder cyle
         if remainder_steps:
             print(f"decohenerence cycle {n_full_cycles+1}")
-            total_counts = {}
-            for bitstring, n_shots in counts.items():
-                initial_states = []
-                for dimension_params in state_register_indices:
-                        initial_states.append(bitstring[dimension_params['start_idx']:1+dimension_params['end_idx']])
-                job = self.run_experiment(n_steps = remainder_steps, shots=n_shots, initial_states=initial_states)
-                results = job.result()
-                counts_appendage = results.get_counts()
-                counts_appendage = self.discard_non_state_bits(counts_appendage, False)
-                self.merge_counts(total_counts=total_counts,counts_appendage=counts_appendage)
-                total_time+=results.time_taken
-
-            counts = total_counts
-
-        displacement_tensors = self.process_counts(counts=counts, shots=shots)
+            with instrumentation.span("decoherence_cycle", cycle=n_full_cycles+1, n_steps=remainder_steps, n_restarts=len(counts)):
+                counts, cycle_time = self._run_decoherence_cycle(counts, remainder_steps, shots, mode, max_parallel_experiments, batch_size)
+            total_time += cycle_time
+
+        with instrumentation.span("post_process"):
+            displacement_tensors = self.process_counts(counts=counts, shots=counts.total)
         return (displacement_tensors, total_time) if return_elapsed_time else displacement_tensors
 
-    def run_job_locally(self, shots = 1024):
+    def run_job_locally(self, shots = 1024, mode = "counts"):
         """Runs a simulation of the quantum circuit for the number of shits specified by `shots`"""
+        if mode == "probabilities":
+            return self._run_probabilities_job_locally()
+
         quantum_circuit_copy = self.quantum_circuit.copy()
-        quantum_circuit_copy.measure_all()
-        transpiled_circuit = transpile(quantum_circuit_copy, self.backend.backend)
+        self.measure_state_registers(quantum_circuit_copy)
+        transpiled_circuit = self._transpile(quantum_circuit_copy, "counts")
         qobj = assemble(transpiled_circuit,shots = shots)
         job = self.backend.backend.run(qobj)
         return job
 
+    def circuit_key(self, purpose, basis_gates = None, n_steps = None) -> tuple:
+        """A hashable description of the circuit built from `n_steps` (by default `n_steps_applied`) steps, excluding the initial states"""
+        if n_steps is None:
+            n_steps = self.n_steps_applied
+        boundary_resets = tuple(boundary_control.n_resets for boundary_control in self.boundary_controls)
+        initialiser_key = (type(self._coin_initialiser).__name__, tuple(sorted(vars(self._coin_initialiser).items())))
+        decoherence_key = None
+        if self.coin_decoherence_cycle is not None:
+            decoherence_key = (self.coin_decoherence_cycle.cycle_length, tuple(self.coin_decoherence_cycle.target_qubits))
+        basis_key = tuple(basis_gates) if basis_gates is not None else None
+        measured_key = tuple(self.measured_dimension_indices)
+        return (self.configuration_key(), boundary_resets, self.shift_synthesis, initialiser_key, decoherence_key,
+            n_steps, purpose, measured_key, self.backend.backend.name(), basis_key)
+
+    def _split_initial_states(self, quantum_circuit) -> tuple:
+        """separates the X gates `initialise_states` places at the start of `quantum_circuit`, returning the rest of the circuit and the flipped qubit indices"""
+        n_gates = self._n_initial_state_gates
+        flipped_qubits = [quantum_circuit.find_bit(instruction.qubits[0]).index for instruction in quantum_circuit.data[:n_gates]]
+        body = quantum_circuit.copy()
+        body.data = quantum_circuit.data[n_gates:]
+        return body, flipped_qubits
+
+    def _transpile(self, quantum_circuit, purpose, basis_gates = None):
+        """
+        transpiles `quantum_circuit` through `transpile_cache`, so circuits with the same structure are transpiled once.
+        The initial states are applied after transpilation, state qubits are never reset so the transpiler cannot depend on them
+        """
+        body, flipped_qubits = self._split_initial_states(quantum_circuit)
+        transpile_function = lambda circuit: transpile(circuit, self.backend.backend, basis_gates = basis_gates)
+        return transpile_cache.get(self.circuit_key(purpose, basis_gates), body, transpile_function, flipped_qubits)
+
+    def build_template(self, n_steps, mode = "counts") -> QuantumCircuit:
+        """
+        builds the walk of `n_steps` with an RX layer on the state qubits in place of `initialise_states`, so that the initial
+        state is bound at run time with `initial_state_binding`. `quantum_circuit` is left unchanged
+        """
+        saved_circuit, saved_n_steps, saved_pending_build = self._quantum_circuit, self.n_steps_applied, self._pending_build
+
+        with instrumentation.span("build", n_steps=n_steps, mode=mode) as span:
+            self.build_ciruit()
+            self.n_steps_applied = 0
+            for qubit, parameter in zip(self.state_qubits, self.initial_state_parameters):
+                self.quantum_circuit.rx(parameter, qubit)
+            self.initialise_coin_register()
+            self.add_n_steps(n_steps)
+            template = self.quantum_circuit
+
+            self._quantum_circuit, self.n_steps_applied, self._pending_build = saved_circuit, saved_n_steps, saved_pending_build
+
+            if mode == "probabilities":
+                template.save_probabilities(self.measured_qubits)
+            else:
+                self.measure_state_registers(template)
+            span.set(n_qubits=template.num_qubits, size=template.size())
+        return template
+
+    def initial_state_binding(self, initial_states = None) -> list:
+        """the template RX angles preparing `initial_states`, pi on every set bit"""
+        if initial_states is None:
+            return [0.0]*len(self.initial_state_parameters)
+
+        assert len(initial_states) == len(self.system_dimensions)
+        angles = []
+        for idx, n_qubits in enumerate(self.system_dimensions):
+            initial_state = initial_states[idx]
+            assert len(initial_state) == n_qubits
+            angles.extend(pi if bit != '0' else 0.0 for bit in initial_state[::-1])
+        return angles
+
+    def get_template(self, n_steps, mode = "counts") -> QuantumCircuit:
+        """returns the transpiled template of `n_steps` steps, only building it on a `transpile_cache` miss"""
+        key = self.circuit_key(("template", mode), n_steps = n_steps)
+        template, basis_gates = None, None
+        if key not in transpile_cache:
+            template = self.build_template(n_steps, mode)
+            if mode == "probabilities":
+                _, basis_gates = self._exact_simulation_method(template)
+        transpile_function = lambda circuit: transpile(circuit, self.backend.backend, basis_gates = basis_gates)
+        return transpile_cache.get(key, template, transpile_function)
+
+    def run_template(self, initial_states_list, n_steps, shots = 1024, mode = "counts", max_parallel_experiments = 1):
+        """
+        runs the walk of `n_steps` from every initial state in `initial_states_list` in a single `backend.run`, binding each
+        into one transpiled template. `shots` is shared by every initial state or is a list with the shots of each.
+        Experiment i of the results belongs to `initial_states_list[i]`
+        """
+        template = self.get_template(n_steps, mode)
+        bindings = [self.initial_state_binding(initial_states) for initial_states in initial_states_list]
+        # a cached template may have been built by another walk, so its parameters are looked up by name
+        template_parameters = {parameter.name: parameter for parameter in template.parameters}
+        parameters = [template_parameters[parameter.name] for parameter in self.initial_state_parameters]
+
+        if mode == "probabilities":
+            # the simulator binds every parameter set itself
+            method, _ = self._exact_simulation_method(template)
+            parameter_binds = [{parameter: [binding[idx] for binding in bindings] for idx, parameter in enumerate(parameters)}]
+            return self.backend.backend.run(template, shots = 1, method = method, parameter_binds = parameter_binds, max_parallel_experiments = max_parallel_experiments)
+
+        shots = shots if type(shots) == list else [shots]*len(bindings)
+        parameter_binds = [dict(zip(parameters, binding)) for binding in bindings]
+        qobj = assemble(template, shots = max(shots), parameter_binds = parameter_binds, max_parallel_experiments = max_parallel_experiments)
+        # every initial state keeps its own number of shots
+        for experiment, n_shots in zip(qobj.experiments, shots):
+            experiment.config.shots = n_shots
+        return self.backend.backend.run(qobj)
+
+    @property
+    def state_qubits(self) -> list:
+        """the qubits of every state register, in dimension order"""
+        return [qubit for register in self.state_registers for qubit in register]
+
+    def _exact_simulation_method(self, quantum_circuit) -> tuple:
+        """returns the Aer method and basis gates which give exact saved probabilities for `quantum_circuit`"""
+        # resets and noise make the state mixed, so only a density matrix gives exact probabilities.
+        # A single statevector shot of a noisy circuit is one random noise trajectory
+        has_resets = any(instruction.operation.name == "reset" for instruction in quantum_circuit.data)
+        if has_resets or self.backend.has_noise_model:
+            return "density_matrix", AerSimulator(method = "density_matrix").configuration().basis_gates
+        return "statevector", None
+
+    def _run_saved_probabilities(self, quantum_circuit, purpose = "probabilities"):
+        """Runs a circuit containing probability save instructions exactly, in a single execution"""
+        method, basis_gates = self._exact_simulation_method(quantum_circuit)
+        transpiled_circuit = self._transpile(quantum_circuit, purpose, basis_gates)
+        job = self.backend.backend.run(transpiled_circuit, shots = 1, method = method)
+        return job
+
+    def _run_probabilities_job_locally(self):
+        """Saves the exact probability distribution over the state registers instead of sampling shots"""
+        quantum_circuit_copy = self.quantum_circuit.copy()
+        quantum_circuit_copy.save_probabilities(self.measured_qubits)
+        return self._run_saved_probabilities(quantum_circuit_copy)
+
+    @staticmethod
+    def sweep_label(n_steps) -> str:
+        """the save instruction label holding the distribution after `n_steps`"""
+        return "step_{}".format(n_steps)
+
+    def run_sweep(self, step_numbers: list, shots = 1024, initial_states = None) -> dict:
+        """
+        runs the walk once up to the largest of `step_numbers`, saving the exact probability distribution after each of them.
+        Returns a dictionary mapping each step number to its processed results
+        """
+        assert not self.backend.is_on_IBM, "sweeps use simulator save instructions and can only run locally"
+        step_numbers = sorted(set(step_numbers))
+
+        if self.native_engine is not None:
+            with instrumentation.span("run", engine=self.engine, step_numbers=step_numbers):
+                job = self.native_engine.run_sweep(step_numbers, shots=shots, initial_states=initial_states)
+        else:
+            with instrumentation.span("build", step_numbers=step_numbers):
+                self.reset_circuit(initial_states)
+                if 0 in step_numbers:
+                    self.quantum_circuit.save_probabilities(self.measured_qubits, label=self.sweep_label(0))
+                for step_idx in range(step_numbers[-1]):
+                    self.step()
+                    self.decohere_coin(step_idx)
+                    if step_idx+1 in step_numbers:
+                        self.quantum_circuit.save_probabilities(self.measured_qubits, label=self.sweep_label(step_idx+1))
+            job = self._run_saved_probabilities(self.quantum_circuit, ("sweep", tuple(step_numbers)))
+
+        data = self._job_result(job).data(0)
+        sweep_results = {}
+        with instrumentation.span("post_process", step_numbers=step_numbers):
+            for n_steps in step_numbers:
+                counts = self.marginalise_counts(self.probabilities_to_counts(data[self.sweep_label(n_steps)]))
+                sweep_results[n_steps] = self.process_counts(counts=counts, shots=1)
+        return sweep_results
+
     def _submit_job_on_IBM(self, shots = 1024):
         """Runs a simulation of the quantum circuit for the number of shits specified by `shots` on IBM hardware"""
         quantum_circuit_copy = self.quantum_circuit.copy()
-        quantum_circuit_copy.measure_all()
-        transpiled_circuit = transpile(quantum_circuit_copy, self.backend.backend)
+        self.measure_state_registers(quantum_circuit_copy)
+        transpiled_circuit = self._transpile(quantum_circuit_copy, "counts")
         qobj = assemble(transpiled_circuit,backend = self.backend.backend, shots = shots)
         job = self.backend.backend.run(qobj)
         print("JOB_ID: {}".format(job.job_id()))
@@ -601,7 +1064,7 @@ class QuantumWalk:
     def draw_debug(self,savepath):
         self.reset_circuit()
         self.step()
-        self.quantum_circuit.measure_all()
+        self.measure_state_registers(self.quantum_circuit)
         self.draw_circuit(savepath)
         self.reset_circuit()
       
@@ -610,6 +1073,7 @@ class QuantumWalk:
         """clears the circuit and initialises to its initial states"""
         if initial_states is None:
             initial_states = self.initial_states
+        self.n_steps_applied = 0
         self.build_ciruit()
         self.initialise_states(initial_states)
         self.initialise_coin_register()
@@ -640,54 +1104,62 @@ class QuantumWalk:
         
 
 class QuantumWalk3D(QuantumWalk):
-    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None) -> None:
+    shift_table = [
+        ("left", "100", 0),
+        ("right", "000", 0),
+        ("left", "101", 1),
+        ("right", "001", 1),
+        ("left", "110", 2),
+        ("right", "010", 2)
+    ]
+
+    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None, engine = None, shift_synthesis = None, measured_dimensions = None) -> None:
         assert len(system_dimensions) == 3
-        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser)
+        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser, engine, shift_synthesis, measured_dimensions)
 
     def step(self) -> None:
         super().step()
         self.add_coins()
         for boundary in self.boundary_controls:
             self.apply_boundary(boundary)
-        # dimension 0
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "100",dimension=0)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "000",dimension=0)
-        # dimension 1
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "101",dimension=1)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "001",dimension=1)
-        # dimension 2
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "110",dimension=2)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "010",dimension=2)
+        self.add_shifts()
         self.apply_post_shift_operations()
         self.reset_boundaries()
 
 class QuantumWalk2D(QuantumWalk):
-    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None) -> None:
+    shift_table = [
+        ("left", "10", 0),
+        ("right", "00", 0),
+        ("left", "11", 1),
+        ("right", "01", 1)
+    ]
+
+    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None, engine = None, shift_synthesis = None, measured_dimensions = None) -> None:
         assert len(system_dimensions) == 2
-        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser)
+        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser, engine, shift_synthesis, measured_dimensions)
 
     def step(self) -> None:
         super().step()
         self.add_coins()
         for boundary in self.boundary_controls:
             self.apply_boundary(boundary)
-        # dimension 0
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "10",dimension=0)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "00",dimension=0)
-        # dimension 1
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "11",dimension=1)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "01",dimension=1)
+        self.add_shifts()
         self.apply_post_shift_operations()
         self.reset_boundaries()
 
 
 class QuantumWalk1D(QuantumWalk):
-    def __init__(self,backend: Backend, system_dimensions: int, initial_states: str = None, n_shift_coin_bits: int = None, coin_class=None ,coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None) -> None:
+    shift_table = [
+        ("left", "1", 0),
+        ("right", "0", 0)
+    ]
+
+    def __init__(self,backend: Backend, system_dimensions: int, initial_states: str = None, n_shift_coin_bits: int = None, coin_class=None ,coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None, engine = None, shift_synthesis = None, measured_dimensions = None) -> None:
         if type(system_dimensions) == int:
             system_dimensions = [system_dimensions]
         if initial_states is not None and type(initial_states) == str:
             initial_states = [initial_states]
-        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser)
+        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser, engine, shift_synthesis, measured_dimensions)
 
 
     def step(self) -> None:
@@ -695,32 +1167,31 @@ class QuantumWalk1D(QuantumWalk):
         self.add_coins()
         for boundary in self.boundary_controls:
             self.apply_boundary(boundary)
-        # dimension 0
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "1",dimension=0)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "0",dimension=0)
+        self.add_shifts()
         self.apply_post_shift_operations()
         self.reset_boundaries()
 
 class QuantumWalk2DIndependant(QuantumWalk):
-
-    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None) -> None:
+    shift_table = [
+        ("left", "10", 0),
+        ("left", "11", 0),
+        ("right", "01", 0),
+        ("right", "00", 0),
+        ("left", "00", 1),
+        ("left", "10", 1),
+        ("right", "11", 1),
+        ("right", "01", 1)
+    ]
+
+    def __init__(self,backend: Backend, system_dimensions: list, initial_states: list = None, n_shift_coin_bits: int = None, coin_class=None, coin_kwargs = {}, boundary_controls = [], coin_decoherence_cycle: CoinDecoherenceCycle = None, coin_initialiser = None, engine = None, shift_synthesis = None, measured_dimensions = None) -> None:
         assert len(system_dimensions) == 2
-        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser)
+        super().__init__(backend,system_dimensions, initial_states, n_shift_coin_bits, coin_class, coin_kwargs, boundary_controls, coin_decoherence_cycle, coin_initialiser, engine, shift_synthesis, measured_dimensions)
 
     def step(self) -> None:
         super().step()
         self.add_coins()
         for boundary in self.boundary_controls:
             self.apply_boundary(boundary)
-        # dimension 0
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "10",dimension=0)
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "11",dimension=0)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "01",dimension=0)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "00",dimension=0)
-        # dimension 1
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "00",dimension=1)
-        self.wrap_shift(operator = self.add_left_shift,coin_bitstring = "10",dimension=1)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "11",dimension=1)
-        self.wrap_shift(operator = self.add_right_shift,coin_bitstring = "01",dimension=1)
+        self.add_shifts()
         self.apply_post_shift_operations()
         self.reset_boundaries()
\ No newline at end of file
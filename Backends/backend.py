@@ -1,16 +1,25 @@
 
 from qiskit import Aer
 from qiskit.providers.aer import AerError, AerSimulator
-from qiskit import IBMQ
+from DiffusionProject.Backends.execution_profiles import aer_options
 
 
 
 class Backend:
     """wrapper for Qiskit backend """
-    def __init__(self,use_GPU = False, IBMQ_device_name = None, backend = None) -> None:
+    def __init__(self,use_GPU = False, IBMQ_device_name = None, backend = None, execution_profile = None) -> None:
+        """
+        Args:
+            use_GPU (bool): simulate on a GPU if Aer supports one\n
+            IBMQ_device_name (str): run on this IBM device instead of a local simulator\n
+            backend: a device whose noise model and coupling map are simulated, an ideal simulator if not set\n
+            execution_profile (dict): Aer options of local simulators, see `DiffusionProject.Backends.execution_profiles.profile_options`
+        """
 
+        self.__execution_profile = {}
         if IBMQ_device_name:
-          
+            # the IBMQ provider is slow to import and only needed for jobs on IBM devices
+            from qiskit import IBMQ
             IBMQ.load_account()
             self.__provider  = IBMQ.get_provider(hub='ibm-q')
             self.__backend = self.__provider.get_backend(IBMQ_device_name)
@@ -31,6 +40,9 @@ class Backend:
                     self.__device = "GPU"
                 except AerError as e:
                     print(e)
+            if execution_profile:
+                self.__execution_profile = aer_options(execution_profile)
+                self.__backend.set_options(**self.__execution_profile)
 
         print("running on device: {}".format(self.__device))
         print("Backend: {}".format(self.__backend.name()))
@@ -45,4 +57,14 @@ class Backend:
 
     @property
     def is_on_IBM(self):
-        return self.__is_on_IBM
\ No newline at end of file
+        return self.__is_on_IBM
+
+    @property
+    def execution_profile(self) -> dict:
+        """the Aer options set by the execution profile, recorded on the spans of every experiment"""
+        return self.__execution_profile
+
+    @property
+    def has_noise_model(self) -> bool:
+        """True if the local simulator applies the noise model of a device"""
+        return not self.__is_on_IBM and getattr(self.__backend.options, "noise_model", None) is not None
\ No newline at end of file
@@ -0,0 +1,87 @@
+import os
+import json
+from datetime import datetime
+
+# `JobParams.ExecutionProfile` keys and the Aer simulator options they set
+profile_options = {
+    "Method": "method",
+    "Precision": "precision",
+    "MaxParallelThreads": "max_parallel_threads",
+    "MaxParallelShots": "max_parallel_shots",
+    "MaxMemoryMB": "max_memory_mb",
+    "FusionEnable": "fusion_enable",
+    "FusionThreshold": "fusion_threshold",
+    "FusionMaxQubit": "fusion_max_qubit",
+    "StatevectorParallelThreshold": "statevector_parallel_threshold",
+    "BlockingEnable": "blocking_enable",
+    "BlockingQubits": "blocking_qubits",
+    "MPSMaxBondDimension": "matrix_product_state_max_bond_dimension",
+}
+
+default_profile_cache_path = "~/.DiffusionProject/execution_profiles.json"
+
+
+def aer_options(profile: dict) -> dict:
+    """converts an execution profile with `JobParams.ExecutionProfile` keys (or Aer option names) into Aer simulator options"""
+    options = {}
+    for key, value in profile.items():
+        option = profile_options.get(key, key)
+        assert option in profile_options.values(), "unknown execution profile option {}, use one of {}".format(key, list(profile_options))
+        options[option] = value
+    return options
+
+
+def candidate_profiles(n_cpus = None, single_precision = False) -> list:
+    """
+    the Aer options tried by the auto-tuner: Aer's defaults, fusion, parallelisation across the statevector or across shots and,
+    if `single_precision` is set, single precision amplitudes
+    """
+    n_cpus = n_cpus or os.cpu_count() or 1
+    candidates = [
+        {},
+        {"fusion_enable": False},
+        {"fusion_threshold": 10, "fusion_max_qubit": 3},
+        {"fusion_threshold": 20, "fusion_max_qubit": 5},
+        {"statevector_parallel_threshold": 10, "max_parallel_threads": n_cpus},
+        {"max_parallel_shots": n_cpus, "max_parallel_threads": n_cpus},
+        {"method": "matrix_product_state"},
+    ]
+    if single_precision:
+        candidates += [dict(candidate, precision = "single") for candidate in candidates if candidate.get("method") is None]
+    return candidates
+
+
+class ProfileCache:
+    """The fastest execution profile found by the auto-tuner for each walk type and circuit width, stored as JSON at `path`"""
+
+    def __init__(self, path = None) -> None:
+        """
+        Args:
+            path (str): the JSON file holding the profiles, `default_profile_cache_path` if not set
+        """
+        self.path = os.path.expanduser(os.path.expandvars(path or default_profile_cache_path))
+
+    @staticmethod
+    def key(walk_type: str, n_qubits: int) -> str:
+        return "{}-{}".format(walk_type, n_qubits)
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file:
+            return json.load(file)
+
+    def lookup(self, walk_type: str, n_qubits: int) -> dict:
+        """the Aer options tuned for `walk_type` with `n_qubits` circuit qubits, or None if it has not been tuned"""
+        entry = self.load().get(self.key(walk_type, n_qubits))
+        return None if entry is None else entry["profile"]
+
+    def store(self, walk_type: str, n_qubits: int, profile: dict, timings: list) -> None:
+        """records `profile` as the fastest for `walk_type` with `n_qubits` circuit qubits, with the (profile, seconds) `timings` of every candidate"""
+        profiles = self.load()
+        profiles[self.key(walk_type, n_qubits)] = {"profile": profile, "timings": timings, "date": datetime.now().isoformat()}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(self.path, "w") as file:
+            json.dump(profiles, file, indent = 1)
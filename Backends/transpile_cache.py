@@ -0,0 +1,136 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from qiskit import QuantumCircuit, qpy
+from DiffusionProject.Utils.instrumentation import instrumentation
+
+
+class TranspileCache:
+    """
+    LRU cache of transpiled circuits keyed by a structural description of the circuit, with an optional on-disk QPY store.
+
+    Each entry records the physical qubit of every virtual qubit so that X gates can be prepended after transpilation,
+    which lets circuits differing only in their initial states share one transpilation.
+    """
+
+    def __init__(self, max_size = 128, directory = None) -> None:
+        """
+        Args:
+            max_size (int): the number of transpiled circuits held in memory\n
+            directory (str): if set, transpiled circuits without Aer save instructions are also saved to and loaded from QPY files in this directory
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+        self.time_spent = 0.0
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ".qpy")
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries or (self.directory is not None and os.path.exists(self._path(key)))
+
+    def _store(self, key, entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last = False)
+
+    def _lookup(self, key):
+        """returns the stored (circuit, transpile time, initial layout) entry for `key`, loading it from disk if needed"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as file:
+                circuit = qpy.load(file)[0]
+            self.disk_hits += 1
+            entry = (circuit, circuit.metadata["transpile_time"], circuit.metadata["initial_layout"])
+            self._store(key, entry)
+            return entry
+        return None
+
+    def get(self, key, source_circuit, transpile_function, x_qubits = None) -> QuantumCircuit:
+        """
+        returns a copy of the transpiled circuit stored under `key`, calling `transpile_function(source_circuit)` on a miss.
+        X gates are prepended on the physical qubits of the virtual qubit indices `x_qubits`
+        """
+        with instrumentation.span("transpile") as span:
+            hits = self.hits
+            entry = self._lookup(key)
+            if entry is not None:
+                self.time_saved += entry[1]
+                span.set(cache = "memory" if self.hits > hits else "disk")
+            else:
+                self.misses += 1
+                span.set(cache = "miss")
+                start_time = time.perf_counter()
+                circuit = transpile_function(source_circuit)
+                transpile_time = time.perf_counter() - start_time
+                self.time_spent += transpile_time
+
+                # virtual qubit index -> physical qubit index
+                layout = getattr(circuit, "_layout", None)
+                # newer qiskit versions wrap the initial layout in a `TranspileLayout`
+                layout = getattr(layout, "initial_layout", layout)
+                if layout is None:
+                    initial_layout = list(range(source_circuit.num_qubits))
+                else:
+                    initial_layout = [layout[qubit] for qubit in source_circuit.qubits]
+
+                entry = (circuit, transpile_time, initial_layout)
+                self._store(key, entry)
+                if self.directory is not None and self.is_serialisable(circuit):
+                    os.makedirs(self.directory, exist_ok = True)
+                    stored_circuit = circuit.copy()
+                    stored_circuit.metadata = {"transpile_time": transpile_time, "initial_layout": initial_layout}
+                    with open(self._path(key), "wb") as file:
+                        qpy.dump(stored_circuit, file)
+
+        circuit, _, initial_layout = entry
+        preparation = QuantumCircuit(circuit.num_qubits)
+        for qubit_idx in (x_qubits or []):
+            preparation.x(initial_layout[qubit_idx])
+        return circuit.compose(preparation, front = True)
+
+    @staticmethod
+    def is_serialisable(circuit) -> bool:
+        """Aer save instructions do not survive QPY, so circuits containing them are only cached in memory"""
+        return not any(instruction.operation.name.startswith("save_") for instruction in circuit.data)
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits)/lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "time_saved": self.time_saved,
+            "time_spent": self.time_spent}
+
+    def report(self) -> str:
+        stats = self.stats
+        return "transpile cache: {} hits ({} from disk), {} misses, hit rate {:.1%}, {:.2f}s saved, {:.2f}s transpiling".format(
+            stats["hits"] + stats["disk_hits"], stats["disk_hits"], stats["misses"], stats["hit_rate"], stats["time_saved"], stats["time_spent"])
+
+    def clear(self) -> None:
+        """removes every circuit held in memory and resets the statistics, the on-disk store is kept"""
+        self._entries.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+        self.time_spent = 0.0
+
+
+transpile_cache = TranspileCache()
@@ -0,0 +1,214 @@
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import itertools
+import contextlib
+from datetime import datetime
+from math import pi
+import qiskit
+from qiskit import transpile, assemble
+from DiffusionProject.Algorithms.Walks import QuantumWalk1D, QuantumWalk2D, QuantumWalk2DIndependant, QuantumWalk3D
+from DiffusionProject.Algorithms.Coins import HadamardCoin, PhaseKickbackCoin, SU2Coin
+from DiffusionProject.Algorithms.Boundaries import Boundary, BoundaryControl, UniDirectionalBoundaryControl, EfficientBoundaryControl, NonDisruptiveBoundaryControl, ControlledDirectionalBoundaryControl, AbsorbingBoundaryControl
+from DiffusionProject.Backends.backend import Backend
+from DiffusionProject.Evaluation.Experiments import SingleExperiment
+from DiffusionProject.Utils.boundary_generator import BoundaryGenerator
+from DiffusionProject.Utils.configCodes import coin_class_dict
+
+PHASES = ["build", "transpile", "simulate", "process_counts", "process_results"]
+
+# walk class and number of dimensions of each walk
+WALKS = {
+    "1D": (QuantumWalk1D, 1),
+    "2D": (QuantumWalk2D, 2),
+    "2DIndependant": (QuantumWalk2DIndependant, 2),
+    "3D": (QuantumWalk3D, 3),
+}
+
+# coins whose constructors take more than the number of qubits
+COIN_KWARGS = {
+    PhaseKickbackCoin: {"lam": pi/4},
+    SU2Coin: {"theta": pi/4, "zeta": 0, "xi": 0},
+}
+
+# one boundary control of each type, placed on the edges of every dimension
+BOUNDARY_CONTROLS = {
+    "none": lambda: None,
+    "hard": lambda: BoundaryControl(),
+    "soft": lambda: BoundaryControl(ctrl=HadamardCoin(1)),
+    "unidirectional": lambda: UniDirectionalBoundaryControl("right", None),
+    "efficient": lambda: EfficientBoundaryControl(),
+    "non_disruptive": lambda: NonDisruptiveBoundaryControl(),
+    "controlled_directional": lambda: ControlledDirectionalBoundaryControl(probabilities=[0.5, 0.5]),
+    "absorbing": lambda: AbsorbingBoundaryControl(),
+}
+
+
+def coin_names() -> list:
+    """the names in `coin_class_dict` with one name per coin class, skipping aliases"""
+    names, classes = [], []
+    for name, coin_class in coin_class_dict.items():
+        if coin_class is not None and coin_class not in classes:
+            names.append(name)
+            classes.append(coin_class)
+    return names
+
+
+PRESETS = {
+    "quick": {"walks": list(WALKS), "qubits": [2], "steps": [3], "coins": ["Hadamard"], "boundaries": ["none", "hard", "soft"]},
+    "full": {"walks": list(WALKS), "qubits": [2, 3, 4], "steps": [1, 5, 10], "coins": coin_names(), "boundaries": list(BOUNDARY_CONTROLS)},
+}
+
+
+@contextlib.contextmanager
+def timed(timings: dict, phase: str):
+    """records the wall time and the CPU time of this process (including Aer threads) spent in the block as `timings[phase]`"""
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    yield
+    timings[phase] = {"wall": time.perf_counter() - start_wall, "cpu": time.process_time() - start_cpu}
+
+
+def case_key(case: dict) -> tuple:
+    return (case["walk"], case["n_qubits"], case["n_steps"], case["coin"], case["boundary"])
+
+
+def make_walk(backend: Backend, walk_name, n_qubits, coin_name, boundary_name):
+    walk_class, n_dims = WALKS[walk_name]
+    coin_class = coin_class_dict[coin_name]
+    boundary_controls = []
+    boundary_control = BOUNDARY_CONTROLS[boundary_name]()
+    if boundary_control is not None:
+        for dimension in range(n_dims):
+            boundary_control.add_boundaries([Boundary(bitstring, dimension) for bitstring in BoundaryGenerator.generate_boundary_bitstrings("Edges", n_qubits)])
+        boundary_controls.append(boundary_control)
+
+    initial_states = ["0" + "1"*(n_qubits-1)]*n_dims
+    return walk_class(backend, system_dimensions=[n_qubits]*n_dims, initial_states=initial_states, coin_class=coin_class, coin_kwargs=COIN_KWARGS.get(coin_class, {}), boundary_controls=boundary_controls)
+
+
+def benchmark_case(backend: Backend, walk_name, n_qubits, n_steps, coin_name, boundary_name, shots, directory) -> dict:
+    """
+    times each phase of one walk: building the circuit, transpiling it (without `transpile_cache`), the Aer execution,
+    `process_counts` and `SingleExperiment._process_results` without plots
+    """
+    case = {"walk": walk_name, "n_qubits": n_qubits, "n_steps": n_steps, "coin": coin_name, "boundary": boundary_name, "shots": shots, "error": None}
+    timings = {}
+    try:
+        with timed(timings, "build"):
+            walk = make_walk(backend, walk_name, n_qubits, coin_name, boundary_name)
+            template = walk.build_template(n_steps)
+
+        with timed(timings, "transpile"):
+            transpiled = transpile(template, backend.backend)
+
+        with timed(timings, "simulate"):
+            parameters = {parameter.name: parameter for parameter in transpiled.parameters}
+            binding = {parameters[parameter.name]: angle for parameter, angle in zip(walk.initial_state_parameters, walk.initial_state_binding(walk.initial_states))}
+            result = backend.backend.run(assemble(transpiled, shots=shots, parameter_binds=[binding])).result()
+        counts = result.get_counts()
+
+        with timed(timings, "process_counts"):
+            results = walk.process_counts(counts, shots)
+
+        experiment = SingleExperiment(walk, WALKS[walk_name][1], n_qubits, shots, n_steps, directory_path=directory, plot=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            experiment._build_filetree()
+            with timed(timings, "process_results"):
+                experiment._process_results(results, timings["simulate"]["wall"])
+
+        case["n_circuit_qubits"] = transpiled.num_qubits
+        case["depth"] = transpiled.depth()
+    except Exception as error:
+        case["error"] = repr(error)
+    case["phases"] = timings
+    return case
+
+
+def run_benchmarks(walks, qubits, steps, coins, boundaries, shots = 1024, repeats = 1, verbose = True) -> dict:
+    """
+    benchmarks every combination of the arguments, returns the results with a description of the machine.
+    Each case is run `repeats` times keeping the fastest wall time of every phase, which is the least disturbed by other load
+    """
+    backend = Backend()
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        for walk_name, n_qubits, n_steps, coin_name, boundary_name in itertools.product(walks, qubits, steps, coins, boundaries):
+            case = benchmark_case(backend, walk_name, n_qubits, n_steps, coin_name, boundary_name, shots, directory)
+            for _ in range(repeats - 1):
+                repeat = benchmark_case(backend, walk_name, n_qubits, n_steps, coin_name, boundary_name, shots, directory)
+                for phase, timing in repeat["phases"].items():
+                    if phase in case["phases"] and timing["wall"] < case["phases"][phase]["wall"]:
+                        case["phases"][phase] = timing
+            cases.append(case)
+            if verbose:
+                phases = " ".join("{}={:.3f}s".format(phase, case["phases"][phase]["wall"]) for phase in PHASES if phase in case["phases"])
+                print("{:<60} {}".format(str(case_key(case)), case["error"] or phases), flush=True)
+
+    return {
+        "metadata": {
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "qiskit": dict(qiskit.__qiskit_version__),
+            "machine": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "cases": cases,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance = 0.25, min_seconds = 0.01) -> list:
+    """
+    compares the wall time of every phase of `results` with the same case and phase of `baseline`. Returns the regressions, phases
+    more than `tolerance` (a fraction) and `min_seconds` slower than the baseline, and the cases that started failing
+    """
+    baseline_cases = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        baseline_case = baseline_cases.get(case_key(case))
+        if baseline_case is None:
+            continue
+        if case["error"] and not baseline_case["error"]:
+            regressions.append({"case": case_key(case), "phase": None, "error": case["error"]})
+            continue
+        for phase, timing in case["phases"].items():
+            baseline_timing = baseline_case["phases"].get(phase)
+            if baseline_timing is None:
+                continue
+            slowdown = timing["wall"] - baseline_timing["wall"]
+            if slowdown > min_seconds and slowdown > tolerance*baseline_timing["wall"]:
+                regressions.append({"case": case_key(case), "phase": phase, "wall": timing["wall"], "baseline": baseline_timing["wall"]})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the build, transpile, simulate and post-processing phases of the walks')
+    parser.add_argument('--preset', action='store', type=str, default='quick', choices=list(PRESETS))
+    parser.add_argument('--walks', action='store', type=str, nargs='+', choices=list(WALKS))
+    parser.add_argument('--qubits', action='store', type=int, nargs='+')
+    parser.add_argument('--steps', action='store', type=int, nargs='+')
+    parser.add_argument('--coins', action='store', type=str, nargs='+')
+    parser.add_argument('--boundaries', action='store', type=str, nargs='+', choices=list(BOUNDARY_CONTROLS))
+    parser.add_argument('--shots', action='store', type=int, default=1024)
+    parser.add_argument('--repeats', action='store', type=int, default=1)
+    parser.add_argument('--output', action='store', type=str, help='save the results as JSON')
+    parser.add_argument('--baseline', action='store', type=str, help='JSON results to compare against')
+    parser.add_argument('--tolerance', action='store', type=float, default=0.25)
+    args = vars(parser.parse_args())
+
+    matrix = {name: args.get(name) or values for name, values in PRESETS[args["preset"]].items()}
+    results = run_benchmarks(shots=args["shots"], repeats=args["repeats"], **matrix)
+
+    if args.get("output"):
+        with open(args["output"], "w") as file:
+            json.dump(results, file, indent=1)
+
+    if args.get("baseline"):
+        with open(args["baseline"], "r") as file:
+            regressions = compare(results, json.load(file), args["tolerance"])
+        for regression in regressions:
+            print("REGRESSION {}".format(regression))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,151 @@
+import numpy as np
+from DiffusionProject.Evaluation.DenseTensor import coordinates_to_dense
+
+
+class CountsTable:
+    """
+    Counts over the state registers of a walk held as NumPy arrays: one integer state index and one count per observed state.
+
+    State indices follow the qiskit bitstring ordering, the register of the first dimension sits in the lowest bits,
+    so `int(bitstring, 2)` of a qiskit counts key is its state index.
+    """
+
+    def __init__(self, states, counts, register_sizes: list, dimensions: list = None) -> None:
+        """
+        Args:
+            states ([int]): the state index of every row, rows may repeat and are summed by `aggregate`\n
+            counts ([number]): the counts (or probability weights) of every row\n
+            register_sizes ([int]): the number of qubits of each state register in the table, in dimension order\n
+            dimensions ([int]): the walk dimension of each state register. Defaults to 0, 1, ...
+        """
+        self.states = np.asarray(states, dtype = np.int64).ravel()
+        self.counts = np.asarray(counts).ravel()
+        assert self.states.shape == self.counts.shape, "every state needs exactly one count"
+        self.register_sizes = list(register_sizes)
+        self.dimensions = list(dimensions) if dimensions is not None else list(range(len(self.register_sizes)))
+        assert len(self.dimensions) == len(self.register_sizes)
+
+    @classmethod
+    def from_dict(cls, counts: dict, register_sizes: list, dimensions: list = None):
+        """builds a table from a qiskit counts dictionary keyed by state register bitstrings"""
+        states = np.fromiter((int(bitstring.replace(" ", ""), 2) for bitstring in counts), dtype = np.int64, count = len(counts))
+        return cls(states, np.array(list(counts.values())), register_sizes, dimensions)
+
+    @classmethod
+    def from_probabilities(cls, probabilities, register_sizes: list, dimensions: list = None, cutoff = 0.0):
+        """builds a table over a single shot from a probability vector indexed by state, dropping probabilities at or below `cutoff`"""
+        probabilities = np.asarray(probabilities)
+        states = np.flatnonzero(probabilities > cutoff)
+        return cls(states, probabilities[states], register_sizes, dimensions)
+
+    @classmethod
+    def from_dense(cls, tensor, dimensions: list = None, cutoff = 0.0):
+        """builds a table over a single shot from a dense probability tensor indexed [dimension_0, dimension_1, ...]"""
+        tensor = np.asarray(tensor)
+        register_sizes = [int(size).bit_length() - 1 for size in tensor.shape]
+        coordinates = np.nonzero(tensor > cutoff)
+        states = np.zeros(len(coordinates[0]), dtype = np.int64)
+        offset = 0
+        for coordinate, register_size in zip(coordinates, register_sizes):
+            states |= coordinate.astype(np.int64) << offset
+            offset += register_size
+        return cls(states, tensor[coordinates].astype(float), register_sizes, dimensions)
+
+    @classmethod
+    def concatenate(cls, tables: list):
+        """merges tables over the same registers, summing the counts of shared states"""
+        assert len(tables) > 0
+        register_sizes, dimensions = tables[0].register_sizes, tables[0].dimensions
+        assert all(table.register_sizes == register_sizes and table.dimensions == dimensions for table in tables), "only tables over the same registers can be merged"
+        states = np.concatenate([table.states for table in tables])
+        counts = np.concatenate([table.counts for table in tables])
+        return cls(states, counts, register_sizes, dimensions).aggregate()
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    @property
+    def n_bits(self) -> int:
+        return sum(self.register_sizes)
+
+    @property
+    def total(self):
+        """the total number of counts, the number of shots for sampled counts"""
+        return self.counts.sum()
+
+    def aggregate(self):
+        """returns a table with one row per distinct state, in ascending state order"""
+        states, inverse = np.unique(self.states, return_inverse = True)
+        counts = np.bincount(inverse, weights = self.counts, minlength = len(states))
+        if np.issubdtype(self.counts.dtype, np.integer):
+            counts = np.rint(counts).astype(self.counts.dtype)
+        return CountsTable(states, counts, self.register_sizes, self.dimensions)
+
+    def merge(self, other):
+        """returns the table holding the counts of both `self` and `other`"""
+        return CountsTable.concatenate([self, other])
+
+    def scale(self, factor):
+        """returns the table with every count multiplied by `factor`"""
+        return CountsTable(self.states, self.counts*factor, self.register_sizes, self.dimensions)
+
+    def _offset(self, position) -> int:
+        return sum(self.register_sizes[:position])
+
+    def field(self, dimension) -> np.ndarray:
+        """the value of the state register of `dimension` in every row"""
+        position = self.dimensions.index(dimension)
+        mask = (1 << self.register_sizes[position]) - 1
+        return (self.states >> self._offset(position)) & mask
+
+    def marginalise(self, dimensions: list):
+        """returns the table summed onto the state registers of `dimensions`, or `self` if it only holds those registers"""
+        dimensions = sorted(dimensions)
+        if dimensions == self.dimensions:
+            return self
+
+        states = np.zeros_like(self.states)
+        register_sizes = []
+        offset = 0
+        for dimension in dimensions:
+            states |= self.field(dimension) << offset
+            register_size = self.register_sizes[self.dimensions.index(dimension)]
+            register_sizes.append(register_size)
+            offset += register_size
+        return CountsTable(states, self.counts, register_sizes, dimensions).aggregate()
+
+    def bitstrings(self, dimension = None) -> list:
+        """the qiskit bitstring of every row, or of the state register of `dimension` only"""
+        if dimension is None:
+            return [format(state, "0{}b".format(self.n_bits)) for state in self.states.tolist()]
+        register_size = self.register_sizes[self.dimensions.index(dimension)]
+        return [format(value, "0{}b".format(register_size)) for value in self.field(dimension).tolist()]
+
+    def to_dict(self) -> dict:
+        """the counts as a qiskit style dictionary keyed by bitstring"""
+        table = self.aggregate()
+        return dict(zip(table.bitstrings(), table.counts.tolist()))
+
+    def to_dense(self, shots = None, path: str = None) -> np.ndarray:
+        """
+        converts the table into a dense float32 probability tensor indexed [dimension_0, dimension_1, ...], dividing the counts by `shots`
+        (the total by default). The tensor is written to and memory-mapped from the `.npy` file `path` if passed
+        """
+        if shots is None:
+            shots = self.total
+        shape = tuple(2**register_size for register_size in self.register_sizes)
+        coordinates = [self.field(dimension) for dimension in self.dimensions]
+        return coordinates_to_dense(coordinates, 1.0*self.counts/shots, shape, path)
+
+    def to_displacement_tensors(self, shots = None) -> dict:
+        """
+        converts the table into the `dimension_i` and `probability_density` columns returned by `QuantumWalk.process_counts`,
+        dividing the counts by `shots` (the total by default)
+        """
+        if shots is None:
+            shots = self.total
+        displacement_tensors = {}
+        for dimension in self.dimensions:
+            displacement_tensors["dimension_{}".format(dimension)] = self.field(dimension).tolist()
+        displacement_tensors["probability_density"] = (1.0*self.counts/shots).tolist()
+        return displacement_tensors
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def open_dense_tensor(path: str, shape = None, dtype = np.float32) -> np.memmap:
+    """
+    opens the dense probability tensor saved as a `.npy` file at `path`, memory-mapped read only.
+    If `shape` is passed a new zeroed tensor of that shape is created instead, memory-mapped for writing
+    """
+    if shape is None:
+        return np.lib.format.open_memmap(path, mode = "r")
+    return np.lib.format.open_memmap(path, mode = "w+", dtype = dtype, shape = tuple(shape))
+
+
+def write_dense_tensor(distribution, path: str = None, dtype = np.float32) -> np.ndarray:
+    """returns `distribution` as a dense `dtype` tensor, written to and memory-mapped from the `.npy` file `path` if passed"""
+    if path is None:
+        return np.asarray(distribution, dtype = dtype)
+    tensor = open_dense_tensor(path, np.shape(distribution), dtype)
+    tensor[...] = distribution
+    tensor.flush()
+    return tensor
+
+
+def coordinates_to_dense(coordinates, weights, shape, path: str = None, dtype = np.float32) -> np.ndarray:
+    """accumulates `weights` at the lattice `coordinates` (one array per dimension) into a dense tensor of `shape`"""
+    tensor = np.zeros(shape, dtype = dtype) if path is None else open_dense_tensor(path, shape, dtype)
+    np.add.at(tensor, tuple(np.asarray(coordinate, dtype = np.int64) for coordinate in coordinates), np.asarray(weights, dtype = dtype))
+    if path is not None:
+        tensor.flush()
+    return tensor
+
+
+def results_to_dense(results: dict, shape, path: str = None, dtype = np.float32) -> np.ndarray:
+    """
+    converts processed results (the `dimension_i` and `probability_density` columns of `QuantumWalk.process_counts`) into a dense tensor
+    of `shape`, indexed [dimension_0, dimension_1, ...]
+    """
+    columns = sorted((column for column in results if str(column).startswith("dimension_")), key = lambda column: int(column.split("_")[-1]))
+    return coordinates_to_dense([results[column] for column in columns], results["probability_density"], shape, path, dtype)
+
+
+def dense_to_results(tensor, dimensions: list = None, cutoff = 0.0) -> dict:
+    """converts a dense tensor into the `dimension_i` and `probability_density` columns of its sites with probability above `cutoff`"""
+    if dimensions is None:
+        dimensions = list(range(np.ndim(tensor)))
+    tensor = np.asarray(tensor)
+    coordinates = np.nonzero(tensor > cutoff)
+    results = {}
+    for dimension, coordinate in zip(dimensions, coordinates):
+        results["dimension_{}".format(dimension)] = coordinate.tolist()
+    results["probability_density"] = tensor[coordinates].astype(float).tolist()
+    return results
+
+
+def qiskit_order_to_dense(probabilities, register_sizes: list) -> np.ndarray:
+    """reshapes a probability vector in qiskit state ordering (first register in the lowest bits) into a tensor indexed [dimension_0, dimension_1, ...]"""
+    shape = tuple(2**register_size for register_size in register_sizes)
+    return np.asarray(probabilities).reshape(shape[::-1]).transpose()
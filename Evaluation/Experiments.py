@@ -2,11 +2,17 @@ from DiffusionProject.Algorithms.Coins import HadamardCoin
 from DiffusionProject.Algorithms.Walks import QuantumWalk, QuantumWalk1D, QuantumWalk2D, QuantumWalk3D
 from DiffusionProject.Backends.backend import Backend
 from DiffusionProject.Algorithms.Boundaries import BoundaryControl, Boundary
-from DiffusionProject.Evaluation.Plotter import plot_distribution2D, plot_distribution3D, plot_distribution1D, plot_distribution_2D_topological
-from DiffusionProject.Evaluation.PostProcesing import rebuild_counts_from_dictionary, get_stats_from_counts_dict
+from DiffusionProject.Evaluation.PostProcesing import get_weighted_stats_from_results
+from DiffusionProject.Evaluation.ResultStore import ResultStore
+from DiffusionProject.Evaluation.DenseTensor import results_to_dense
+from DiffusionProject.Evaluation.MemoryEval import estimate_memory, simulation_method, available_memory, max_parallel_experiments_within, process_overhead
 from DiffusionProject.Utils.timer import Timer
+from DiffusionProject.Utils.instrumentation import instrumentation
 import pandas as pd
+import numpy as np
+import os
 import subprocess
+import time
 
 
 
@@ -55,6 +61,8 @@ class Experiment:
         subprocess.run("mkdir {}/debug".format(self.path), shell=True)
 
     def _plot_distribution(self, experiment_number, results, plot_path):
+        # plotting libraries are imported on first use so compute-only runs never load them
+        from DiffusionProject.Evaluation.Plotter import plot_distribution2D, plot_distribution3D
         if self.n_dims == 2:
             title = "diffusion on an {0}x{0} grid with a {1} after {2} steps".format(2**self.n_qubits, self.walk.shift_coin._name,experiment_number)
             plot_distribution2D(results=results,n_qubits=self.n_qubits,savepath=plot_path,title=title)
@@ -111,6 +119,7 @@ class Experiment2D(Experiment):
         self.walk.step()
 
     def _plot_distribution(self, experiment_number, results, plot_path):
+        from DiffusionProject.Evaluation.Plotter import plot_distribution2D
         title = "diffusion on an {0}x{0} grid with a {1} after {2} steps".format(2**self.n_qubits, self.walk.shift_coin._name,experiment_number)
         plot_distribution2D(results=results,n_qubits=self.n_qubits,savepath=plot_path,title=title)
 
@@ -130,6 +139,7 @@ class Experiment3D(Experiment):
         self.walk.step()
 
     def _plot_distribution(self, experiment_number, results, plot_path):
+        from DiffusionProject.Evaluation.Plotter import plot_distribution3D
         title = "diffusion on an {0}x{0}*{0} grid with a {1} after {2} steps".format(2**self.n_qubits, self.walk.shift_coin._name,experiment_number)
         plot_distribution3D(results=results,n_qubits=self.n_qubits,savepath=plot_path,title=title)
 
@@ -149,8 +159,20 @@ class debugExperiment(Experiment):
 
 class SingleExperiment(Experiment):
 
-    def __init__(self, walk : QuantumWalk, n_dims, n_qubits, shots, n_steps,decoherence_intervals = None, experiment_name=None, directory_path = ".") -> None:
+    # the engine a run is moved to when its own engine does not fit into the memory budget
+    engine_downgrades = {
+        "operator": "sparse",
+        "density": "numpy"
+    }
+
+    def __init__(self, walk : QuantumWalk, n_dims, n_qubits, shots, n_steps,decoherence_intervals = None, experiment_name=None, directory_path = ".", mode = "counts", max_parallel_experiments = 1, decoherence_batch_size = None, dense_output = False, plot = True, memory_budget = None) -> None:
         self.walk = walk
+        self.memory_budget = memory_budget
+        self.plot = plot
+        self.mode = mode
+        self.dense_output = dense_output
+        self.max_parallel_experiments = max_parallel_experiments
+        self.decoherence_batch_size = decoherence_batch_size
         self.n_steps = n_steps
         self.n_dims = n_dims
         self.n_qubits = n_qubits
@@ -159,6 +181,7 @@ class SingleExperiment(Experiment):
         self.job_id_path = self.directory_path +'/' + "IBM_job_list.txt"
         self._set_path(experiment_name)
         self.decoherence_intervals = decoherence_intervals
+        self.result_store = ResultStore(self.path + "/data/results.npz")
 
     def _set_path(self,experiment_name: None):
         # name experiment
@@ -169,6 +192,8 @@ class SingleExperiment(Experiment):
             self.path = self.directory_path +'/' + experiment_name
 
     def _plot_distribution(self, results, plot_path, auxillary_plot_path = None, show_fig = False):
+        # plotting libraries are imported on first use so compute-only runs never load them
+        from DiffusionProject.Evaluation.Plotter import plot_distribution2D, plot_distribution3D, plot_distribution1D, plot_distribution_2D_topological
         clear_fig = not show_fig
         if self.n_dims == 1:
             title = "diffusion on an {0} digit line with a {1}".format(2**self.n_qubits, self.walk.shift_coin._name)
@@ -188,10 +213,15 @@ class SingleExperiment(Experiment):
         timer = Timer()
         timer.start()
 
-        if self.decoherence_intervals:
-            results,qiskit_time = self.walk.run_decoherence_experiment(n_steps=self.n_steps, decoherence_intervals = self.decoherence_intervals, shots=self.shots,return_elapsed_time=True)
+        if self.dense_output and not self.decoherence_intervals:
+            # the engine writes the distribution straight into the memory-mapped tensor
+            start_time = time.perf_counter()
+            results = self.walk.run_dense(self.n_steps, path=self._dense_path(), shots=self.shots)
+            qiskit_time = time.perf_counter() - start_time
+        elif self.decoherence_intervals:
+            results,qiskit_time = self.walk.run_decoherence_experiment(n_steps=self.n_steps, decoherence_intervals = self.decoherence_intervals, shots=self.shots,return_elapsed_time=True, mode=self.mode, max_parallel_experiments=self.max_parallel_experiments, batch_size=self.decoherence_batch_size)
         else:
-            job = self.walk.run_experiment(n_steps=self.n_steps, shots=self.shots)
+            job = self.walk.run_experiment(n_steps=self.n_steps, shots=self.shots, mode=self.mode)
             results, qiskit_time = self.walk.get_results(job,True)
 
         python_elapsed_time = Timer.seconds_to_hms(timer.stop())
@@ -199,6 +229,21 @@ class SingleExperiment(Experiment):
         
         self._process_results(results,qiskit_time, show_fig)
 
+    def _run_sweep_locally(self, step_numbers, show_fig = False):
+        """Runs every step count in `step_numbers` in a single execution of the walk"""
+        assert not self.decoherence_intervals, "decoherence experiments restart the walk and cannot be swept in one execution"
+        timer = Timer()
+        timer.start()
+
+        sweep_results = self.walk.run_sweep(step_numbers, shots=self.shots)
+
+        python_elapsed_time = timer.stop()
+        print(Timer.seconds_to_hms(python_elapsed_time))
+
+        for n_steps, results in sweep_results.items():
+            self.n_steps = n_steps
+            self._process_results(results, python_elapsed_time, show_fig)
+
     def submit_job_to_IBM(self):
 
         job = self.walk.run_experiment(n_steps=self.n_steps, shots=self.shots)
@@ -209,8 +254,9 @@ class SingleExperiment(Experiment):
 
         print("JOB ID: {} submitted succesfully!".format(job_id))
 
-        circuit_diagram_path = self.path + "/circuit_diagram.png"
-        self.walk.draw_debug(circuit_diagram_path)
+        if self.plot:
+            circuit_diagram_path = self.path + "/circuit_diagram.png"
+            self.walk.draw_debug(circuit_diagram_path)
 
 
 
@@ -225,8 +271,45 @@ class SingleExperiment(Experiment):
 
 
 
+    def _result_metadata(self, elapsed_time) -> dict:
+        """the description of the experiment stored alongside every step in `result_store`"""
+        boundaries = []
+        for boundary_control in self.walk.boundary_controls:
+            for boundary in boundary_control.boundaries:
+                bitstrings = getattr(boundary, "bitstrings", [getattr(boundary, "bitstring", None)])
+                dimensions = getattr(boundary, "dimensions", [getattr(boundary, "dimension", None)])
+                boundaries.append({"control": type(boundary_control).__name__, "bitstrings": bitstrings, "dimensions": dimensions})
+
+        return {
+            "shots": self.shots,
+            "mode": self.mode,
+            "n_dims": self.n_dims,
+            "n_qubits": self.n_qubits,
+            "coin": self.walk.shift_coin._name,
+            "boundaries": boundaries,
+            "decoherence_intervals": self.decoherence_intervals,
+            "elapsed_time": elapsed_time}
+
+    def _experiment_name(self, n_steps = None) -> str:
+        n_steps = self.n_steps if n_steps is None else n_steps
+        return "{}D_Walk_{}_bit_{}_{}_steps".format(self.n_dims,2**self.n_qubits, self.walk.shift_coin._name,n_steps)
+
+    def _dense_path(self, n_steps = None) -> str:
+        """the `.npy` file holding the dense probability tensor of `n_steps`, by default the current step count"""
+        return self.path + "/data/{}_probabilities.npy".format(self._experiment_name(n_steps))
+
+    def has_results(self, n_steps) -> bool:
+        """True if the results of `n_steps` are saved in the experiment directory, in `result_store` or as a dense tensor"""
+        if self.dense_output:
+            return os.path.exists(self._dense_path(n_steps))
+        return n_steps in self.result_store
+
     def _process_results(self,results,elapsed_time, show_fig = False):
-        experiment_name = "{}D_Walk_{}_bit_{}_{}_steps".format(self.n_dims,2**self.n_qubits, self.walk.shift_coin._name,self.n_steps)
+        """
+        saves, plots and prints the statistics of `results`, either processed results or a dense probability tensor.
+        With `dense_output` results are kept as a memory-mapped dense tensor instead of being added to `result_store`
+        """
+        experiment_name = self._experiment_name()
         debug_file_path = self.path + '/debug/debug_{}.txt'.format(experiment_name)
         with open(debug_file_path, 'w') as f:
             f.write('\nDebug output for a {} coined walk on a {} dimensional system with {} qubit dimensions after {} steps:\n'.format(self.coin_name,self.n_dims,self.n_qubits,self.n_steps))
@@ -234,22 +317,28 @@ class SingleExperiment(Experiment):
         
 
        
-        data_path = self.path + "/data/{}_results.csv".format(experiment_name)
         plot_path = self.path + "/images/{}.png".format(experiment_name)
         auxillary_plot_path = self.path + "/auxillary_plots/{}.png".format(experiment_name)
         circuit_diagram_path = self.path + "/circuit_diagram.png"
       
 
-        results = pd.DataFrame(results)
-        results.to_csv(data_path)
-        self._plot_distribution(results=results, plot_path=plot_path, auxillary_plot_path=auxillary_plot_path, show_fig = show_fig)
+        with instrumentation.span("write", n_steps=self.n_steps, dense=self.dense_output):
+            if self.dense_output:
+                if not isinstance(results, np.ndarray):
+                    results = results_to_dense(results, [2**self.n_qubits]*self.n_dims, path=self._dense_path())
+            else:
+                self.result_store.append(self.n_steps, results, self._result_metadata(elapsed_time))
+                results = pd.DataFrame(results)
 
-        # draw the circuit
-        self.walk.draw_debug(circuit_diagram_path)
+        # plots and the circuit diagram are skipped in compute-only runs
+        if self.plot:
+            with instrumentation.span("plot", n_steps=self.n_steps):
+                self._plot_distribution(results=results, plot_path=plot_path, auxillary_plot_path=auxillary_plot_path, show_fig = show_fig)
+                self.walk.draw_debug(circuit_diagram_path)
 
         # get covariance
-        results_rebuilt = rebuild_counts_from_dictionary(results,n_dims=self.n_dims,shots=self.shots)
-        stats = get_stats_from_counts_dict(results_rebuilt)
+        with instrumentation.span("post_process", n_steps=self.n_steps):
+            stats = get_weighted_stats_from_results(results, shots=self.shots, n_steps=self.n_steps)
         covariance_matrix = stats["cov"]
 
         # output diffusion tensor to debig output
@@ -266,10 +355,63 @@ class SingleExperiment(Experiment):
 
 
 
+    def _span_attributes(self) -> dict:
+        """the description of the experiment recorded on its root span"""
+        execution_profile = self.walk.backend.execution_profile if self.walk.backend is not None else {}
+        return {"n_dims": self.n_dims, "n_qubits": self.n_qubits, "shots": self.shots, "mode": self.mode, "engine": self.walk.engine, "decoherence_intervals": self.decoherence_intervals, "execution_profile": execution_profile}
+
+    @property
+    def spans_path(self) -> str:
+        """the JSON lines file the spans of every run of the experiment are appended to"""
+        return self.path + "/spans.jsonl"
+
+    def estimate_memory(self, n_steps = None) -> float:
+        """the predicted peak memory in GB of running the experiment for `n_steps`, by default `self.n_steps`"""
+        # dense tensors are built from exact probabilities
+        mode = "probabilities" if self.dense_output and not self.decoherence_intervals else self.mode
+        return estimate_memory(self.walk, mode, self.shots, self.n_steps if n_steps is None else n_steps, self.max_parallel_experiments)
+
+    def admit(self, n_steps = None) -> None:
+        """
+        checks the estimated memory of a run of `n_steps` against `memory_budget` GB, by default the free memory, before anything
+        is built. Runs that do not fit are downgraded to fewer parallel experiments, then to the engine in `engine_downgrades`,
+        then from exact probabilities to sampled counts. Runs that still do not fit are refused
+        """
+        if self.walk.backend is not None and self.walk.backend.is_on_IBM:
+            return
+        # the free memory does not include this process
+        budget = self.memory_budget or available_memory() + process_overhead
+        dense_probabilities = self.dense_output and not self.decoherence_intervals
+
+        if self.estimate_memory(n_steps) > budget and self.max_parallel_experiments > 1:
+            mode = "probabilities" if dense_probabilities else self.mode
+            self.max_parallel_experiments = max_parallel_experiments_within(self.walk, budget, mode, self.shots, self.n_steps if n_steps is None else n_steps, self.max_parallel_experiments)
+            print("MEMORY: reduced the parallel experiments to {}".format(self.max_parallel_experiments))
+
+        if self.estimate_memory(n_steps) > budget and self.walk.engine in self.engine_downgrades:
+            print("MEMORY: the {} engine needs {:.2f}GB, switching to the {} engine".format(self.walk.engine, self.estimate_memory(n_steps), self.engine_downgrades[self.walk.engine]))
+            self.walk.set_engine(self.engine_downgrades[self.walk.engine])
+
+        if self.estimate_memory(n_steps) > budget and self.mode == "probabilities" and not dense_probabilities:
+            print("MEMORY: exact probabilities with {} need {:.2f}GB, sampling counts instead".format(simulation_method(self.walk, self.mode), self.estimate_memory(n_steps)))
+            self.mode = "counts"
+
+        estimate = self.estimate_memory(n_steps)
+        assert estimate <= budget, "the experiment needs an estimated {:.3f}GB simulating {} with {}, more than the {:.3f}GB budget".format(estimate, self.walk.system_dimensions, simulation_method(self.walk, self.mode), budget)
+
     def run_locally(self, show_fig = False):
         """runs a monte carlo simulation after a varied number of timesteps specified by `self.stepsize` and `self.max_iterations`"""
+        self.admit()
+        self._build_filetree()
+        with instrumentation.span("experiment", path=self.spans_path, n_steps=self.n_steps, **self._span_attributes()):
+            self._run_experiment_locally(show_fig)
+
+    def run_sweep_locally(self, step_numbers, show_fig = False):
+        """runs the walk once and processes the results after each step count in `step_numbers`"""
+        self.admit(max(step_numbers))
         self._build_filetree()
-        self._run_experiment_locally(show_fig)
+        with instrumentation.span("sweep", path=self.spans_path, step_numbers=list(step_numbers), **self._span_attributes()):
+            self._run_sweep_locally(step_numbers, show_fig)
 
     def process_IBM_results(self):
         self._build_filetree()
@@ -0,0 +1,134 @@
+import os
+import math
+import numpy as np
+
+# bytes of a complex amplitude at each Aer precision
+bytes_per_amplitude = {
+    "double": 16,
+    "single": 8
+}
+
+# python, qiskit and Aer before any state is allocated, in GB
+process_overhead = 0.3
+
+# copies of the state held at once while a native engine steps: the state, the rolled/coined copy and the probabilities
+native_state_copies = 3
+
+# the `max_batch_amplitudes` of native engines that have not been created yet
+default_max_batch_amplitudes = 2**24
+
+
+def has_resets(walk) -> bool:
+    """True if the circuit of `walk` contains resets: soft boundary registers, boundary ancillas, absorption or coin decoherence"""
+    has_boundary_ancillas = any(boundary_control.ancilla_register is not None for boundary_control in walk.boundary_controls)
+    return bool(walk.boundary_control_registers) or has_boundary_ancillas or walk.absorption_register is not None or walk.coin_decoherence_cycle is not None
+
+
+def circuit_qubits(walk) -> int:
+    """the number of qubits in the circuit of `walk`: the coin, ancilla, boundary control and state registers"""
+    registers = [walk.shift_coin_register] + walk.ancilla_registers + walk.boundary_control_registers + walk.state_registers
+    return sum(register.size for register in registers)
+
+
+def _backend_option(walk, option, default):
+    backend = walk.backend
+    if backend is None or backend.is_on_IBM:
+        return default
+    value = getattr(backend.backend.options, option, None)
+    return default if value is None else value
+
+
+def simulation_method(walk, mode = "counts") -> str:
+    """
+    the method `walk` is simulated with: the name of its native engine, or the Aer method. Exact probabilities of circuits with
+    resets or on a noisy backend need a density matrix, otherwise Aer's "automatic" method simulates the walks as a statevector
+    """
+    if walk.engine != "qiskit":
+        return walk.engine
+    has_noise_model = walk.backend is not None and walk.backend.has_noise_model
+    if mode == "probabilities" and (has_resets(walk) or has_noise_model):
+        return "density_matrix"
+    method = _backend_option(walk, "method", "automatic")
+    return "statevector" if method == "automatic" else method
+
+
+def _mps_amplitudes(n_qubits, max_bond_dimension = None) -> int:
+    """the amplitudes of a matrix product state with the worst case bond dimension across every cut"""
+    n_amplitudes = 0
+    for site in range(n_qubits):
+        left_bond = 2**min(site, n_qubits-site)
+        right_bond = 2**min(site+1, n_qubits-site-1)
+        if max_bond_dimension:
+            left_bond, right_bond = min(left_bond, max_bond_dimension), min(right_bond, max_bond_dimension)
+        n_amplitudes += 2*left_bond*right_bond
+    return n_amplitudes
+
+
+def _native_engine_bytes(walk, method, shots, n_steps, stochastic) -> int:
+    """the peak bytes of the position x coin arrays of a native engine, see `DiffusionProject.Algorithms.Engines`"""
+    dimension = int(np.prod([2**n_qubits for n_qubits in walk.system_dimensions]))*2**walk.n_shift_coin_bits
+    state_bytes = bytes_per_amplitude["double"]*dimension
+
+    if method == "density" and stochastic:
+        # the density matrix, the channel's output and the branch being applied
+        return 3*state_bytes*dimension
+    if method == "operator" and not stochastic:
+        # the identity the step operator is built from and U^(2^k) for every bit of `n_steps`
+        return state_bytes*dimension*(max(n_steps, 1).bit_length() + 1)
+    if method == "fourier" and not stochastic:
+        # the state, its transform and U(k) with its powers, a coin x coin matrix for every site
+        return native_state_copies*state_bytes + 3*state_bytes*2**walk.n_shift_coin_bits
+    if method == "sparse" and not stochastic:
+        # a column index and an amplitude for every non-zero, the coin mixes every coin state of a site, plus the composition
+        return 2*dimension*2**walk.n_shift_coin_bits*(bytes_per_amplitude["double"] + 8) + native_state_copies*state_bytes
+
+    # trajectories are evolved in batches of at most `max_batch_amplitudes`
+    batch_size = 1
+    if stochastic:
+        max_batch_amplitudes = getattr(walk._native_engine, "_max_batch_amplitudes", default_max_batch_amplitudes)
+        batch_size = min(shots, max(1, max_batch_amplitudes//dimension))
+    return native_state_copies*state_bytes*batch_size
+
+
+def estimate_memory(walk, mode = "counts", shots = 1024, n_steps = 1, max_parallel_experiments = 1, method = None) -> float:
+    """
+    predicts the peak memory in GB of running `walk` from its registers and simulation method (by default `simulation_method`),
+    including `process_overhead`. `max_parallel_experiments` states are held at once by Aer
+    """
+    if method is None:
+        method = simulation_method(walk, mode)
+    n_qubits = circuit_qubits(walk)
+    n_state_qubits = sum(walk.system_dimensions)
+
+    if method in walk.engines:
+        state_bytes = _native_engine_bytes(walk, method, shots, n_steps, has_resets(walk))
+    else:
+        amplitude_bytes = bytes_per_amplitude[_backend_option(walk, "precision", "double")]
+        if method == "density_matrix":
+            state_bytes = amplitude_bytes*4**n_qubits
+        elif method == "matrix_product_state":
+            state_bytes = amplitude_bytes*_mps_amplitudes(n_qubits, _backend_option(walk, "matrix_product_state_max_bond_dimension", None))
+        else:
+            state_bytes = amplitude_bytes*2**n_qubits
+        state_bytes *= max_parallel_experiments
+
+    # probabilities are returned over every state qubit and copied into position order, counts hold at most `shots` states
+    if mode == "probabilities":
+        result_bytes = 2*8*2**n_state_qubits
+    else:
+        result_bytes = 2*8*min(shots, 2**n_state_qubits)
+
+    return process_overhead + (10**-9)*(state_bytes + result_bytes)
+
+
+def available_memory() -> float:
+    """the memory in GB that is free on this machine"""
+    return (10**-9)*os.sysconf("SC_PAGE_SIZE")*os.sysconf("SC_AVPHYS_PAGES")
+
+
+def max_parallel_experiments_within(walk, budget, mode = "counts", shots = 1024, n_steps = 1, max_parallel_experiments = 1) -> int:
+    """the largest number of parallel experiments, at most `max_parallel_experiments`, whose estimate fits into `budget` GB"""
+    single_experiment = estimate_memory(walk, mode, shots, n_steps, 1)
+    per_experiment = max(single_experiment - estimate_memory(walk, mode, shots, n_steps, 0), 10**-12)
+    fitting = math.floor((budget - single_experiment)/per_experiment) + 1
+    return max(1, min(max_parallel_experiments, fitting))
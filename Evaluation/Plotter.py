@@ -8,20 +8,28 @@ import numpy as np
 
 sns.set_style("whitegrid")
 
+def _dense_sites(tensor):
+    """the coordinates (one array per dimension) and probabilities of the non-zero sites of a dense tensor or memmap, in index order"""
+    coordinates = np.nonzero(tensor)
+    return coordinates, np.asarray(tensor[coordinates], dtype=float)
+
 def plot_distribution1D(results,n_qubits,savepath,title = None, clear_fig = True):
     plt.rcParams.update({'figure.figsize': (10,10)})
-    """plots diffusion for 1D data"""
+    """plots diffusion for 1D data, `results` may also be a dense probability tensor"""
+    if isinstance(results, np.ndarray):
+        # the sites of a dense tensor are already in index order
+        (x_sorted,),probability_sorted = _dense_sites(results)
+    else:
+        x,probability_density = results["dimension_0"],results["probability_density"]
+        coords = [(i,j) for i,j in zip(x,probability_density)]
+        coords.sort(key=lambda coord: coord[0])
+        x_sorted = [coord[0] for coord in coords]
+        probability_sorted = [coord[1] for coord in coords]
 
-    x,probability_density = results["dimension_0"],results["probability_density"]
     axes_limit = (2**n_qubits)-1
     if title is None:
         title = "diffusion on an {0} digit line".format(axes_limit+1)
 
-    coords = [(i,j) for i,j in zip(x,probability_density)]
-    coords.sort(key=lambda coord: coord[0])
-    x_sorted = [coord[0] for coord in coords]
-    probability_sorted = [coord[1] for coord in coords]
-
     plt.cla()
     plt.plot(x_sorted,probability_sorted,'o--')
     plt.xlim(0,axes_limit)
@@ -33,9 +41,12 @@ def plot_distribution1D(results,n_qubits,savepath,title = None, clear_fig = True
         plt.cla()
 
 def plot_distribution2D(results,n_qubits,savepath,title = None, clear_fig = True):
-    """plots diffusion for 2D data"""
+    """plots diffusion for 2D data, `results` may also be a dense probability tensor"""
     plt.rcParams.update({'figure.figsize': (10,10)})
-    y,x,probability_density = results["dimension_0"],results["dimension_1"],results["probability_density"]
+    if isinstance(results, np.ndarray):
+        (y,x),probability_density = _dense_sites(results)
+    else:
+        y,x,probability_density = results["dimension_0"],results["dimension_1"],results["probability_density"]
     axes_limit = (2**n_qubits)-1
     if title is None:
         title = "diffusion on an {0}x{0} grid".format(axes_limit+1)
@@ -57,9 +68,9 @@ def plot_distribution2D(results,n_qubits,savepath,title = None, clear_fig = True
 
 
 def plot_distribution_2D_topological(results,n_qubits,savepath,title = None, clear_fig = True):
+    """plots the 2D distribution as a surface, a dense probability tensor is plotted as is"""
     plt.rcParams.update({'figure.figsize': (20,10)})
     plt.tight_layout(pad=0)
-    x,y,probability_density = results["dimension_0"],results["dimension_1"],results["probability_density"]
 
     if type(n_qubits) == list:
         axes_limit = [(2**n)-1 for n in n_qubits]
@@ -74,10 +85,14 @@ def plot_distribution_2D_topological(results,n_qubits,savepath,title = None, cle
     X = np.arange(0,axes_limit[0]+1, 1, dtype=float)
     Y = np.arange(0,axes_limit[1]+1, 1, dtype=float)
     X, Y = np.meshgrid(X, Y)
-    Z = X*0
 
-    for px,py,prob in zip(x,y,probability_density):
-        Z[px][py] = prob
+    if isinstance(results, np.ndarray):
+        Z = np.asarray(results, dtype=float)
+    else:
+        Z = X*0
+        x,y,probability_density = results["dimension_0"],results["dimension_1"],results["probability_density"]
+        for px,py,prob in zip(x,y,probability_density):
+            Z[px][py] = prob
 
 
     plt.cla()
@@ -111,9 +126,12 @@ def plot_distribution_2D_topological(results,n_qubits,savepath,title = None, cle
 
 
 def plot_distribution3D(results,n_qubits,savepath,title = None, clear_fig = True):
-    """plots diffusion for 3D data"""
+    """plots diffusion for 3D data, `results` may also be a dense probability tensor"""
     plt.rcParams.update({'figure.figsize': (10,10)})
-    z,y,x,probability_density = results["dimension_0"],results["dimension_1"],results["dimension_2"],results["probability_density"]
+    if isinstance(results, np.ndarray):
+        (z,y,x),probability_density = _dense_sites(results)
+    else:
+        z,y,x,probability_density = results["dimension_0"],results["dimension_1"],results["dimension_2"],results["probability_density"]
     axes_limit = (2**n_qubits)-1
     if title is None:
         title = "diffusion on an {0}x{0}x{0} grid".format(axes_limit+1)
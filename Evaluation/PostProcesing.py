@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 import re
 import glob
+from DiffusionProject.Evaluation.ResultStore import ResultStore
+from DiffusionProject.Evaluation.DenseTensor import open_dense_tensor
 
 
 def rebuild_counts_from_csv(path,n_dims, shots):
@@ -52,6 +55,102 @@ def get_stats_from_counts_dataframe(counts_dataframe: pd.DataFrame)-> dict:
     results_dict['var'] = counts_dataframe.var()
     return results_dict
     
+def _sparse_moments(results, shots) -> tuple:
+    """the labels, total weight, mean, covariance sum and central moment sums of `dimension_i`/`probability_density` results"""
+    columns = [column for column in results if str(column).startswith("dimension_")]
+    labels = ["d{}".format(column.split("_")[-1]) for column in columns]
+    positions = np.array([np.asarray(results[column], dtype = float) for column in columns])
+    weights = np.asarray(results["probability_density"], dtype = float)
+    if shots is not None:
+        weights = weights*shots
+    total_weight = weights.sum()
+
+    mean = positions @ weights/total_weight
+    centred = positions - mean[:, None]
+    covariance_sum = (centred*weights) @ centred.T
+    central_moment_sums = {order: (centred**order) @ weights for order in [2, 3, 4]}
+    return labels, total_weight, mean, covariance_sum, central_moment_sums
+
+
+def _dense_pair_marginal(tensor, dimension, other, block_size = 2**22) -> np.ndarray:
+    """
+    the float64 marginal of `tensor` over the axes `dimension` < `other`, summed `block_size` elements of the first axis at a time
+    so a memory-mapped tensor is read without converting it as a whole
+    """
+    summed_axes = tuple(axis for axis in range(tensor.ndim) if axis not in (dimension, other))
+    n_rows = max(1, block_size//max(1, int(np.prod(tensor.shape[1:]))))
+    pair_marginal = np.zeros((tensor.shape[dimension], tensor.shape[other]))
+    for start in range(0, tensor.shape[0], n_rows):
+        block_marginal = tensor[start:start+n_rows].sum(axis = summed_axes, dtype = np.float64)
+        if dimension == 0:
+            pair_marginal[start:start+n_rows] += block_marginal
+        else:
+            pair_marginal += block_marginal
+    return pair_marginal
+
+
+def _dense_moments(tensor, shots) -> tuple:
+    """
+    as `_sparse_moments` for a dense probability tensor, using its one and two dimensional marginals.
+    The marginals are summed in float64 straight from the tensor, so a memmap is never copied into memory
+    """
+    n_dims = tensor.ndim
+    labels = ["d{}".format(dimension) for dimension in range(n_dims)]
+    scale = shots if shots is not None else 1.0
+    total_weight = tensor.sum(dtype = np.float64)*scale
+
+    marginals = [tensor.sum(axis = tuple(axis for axis in range(n_dims) if axis != dimension), dtype = np.float64)*scale for dimension in range(n_dims)]
+    positions = [np.arange(tensor.shape[dimension], dtype = float) for dimension in range(n_dims)]
+    mean = np.array([positions[dimension] @ marginals[dimension] for dimension in range(n_dims)])/total_weight
+    centred = [positions[dimension] - mean[dimension] for dimension in range(n_dims)]
+
+    covariance_sum = np.zeros((n_dims, n_dims))
+    for dimension in range(n_dims):
+        covariance_sum[dimension, dimension] = (centred[dimension]**2) @ marginals[dimension]
+        for other in range(dimension+1, n_dims):
+            pair_marginal = _dense_pair_marginal(tensor, dimension, other)*scale
+            covariance_sum[dimension, other] = covariance_sum[other, dimension] = centred[dimension] @ pair_marginal @ centred[other]
+    central_moment_sums = {order: np.array([(centred[dimension]**order) @ marginals[dimension] for dimension in range(n_dims)]) for order in [2, 3, 4]}
+    return labels, total_weight, mean, covariance_sum, central_moment_sums
+
+
+def get_weighted_stats_from_results(results, shots = None, n_steps = None) -> dict:
+    """
+    computes the statistics of `get_stats_from_counts_dataframe` straight from the `probability_density` column of processed results
+    (a `dimension_i`/`probability_density` dictionary or dataframe) or from a dense probability tensor, without expanding them into samples.
+    With `shots` every site is weighted by `density*shots` samples and var/cov are sample estimates as in pandas, without it they are exact moments.
+    Also returns the skewness, excess kurtosis and, if `n_steps` is passed, the diffusion tensor cov/(2*n_steps)
+    """
+    if isinstance(results, np.ndarray):
+        labels, total_weight, mean, covariance_sum, central_moment_sums = _dense_moments(results, shots)
+    else:
+        labels, total_weight, mean, covariance_sum, central_moment_sums = _sparse_moments(results, shots)
+    ddof = 1 if shots is not None else 0
+    cov = covariance_sum/(total_weight - ddof)
+    central_moments = {order: moment_sum/total_weight for order, moment_sum in central_moment_sums.items()}
+
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        std = np.sqrt(np.diag(cov))
+        corr = cov/np.outer(std, std)
+        skew = central_moments[3]/central_moments[2]**1.5
+        kurtosis = central_moments[4]/central_moments[2]**2 - 3
+
+    results_dict = {}
+    results_dict["corr"] = pd.DataFrame(corr, index = labels, columns = labels)
+    results_dict["cov"] = pd.DataFrame(cov, index = labels, columns = labels)
+    results_dict["mean"] = pd.Series(mean, index = labels)
+    results_dict["var"] = pd.Series(np.diag(cov), index = labels)
+    results_dict["skew"] = pd.Series(skew, index = labels)
+    results_dict["kurtosis"] = pd.Series(kurtosis, index = labels)
+    if n_steps:
+        results_dict["diffusion_tensor"] = results_dict["cov"]/(2*n_steps)
+    return results_dict
+
+
+def get_weighted_stats_from_csv(path, shots = None, n_steps = None) -> dict:
+    return get_weighted_stats_from_results(pd.read_csv(path), shots = shots, n_steps = n_steps)
+
+
 def get_n_steps_from_filepath(filepath)-> int:
     filename = filepath.split('/')[-1]
     return int(re.findall(r"\d+_steps",filename)[0].split('_')[0])
@@ -67,24 +166,31 @@ def get_n_dims_from_path(path)-> int:
     return ndims
 
 def extract_mean_variance_vs_nsteps(directory_path: str,dimension = 0):
-    nshots = get_n_shots_from_path(directory_path)
+    """
+    returns the step counts, variances and means of `dimension` of every experiment in `directory_path`.
+    Experiments are read from their `ResultStore` or, with `DenseOutput`, from their memory-mapped probability tensors (exact moments).
+    Experiments saved as per-step CSV files are still read from the CSVs
+    """
     ndims = get_n_dims_from_path(directory_path)
     assert dimension < ndims, "queried dimension exceeds experiment space"
-    files = glob.glob(directory_path+'/*/data/**.csv')
-    files.sort(key = get_n_steps_from_filepath)
-
-    n_steps = []
-    variance = []
-    mean = []
-
-    for filepath in files:
-        filename = filepath.split('/')[-1]
-        nsteps = int(re.findall(r"\d+_steps",filename)[0].split('_')[0])
-        rebuilt_dict = rebuild_counts_from_csv(filepath,n_dims=ndims,shots=nshots)
-        stats = get_stats_from_counts_dict(rebuilt_dict)
-        variance.append(stats['var'][dimension])
-        mean.append(stats['mean'][dimension])
-        n_steps.append(nsteps)
+
+    step_stats = []
+    for store_path in glob.glob(directory_path+'/*/data/results.npz'):
+        for nsteps, (results, metadata) in ResultStore(store_path).load_all().items():
+            step_stats.append((nsteps, get_weighted_stats_from_results(results, shots = metadata.get("shots"))))
+
+    for tensor_path in glob.glob(directory_path+'/*/data/*_probabilities.npy'):
+        step_stats.append((get_n_steps_from_filepath(tensor_path), get_weighted_stats_from_results(open_dense_tensor(tensor_path))))
+
+    csv_files = glob.glob(directory_path+'/*/data/**.csv')
+    if csv_files:
+        nshots = get_n_shots_from_path(directory_path)
+        for filepath in csv_files:
+            step_stats.append((get_n_steps_from_filepath(filepath), get_weighted_stats_from_csv(filepath, shots = nshots)))
+    step_stats.sort(key = lambda item: item[0])
+
+    n_steps = [nsteps for nsteps, _ in step_stats]
+    variance = [stats['var']["d{}".format(dimension)] for _, stats in step_stats]
+    mean = [stats['mean']["d{}".format(dimension)] for _, stats in step_stats]
 
     return n_steps, variance, mean
-     
@@ -0,0 +1,141 @@
+import os
+import json
+import fcntl
+import contextlib
+import zipfile
+import numpy as np
+
+
+class ResultStore:
+    """
+    Stores the distribution of every step count of an experiment as typed arrays in a single uncompressed NPZ file.
+
+    Each step is appended as the members `step_<n>/<column>.npy` (the `dimension_i` and `probability_density` columns of
+    `QuantumWalk.process_counts`) and `step_<n>/metadata.json`. Members are stored uncompressed, so a single column can be
+    memory-mapped straight out of the archive without reading the rest of the sweep.
+
+    Experiments running in parallel may share a store, so writers hold an exclusive lock on `<path>.lock` and readers a shared one,
+    a reader never sees an archive that is being rewritten.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): the NPZ file of the store, created on the first `append`
+        """
+        self.path = path
+
+    @staticmethod
+    def step_prefix(n_steps) -> str:
+        return "step_{}/".format(n_steps)
+
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        """holds the `fcntl` lock `operation` (LOCK_SH or LOCK_EX) on the lock file of the store"""
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, operation)
+            yield
+
+    def _names(self) -> list:
+        """the members of the archive, callers hold the lock"""
+        if not os.path.exists(self.path):
+            return []
+        with zipfile.ZipFile(self.path) as archive:
+            return archive.namelist()
+
+    def _read_names(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        with self._locked(fcntl.LOCK_SH):
+            return self._names()
+
+    @property
+    def steps(self) -> list:
+        """the step counts held in the store, in ascending order"""
+        return sorted({int(name.split("/")[0].split("_")[1]) for name in self._read_names() if name.startswith("step_")})
+
+    def __contains__(self, n_steps) -> bool:
+        return self.step_prefix(n_steps) + "metadata.json" in self._read_names()
+
+    def _remove_step(self, n_steps) -> None:
+        """rewrites the archive without the members of `n_steps`, zip archives cannot delete members in place"""
+        prefix = self.step_prefix(n_steps)
+        temporary_path = self.path + ".tmp"
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(temporary_path, "w", zipfile.ZIP_STORED) as destination:
+            for info in source.infolist():
+                if not info.filename.startswith(prefix):
+                    destination.writestr(info, source.read(info.filename))
+        os.replace(temporary_path, self.path)
+
+    def append(self, n_steps, results: dict, metadata: dict = None) -> None:
+        """
+        appends the processed `results` of `n_steps` steps to the store, replacing any results already stored for `n_steps`.
+        `metadata` (e.g shots, coin, boundaries) must be JSON serialisable
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        with self._locked(fcntl.LOCK_EX):
+            self._append(n_steps, results, metadata)
+
+    def _append(self, n_steps, results: dict, metadata: dict = None) -> None:
+        # the exclusive lock is already held, so the members are read without `__contains__`
+        if self.step_prefix(n_steps) + "metadata.json" in self._names():
+            self._remove_step(n_steps)
+
+        prefix = self.step_prefix(n_steps)
+        metadata = dict(metadata or {})
+        metadata["n_steps"] = n_steps
+        metadata["columns"] = list(results.keys())
+        with zipfile.ZipFile(self.path, "a", zipfile.ZIP_STORED) as archive:
+            for column, values in results.items():
+                values = np.asarray(values)
+                if column.startswith("dimension_"):
+                    values = values.astype(np.int64)
+                with archive.open(prefix + column + ".npy", "w", force_zip64 = True) as member:
+                    np.lib.format.write_array(member, np.ascontiguousarray(values), allow_pickle = False)
+            archive.writestr(prefix + "metadata.json", json.dumps(metadata))
+
+    def metadata(self, n_steps) -> dict:
+        with self._locked(fcntl.LOCK_SH), zipfile.ZipFile(self.path) as archive:
+            return json.loads(archive.read(self.step_prefix(n_steps) + "metadata.json"))
+
+    def _memmap_member(self, info) -> np.ndarray:
+        """memory-maps an uncompressed `.npy` member of the archive"""
+        with open(self.path, "rb") as file:
+            # the member data follows its 30 byte local header, file name and extra field
+            file.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(file.read(4), dtype = "<u2")
+            file.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(file)
+            read_array_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_array_header(file)
+            offset = file.tell()
+        if int(np.prod(shape)) == 0:
+            return np.zeros(shape, dtype = dtype)
+        return np.memmap(self.path, dtype = dtype, mode = "r", offset = offset, shape = shape, order = "F" if fortran_order else "C")
+
+    def _load(self, archive, n_steps, mmap) -> dict:
+        prefix = self.step_prefix(n_steps)
+        columns = json.loads(archive.read(prefix + "metadata.json"))["columns"]
+        results = {}
+        for column in columns:
+            info = archive.getinfo(prefix + column + ".npy")
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                results[column] = self._memmap_member(info)
+            else:
+                with archive.open(info) as member:
+                    results[column] = np.lib.format.read_array(member, allow_pickle = False)
+        return results
+
+    def load(self, n_steps, mmap = True) -> dict:
+        """returns the columns stored for `n_steps`, memory-mapped from the archive unless `mmap` is False"""
+        with self._locked(fcntl.LOCK_SH), zipfile.ZipFile(self.path) as archive:
+            return self._load(archive, n_steps, mmap)
+
+    def load_all(self, mmap = True) -> dict:
+        """returns the columns and metadata of every stored step count as (columns, metadata) tuples keyed by step count"""
+        with self._locked(fcntl.LOCK_SH), zipfile.ZipFile(self.path) as archive:
+            steps = sorted({int(name.split("/")[0].split("_")[1]) for name in archive.namelist() if name.startswith("step_")})
+            return {n_steps: (self._load(archive, n_steps, mmap), json.loads(archive.read(self.step_prefix(n_steps) + "metadata.json"))) for n_steps in steps}
@@ -1,10 +1,12 @@
 from DiffusionProject.Algorithms.Coins import HadamardCoin
 from DiffusionProject.Backends.backend import Backend
-from DiffusionProject.Algorithms.Boundaries import Boundary, OneWayBoundaryControl, BoundaryControl
+from DiffusionProject.Backends.transpile_cache import transpile_cache
+from DiffusionProject.Algorithms.Boundaries import Boundary, BoundaryControl
 from DiffusionProject.Evaluation.Experiments import Experiment, SingleExperiment
 from DiffusionProject.JobManager.experimentParser import ExperimentParser
 from DiffusionProject.Utils.configCodes import coin_class_dict, walk_type_dict, backend_dict
 from DiffusionProject.Algorithms.Decoherence import CoinDecoherenceCycle
+from DiffusionProject.JobManager.work_queue import WorkQueue
 from math import pi
 
 
@@ -14,7 +16,8 @@ args = parser.parse_args()
 backend = backend_dict.get(args.get("backend"))
 if backend:
     backend = backend()
-BACKEND = Backend(use_GPU=args.get("GPU"), IBMQ_device_name=args.get("IBMDeviceName"),backend=backend)
+BACKEND = Backend(use_GPU=args.get("GPU"), IBMQ_device_name=args.get("IBMDeviceName"),backend=backend, execution_profile=args.get("execution_profile"))
+transpile_cache.directory = args.get("transpile_cache_dir")
 
 def generate_boundary_control_code_dict():
     boundaries = {}
@@ -101,6 +104,8 @@ kwargs["boundary_controls"] = generate_boundary_controls()
 kwargs["coin_class"] = coin_class_dict.get(args.get("coin"), HadamardCoin)
 kwargs["coin_kwargs"] = generate_coin_kwargs()
 kwargs["backend"] = BACKEND
+kwargs["engine"] = args.get("engine")
+kwargs["shift_synthesis"] = args.get("shift_synthesis")
 
 # Generate Coin decoherence Cycle
 if args.get("decohere_coin_only"):
@@ -125,7 +130,30 @@ if args.get("decohere_coin_only") == False:
 else:
     decoherence_intervals = None
 
-Experiment = SingleExperiment(walk,args["ndims"],args["nqubits"],args["shots"],args["nsteps"],decoherence_intervals=decoherence_intervals)
-Experiment.run_locally()
+Experiment = SingleExperiment(walk,args["ndims"],args["nqubits"],args["shots"],args["nsteps"],decoherence_intervals=decoherence_intervals,mode=args["mode"],max_parallel_experiments=args["max_parallel_experiments"],decoherence_batch_size=args.get("decoherence_batch_size"),dense_output=args.get("dense_output"),directory_path=args["savepath"],plot=not args.get("no_plots"),memory_budget=args.get("memory"))
+step_numbers = args.get("sweep_steps") or [args["nsteps"]]
+
+# claim the unit from the work queue so completed units are skipped when a sweep is resubmitted
+work_queue = WorkQueue(args["work_queue"], stale_after=args.get("stale_after")) if args.get("work_queue") else None
+unit = work_queue.claim(step_numbers=step_numbers) if work_queue else None
+if work_queue and unit is None:
+    print("{} is completed or claimed by another worker, skipping".format(step_numbers))
+else:
+    try:
+        if args.get("sweep_steps"):
+            Experiment.run_sweep_locally(args["sweep_steps"])
+        else:
+            Experiment.run_locally()
+        # the unit is only completed once its results are saved under the savepath, so a lost run is rerun on resume
+        missing_steps = [n_steps for n_steps in step_numbers if not Experiment.has_results(n_steps)]
+        assert not missing_steps, "no results saved in {} for steps {}".format(Experiment.path, missing_steps)
+    except Exception as error:
+        if unit:
+            work_queue.fail(unit[0], repr(error))
+        raise
+    if unit:
+        work_queue.complete(unit[0])
+
+print(transpile_cache.report())
 
 
@@ -0,0 +1,72 @@
+import io
+import time
+import argparse
+import contextlib
+from DiffusionProject.Backends.execution_profiles import ProfileCache, candidate_profiles
+from DiffusionProject.Evaluation.MemoryEval import circuit_qubits
+from DiffusionProject.JobManager.config import Config
+
+
+def time_profile(config: Config, profile: dict, n_steps, shots = None, repeats = 3) -> float:
+    """
+    the fastest wall time in seconds of `repeats` runs of the config's walk for `n_steps` with the Aer options `profile`.
+    The walk is run once beforehand so the transpilation is not timed
+    """
+    shots = shots or config.experiment_params.get("Shots",1024)
+    mode = config.experiment_params.get("ResultMode","counts")
+    with contextlib.redirect_stdout(io.StringIO()):
+        walk = config.gen_walk_from_config(config.gen_backend_from_config(profile))
+        walk.run_experiment(n_steps, shots, mode=mode).result()
+
+        times = []
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            walk.run_experiment(n_steps, shots, mode=mode).result()
+            times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+def autotune(config: Config, n_steps = 5, shots = None, repeats = 3, candidates = None, cache_path = None, verbose = True) -> dict:
+    """
+    times every candidate profile (by default `candidate_profiles()`) on the walk of `config` and stores the fastest in the
+    `ProfileCache` at `cache_path`, by default `JobParams.ProfileCache`, under the walk type and circuit width. Returns the fastest profile
+    """
+    if candidates is None:
+        candidates = candidate_profiles()
+    walk = config.gen_walk_from_config()
+    walk_type, n_qubits = type(walk).__name__, circuit_qubits(walk)
+    if verbose:
+        print("tuning {} candidate profiles on {} with {} qubits over {} steps".format(len(candidates), walk_type, n_qubits, n_steps))
+
+    timings = []
+    for profile in candidates:
+        try:
+            seconds = time_profile(config, profile, n_steps, shots, repeats)
+        except Exception as error:
+            seconds = None
+            if verbose:
+                print("{}: {}".format(profile, repr(error)))
+        timings.append((profile, seconds))
+        if verbose and seconds is not None:
+            print("{}: {:.3f}s".format(profile, seconds))
+
+    completed = [timing for timing in timings if timing[1] is not None]
+    assert completed, "every candidate profile failed"
+    fastest_profile, fastest_time = min(completed, key = lambda timing: timing[1])
+    cache = ProfileCache(cache_path or config.job_params.get("ProfileCache"))
+    cache.store(walk_type, n_qubits, fastest_profile, timings)
+    if verbose:
+        print("fastest profile {} in {:.3f}s, saved to {}".format(fastest_profile, fastest_time, cache.path))
+    return fastest_profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find the fastest Aer execution profile for the walk of a config, used by configs with `ExecutionProfile: auto`')
+    parser.add_argument('--config', action='store', type=str, required=True)
+    parser.add_argument('--steps', action='store', type=int, default=5)
+    parser.add_argument('--shots', action='store', type=int)
+    parser.add_argument('--repeats', action='store', type=int, default=3)
+    parser.add_argument('--cache', action='store', type=str, help='the profile cache, `JobParams.ProfileCache` of the config by default')
+    parser.add_argument('--single_precision', action='store_true', default=False, help='also try single precision amplitudes')
+    args = parser.parse_args()
+    autotune(Config(args.config), args.steps, args.shots, args.repeats, candidate_profiles(single_precision=args.single_precision), args.cache)
@@ -1,17 +1,39 @@
+import os
+import json
 import yaml
 import math
+import shutil
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from math import pi
 from DiffusionProject.Utils.boundary_generator import BoundaryGenerator
 from DiffusionProject.Algorithms.Boundaries import Boundary, BoundaryControl
 from DiffusionProject.Backends.backend import Backend
+from DiffusionProject.Backends.transpile_cache import transpile_cache
+from DiffusionProject.Backends.execution_profiles import ProfileCache, aer_options
 from DiffusionProject.Evaluation.Experiments import  SingleExperiment
+from DiffusionProject.Evaluation.MemoryEval import estimate_memory, circuit_qubits
 from DiffusionProject.Utils.configCodes import walk_type_dict, backend_dict,coin_class_dict
 from DiffusionProject.Algorithms.Decoherence import CoinDecoherenceCycle
+from DiffusionProject.JobManager.work_queue import WorkQueue
+
+
+def _run_local_worker(config_path, savepath, n_threads):
+    """a worker of `Config.run_locally`, runs units claimed from the work queue under `savepath` in one warm process until none are left"""
+    # imported here as the worker module imports this one
+    from DiffusionProject.JobManager.worker import WarmWorker
+    worker = WarmWorker(n_threads=n_threads)
+    return worker.run_config(Config(config_path, savepath))
 
 
 class Config:
-    def __init__(self,path) -> None:
+    def __init__(self,path, savepath = None) -> None:
+        """
+        Args:
+            path (str): the config `.yml` file\n
+            savepath (str): the output directory of an earlier run to resume, generated from the config `Name` and the date by default
+        """
         self.__config = self.parse_config(path)
         self.experiment_params = self.__config.get("ExperimentParams")
         self.__job_params = self.__config.get("JobParams", {})
@@ -19,7 +41,10 @@ class Config:
         self.n_dimensional_qubits = self.experiment_params.get("NQubits")
         self.boundaries = self.experiment_params.get("Boundaries")
         self.job_files = []
-        self.__savepath = None
+        self.__savepath = savepath
+        # built from the walk, so only estimated once per config
+        self.__required_mem = None
+        self.__execution_profile = None
         self.path = path
         self.output_dir = self.__config.get("OutputPath","$WORK/Results")
 
@@ -34,6 +59,41 @@ class Config:
         return self.__savepath
 
 
+    @property
+    def job_params(self) -> dict:
+        return self.__job_params
+
+    @property
+    def walltime(self) -> int:
+        """the walltime of each PBS job in hours"""
+        if self.__job_params.get("UseGPU", False):
+            return min(self.__job_params.get('Walltime',24),24)
+        return min(self.__job_params.get('Walltime',72),72)
+
+    @property
+    def work_queue_path(self) -> str:
+        """the SQLite file of the work queue, `work_queue.db` in `savepath`"""
+        return os.path.expandvars(self.savepath) + "/work_queue.db"
+
+    @property
+    def work_queue(self) -> WorkQueue:
+        """
+        the queue of the experiment units of this config, saved at `work_queue_path`.
+        Units left running for longer than a job's walltime are claimed again
+        """
+        return WorkQueue(self.work_queue_path, stale_after=self.stale_after)
+
+    @property
+    def stale_after(self) -> int:
+        """the seconds after which a running unit is claimed again, a unit still running after a job's walltime was killed with it"""
+        return 3600*self.walltime
+
+    def _build_work_queue(self) -> WorkQueue:
+        """adds every unit of the config to the work queue, units completed by an earlier run are kept"""
+        work_queue = self.work_queue
+        work_queue.add_units(self._generate_work_units(), output_path=os.path.expandvars(self.savepath))
+        return work_queue
+
     def _build_job_filetree(self):
         """generate a directory to save job files"""
         subprocess.run("mkdir jobs", shell=True)
@@ -55,21 +115,28 @@ class Config:
         
         return data
 
+    @property
+    def max_steps(self) -> int:
+        """the largest step count run by this config"""
+        if self.experiment_params.get("Type","Single") == "Single":
+            return self.experiment_params["NSteps"]
+        return max(max(batch) for batch in self._generate_batch_steps())
+
     @property
     def required_mem(self):
-        """The maximum amount of system memory required to simulate the quantum system described by this config"""
-        return (10**-9)*8*2**self.n_system_qubits
+        """
+        The predicted peak memory in GB of the largest experiment of this config, estimated from the registers of its walk and
+        the simulation method by `DiffusionProject.Evaluation.MemoryEval.estimate_memory`. Only estimated once, as it builds the walk
+        """
+        if self.__required_mem is None:
+            mode = "probabilities" if self.experiment_params.get("DenseOutput", False) and not self.experiment_params.get("DecoherenceIntervals") else self.experiment_params.get("ResultMode","counts")
+            self.__required_mem = estimate_memory(self.gen_walk_from_config(), mode, self.experiment_params.get("Shots",1024), self.max_steps, self.__job_params.get("MaxParallelExperiments",1))
+        return self.__required_mem
 
     @property
     def n_system_qubits(self):
-        """The theoretical total number of qubits required to simulate the system, does not include overheads"""
-        n_spacial_qubits = self.n_dims * self.n_dimensional_qubits
-        n_boundary_qubits = 0
-
-        for boundary in self.boundaries:
-            n_boundary_qubits += boundary.get("n_qubits",0)
-        
-        return n_boundary_qubits + n_spacial_qubits
+        """The total number of qubits in the circuit of the walk: the state, coin, boundary control and ancilla registers"""
+        return circuit_qubits(self.gen_walk_from_config())
 
     def generate_boundary_controls(self):
         """generates boundary controls from config params"""
@@ -152,24 +219,59 @@ class Config:
         if use_GPU:
             python_call = python_call + ' --GPU'
         if self.experiment_params.get("Shots"):
-            python_call = python_call + ' --s {}'.format(self.experiment_params.get("Shots"))
+            python_call = python_call + ' --shots {}'.format(self.experiment_params.get("Shots"))
+        if self.experiment_params.get("ResultMode"):
+            python_call = python_call + ' --mode {}'.format(self.experiment_params.get("ResultMode"))
+        if self.experiment_params.get("DenseOutput"):
+            python_call = python_call + ' --dense_output'
+        if not self.experiment_params.get("Plot", True):
+            python_call = python_call + ' --no_plots'
         if IBM_device_name:
             python_call = python_call + ' --IBMDeviceName {}'.format(IBM_device_name)
         if self.__job_params.get("Backend"):
             python_call = python_call + ' --backend {}'.format(self.__job_params.get("Backend"))
         if self.experiment_params.get("IndependantWalk"):
             python_call = python_call + ' --independant'
+        if self.__job_params.get("Engine"):
+            python_call = python_call + ' --engine {}'.format(self.__job_params.get("Engine"))
+        if self.__job_params.get("ShiftSynthesis"):
+            python_call = python_call + ' --shift_synthesis {}'.format(self.__job_params.get("ShiftSynthesis"))
+        if self.__job_params.get("TranspileCacheDir"):
+            python_call = python_call + ' --transpile_cache_dir {}'.format(self.__job_params.get("TranspileCacheDir"))
+        if self.__job_params.get("MaxParallelExperiments"):
+            python_call = python_call + ' --max_parallel_experiments {}'.format(self.__job_params.get("MaxParallelExperiments"))
+        if self.__job_params.get("DecoherenceBatchSize"):
+            python_call = python_call + ' --decoherence_batch_size {}'.format(self.__job_params.get("DecoherenceBatchSize"))
+        if self.execution_profile and not IBM_device_name:
+            python_call = python_call + " --execution_profile '{}'".format(json.dumps(self.execution_profile))
+        if not IBM_device_name:
+            # experiments save straight into `savepath`, so every job appends its steps to the shared result stores
+            python_call = python_call + ' --savepath {}'.format(self.savepath)
+            python_call = python_call + ' --work_queue {} --stale_after {}'.format(self.work_queue_path, self.stale_after)
+        if not IBM_device_name and not use_GPU:
+            python_call = python_call + ' --memory {}'.format(self.pbs_memory)
 
         return python_call
 
     def _write_experiment(self, file, n_steps, use_GPU = False):
         file.write(self._write_experiment_string(n_steps, use_GPU))
         file.write("\n")
-        self._write_file_transfer(file)
 
+    def _write_sweep(self, file, step_numbers, use_GPU = False):
+        """writes a single call that runs every step count in `step_numbers` in one execution"""
+        file.write(self._write_experiment_string(max(step_numbers), use_GPU))
+        file.write(' --sweep_steps {}'.format(" ".join(str(n_steps) for n_steps in step_numbers)))
+        file.write("\n")
 
-    def _write_file_transfer(self,file):
-        file.write('cp -r * {}\n'.format(self.savepath))
+
+    def _write_warm_worker(self, file, step_numbers):
+        """writes a single call that runs every step count in `step_numbers` in one warm worker process, saving straight to `savepath`"""
+        worker_path = '/rds/general/user/db3115/home/DiffusionProject/JobManager/worker.py'
+        config_path = '{}/{}'.format(self.savepath, os.path.basename(self.path))
+        file.write('python3 {} --config {} --savepath {} --steps {}'.format(worker_path, config_path, self.savepath, " ".join(str(n_steps) for n_steps in step_numbers)))
+        if not self.__job_params.get("UseGPU", False):
+            file.write(' --threads {}'.format(self.__job_params.get("NCPUs", 8)))
+        file.write("\n")
 
     def _generate_batch_steps(self) -> list:
         """Divides up the experiments into batches"""
@@ -193,12 +295,19 @@ class Config:
         
 
     def _generate_job_files(self):
-        """generates the `.pbs` job files required to tun experiments"""
+        """generates the `.pbs` job files required to tun experiments, skipping step counts the work queue records as completed"""
+        work_queue = self._build_work_queue()
         if self.experiment_params.get("Type","Single") == "Single":
-            self._generate_job_file([self.experiment_params["NSteps"]])
+            batches = [[self.experiment_params["NSteps"]]]
         else:
             batches = self._generate_batch_steps()
-            for batch in batches:
+
+        for batch in batches:
+            if self.__job_params.get("SweepInOneExecution", False):
+                batch = [] if work_queue.is_completed(batch) else batch
+            else:
+                batch = [n_steps for n_steps in batch if not work_queue.is_completed([n_steps])]
+            if batch:
                 self._generate_job_file(batch)
 
     def _generate_job_file(self,step_numbers):
@@ -216,14 +325,12 @@ class Config:
                 nGPUs = self.__job_params.get("NGPUs", 1)
                 nCPUs = 4*nGPUs
                 mem = 24*nGPUs
-                walltime = min(self.__job_params.get('Walltime',24),24)
                 f.write('#PBS -lselect=1:ncpus={}:mem={}gb:ngpus={}:gpu_type={}\n'.format(nCPUs,mem,nGPUs,GPU))
             else:
-                walltime = min(self.__job_params.get('Walltime',72),72)
                 nCPUs = self.__job_params.get("NCPUs", 8)
-                mem = max(math.ceil(self.required_mem), self.__job_params.get("Memory",0))
+                mem = self.pbs_memory
                 f.write('#PBS -lselect=1:ncpus={}:mem={}gb\n'.format(nCPUs,mem))
-            f.write('#PBS -lwalltime={}:00:00\n'.format(walltime))
+            f.write('#PBS -lwalltime={}:00:00\n'.format(self.walltime))
 
             # Keep tabs on job ID
             f.write('echo $PBS_JOBID >> {}/job_list.txt\n'.format(self.savepath))
@@ -231,12 +338,22 @@ class Config:
             f.write('source $WORK/test-env/bin/activate\n')
             f.write('export PYTHONPATH="${PYTHONPATH}:/rds/general/user/db3115/home/"\n')
             # run experiments
-            for n_steps in step_numbers:
-                self._write_experiment(f,n_steps, use_GPU)
+            if self.__job_params.get("WarmWorker", False):
+                self._write_warm_worker(f, step_numbers)
+            elif self.__job_params.get("SweepInOneExecution", False):
+                self._write_sweep(f, step_numbers, use_GPU)
+            else:
+                for n_steps in step_numbers:
+                    self._write_experiment(f,n_steps, use_GPU)
             f.write('echo "BATCH COMPLETE"\n')
 
         self.job_files.append(filename)
 
+    @property
+    def pbs_memory(self) -> int:
+        """the memory in GB requested by each CPU job, the estimated `required_mem` or `JobParams.Memory` if it is larger"""
+        return max(math.ceil(self.required_mem), self.__job_params.get("Memory",0))
+
     def _submit_job_files(self,verbose = True):
         for jobfile in self.job_files:
             subprocess.run("qsub jobs/{}".format(jobfile),shell=True)
@@ -256,6 +373,74 @@ class Config:
         if not self.__config.get("KeepJobFiles", False):
             self._remove_job_files()
 
+    @staticmethod
+    def system_memory():
+        """The physical memory of this machine in GB"""
+        return (10**-9)*os.sysconf("SC_PAGE_SIZE")*os.sysconf("SC_PHYS_PAGES")
+
+    def _generate_work_units(self) -> list:
+        """the step numbers run by each execution of the walk, one unit per step count unless `SweepInOneExecution` is set"""
+        if self.experiment_params.get("Type","Single") == "Single":
+            batches = [[self.experiment_params["NSteps"]]]
+        else:
+            batches = self._generate_batch_steps()
+
+        if self.__job_params.get("SweepInOneExecution", False):
+            return batches
+        return [[n_steps] for batch in batches for n_steps in batch]
+
+    def local_workers(self, n_jobs, n_workers = None) -> int:
+        """
+        The number of experiments to run concurrently: one per CPU (or `n_workers`), limited so that `required_mem` of every
+        running experiment fits into `JobParams.Memory` GB, or the system memory if it is not set
+        """
+        memory = self.__job_params.get("Memory") or self.system_memory()
+        memory_limit = max(1, int(memory//max(self.required_mem, 10**-9)))
+        if n_workers is None:
+            n_workers = self.__job_params.get("NWorkers") or os.cpu_count() or 1
+        return max(1, min(n_workers, memory_limit, n_jobs))
+
+    def build_local_save_directory(self):
+        """generate the output directory of a local run, with the same layout as `_build_save_directory`"""
+        savepath = os.path.expandvars(self.savepath)
+        os.makedirs(savepath, exist_ok=True)
+        if not os.path.exists(os.path.join(savepath, os.path.basename(self.path))):
+            shutil.copy(self.path, savepath)
+
+    def run_locally(self, n_workers = None, verbose = True):
+        """
+        runs every experiment of the config on a local process pool instead of PBS, saving to the same `savepath` layout.
+        Workers claim units from the work queue, so units completed by an earlier run are skipped.
+        Each worker's simulator gets an equal share of the CPUs
+        """
+        savepath = os.path.expandvars(self.savepath)
+        self.build_local_save_directory()
+
+        work_queue = self._build_work_queue()
+        n_units = work_queue.status()[WorkQueue.PENDING]
+        n_workers = self.local_workers(max(n_units, 1), n_workers)
+        n_threads = max(1, (os.cpu_count() or 1)//n_workers)
+        if verbose:
+            print("running {} units on {} local workers with {} threads each".format(n_units, n_workers, n_threads))
+
+        completed_units = []
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_run_local_worker, self.path, savepath, n_threads) for _ in range(n_workers)]
+            for future in as_completed(futures):
+                completed_units += future.result()
+        if verbose:
+            print(work_queue.report())
+        return completed_units
+
+    def resume(self):
+        """
+        resumes a run of this config in `savepath` after a crash, rerunning the units that did not complete.
+        Only call this once no worker of the earlier run is still running
+        """
+        self.work_queue.requeue_running()
+        self.work_queue.retry_failed()
+        self.run()
+
     def generate_initial_states(self):
         if self.experiment_params.get("InitialState","auto") == "auto":
             middle_bitstring = "0"+"1"*(self.n_dimensional_qubits-1)
@@ -264,14 +449,69 @@ class Config:
         else:
             return self.experiment_params.get("InitialState").split()
 
-    def gen_experiment_from_config(self):
-        """run a single experiment"""
-        assert self.experiment_params.get("Type","Single") == "Single", "Currently only supports single jobs"
-        device_name = self.__job_params.get('IBMDeviceName')
+    def generate_coin_kwargs(self) -> dict:
+        """parses `CoinKwargs`, e.g "theta=pi/4,xi=0,zeta=0", the format of the `--coin_kwargs` of the driver"""
+        kwargs_str = self.experiment_params.get("CoinKwargs")
+        if kwargs_str is None:
+            return {}
+
+        kwargs_dict = {}
+        for keyword_arg in kwargs_str.split(","):
+            param,value = keyword_arg.split('=')
+            kwargs_dict[param] = eval(value, {"pi": pi})
+        return kwargs_dict
+
+    def gen_experiment_from_config(self, n_steps = None, directory_path = None, backend = None):
+        """
+        generates the experiment of `n_steps` steps, by default the `NSteps` of a single experiment config.
+        Results are saved in `directory_path`, by default the config `OutputPath`. `backend` is created from the config if not passed
+        """
+        if n_steps is None:
+            assert self.experiment_params.get("Type","Single") == "Single", "Currently only supports single jobs"
+            n_steps = self.experiment_params["NSteps"]
+        if directory_path is None:
+            directory_path = self.__config.get("OutputPath")
+
+        if backend is None:
+            backend = self.gen_backend_from_config()
+        transpile_cache.directory = self.__job_params.get("TranspileCacheDir")
+
+        walk = self.gen_walk_from_config(backend)
+        decoherence_intervals = None if self.experiment_params.get("DecohereCoinOnly") else self.experiment_params.get("DecoherenceIntervals")
+        experiment = SingleExperiment(walk,self.n_dims,self.n_dimensional_qubits,self.experiment_params.get("Shots",1024),n_steps,decoherence_intervals=decoherence_intervals,directory_path=directory_path,mode=self.experiment_params.get("ResultMode","counts"),max_parallel_experiments=self.__job_params.get("MaxParallelExperiments",1),decoherence_batch_size=self.__job_params.get("DecoherenceBatchSize"),dense_output=self.experiment_params.get("DenseOutput",False),plot=self.experiment_params.get("Plot",True),memory_budget=self.__job_params.get("Memory"))
+        return experiment
 
+    @property
+    def execution_profile(self) -> dict:
+        """
+        the Aer options set by `JobParams.ExecutionProfile`, either a mapping of `execution_profiles.profile_options` keys or "auto"
+        for the profile `JobManager/autotune.py` found fastest for this config's walk type and width, stored in `JobParams.ProfileCache`.
+        Only resolved once, as "auto" builds the walk
+        """
+        if self.__execution_profile is None:
+            profile = self.__job_params.get("ExecutionProfile")
+            if profile == "auto":
+                walk = self.gen_walk_from_config()
+                profile = ProfileCache(self.__job_params.get("ProfileCache")).lookup(type(walk).__name__, circuit_qubits(walk))
+                if profile is None:
+                    print("no tuned execution profile for {} with {} qubits, using Aer's defaults".format(type(walk).__name__, circuit_qubits(walk)))
+            self.__execution_profile = aer_options(profile or {})
+        return self.__execution_profile
+
+    def gen_backend_from_config(self, execution_profile = None) -> Backend:
+        """generates the backend described by `JobParams`, with `execution_profile` or by default the config's `execution_profile`"""
         backend = backend_dict.get(self.__job_params.get("Backend"))
-        BACKEND = Backend(use_GPU=False, IBMQ_device_name=device_name,backend=backend )
-
+        if backend:
+            backend = backend()
+        if execution_profile is None:
+            execution_profile = self.execution_profile
+        return Backend(use_GPU=False, IBMQ_device_name=self.__job_params.get('IBMDeviceName'), backend=backend, execution_profile=execution_profile)
+
+    def gen_walk_from_config(self, backend = None):
+        """
+        generates the walk described by the config. Walks generated without a `backend` can be inspected, e.g. to estimate
+        their memory, but not run
+        """
         walk_type_key = self.n_dims
         if self.experiment_params.get("IndependantWalk"):
             walk_type_key*=-1
@@ -288,11 +528,8 @@ class Config:
             assert decoherence_intervals is not None, "Must specify decoherence intervals if `DecohereCoinOnly` is set to true"
             target_qubits = [i for i in range(self.n_dims)]
             decoherence_cycle = CoinDecoherenceCycle(self.experiment_params.get("DecoherenceIntervals"),target_qubits=target_qubits)
-            decoherence_intervals = None
         
-        walk = walk_class(BACKEND,system_dimensions=system_dimensions, initial_states=initial_states, coin_class=coin_class, boundary_controls = boundary_controls, coin_decoherence_cycle=decoherence_cycle)
-        experiment = SingleExperiment(walk,self.n_dims,self.n_dimensional_qubits,self.experiment_params.get("Shots",1024),self.experiment_params["NSteps"],decoherence_intervals=decoherence_intervals,directory_path=self.__config.get("OutputPath"))
-        return experiment
+        return walk_class(backend,system_dimensions=system_dimensions, initial_states=initial_states, coin_class=coin_class, coin_kwargs=self.generate_coin_kwargs(), boundary_controls = boundary_controls, coin_decoherence_cycle=decoherence_cycle, engine=self.__job_params.get("Engine"), shift_synthesis=self.__job_params.get("ShiftSynthesis"))
 
     def _run_on_IBM(self):
         experiment = self.gen_experiment_from_config()
@@ -311,6 +548,8 @@ class Config:
     def run(self):
         if self.__job_params.get('IBMDeviceName'):
             self._run_on_IBM()
+        elif self.__job_params.get('RunLocally', False):
+            self.run_locally()
         else:
             self.run_on_PBS()
 
@@ -1,3 +1,4 @@
+import json
 import argparse
 
 class ExperimentParser:
@@ -17,6 +18,20 @@ class ExperimentParser:
         self.__parser.add_argument('--GPU', action='store_true', default = False)
         self.__parser.add_argument('--IBMDeviceName', action='store', type=str)
         self.__parser.add_argument('--independant', action='store_true', default = False)
+        self.__parser.add_argument('--engine', action='store', type=str, default = "qiskit")
+        self.__parser.add_argument('--shift_synthesis', action='store', type=str, default = "mct")
+        self.__parser.add_argument('--transpile_cache_dir', action='store', type=str)
+        self.__parser.add_argument('--mode', action='store', type=str, default = "counts")
+        self.__parser.add_argument('--sweep_steps', action='store', type=int, nargs='+')
+        self.__parser.add_argument('--max_parallel_experiments', action='store', type=int, default = 1)
+        self.__parser.add_argument('--decoherence_batch_size', action='store', type=int)
+        self.__parser.add_argument('--dense_output', action='store_true', default = False)
+        self.__parser.add_argument('--no_plots', action='store_true', default = False)
+        self.__parser.add_argument('--work_queue', action='store', type=str)
+        self.__parser.add_argument('--stale_after', action='store', type=float)
+        self.__parser.add_argument('--savepath', action='store', type=str, default = ".")
+        self.__parser.add_argument('--memory', action='store', type=float)
+        self.__parser.add_argument('--execution_profile', action='store', type=json.loads)
         self.__args = None
 
     def parse_args(self) -> dict:
@@ -3,6 +3,11 @@ from DiffusionProject.JobManager.config import Config
 
 if __name__ =="__main__":
     config_path = str(sys.argv[1])
-    config = Config(config_path)
-    config.run()
+    if len(sys.argv) > 2:
+        # resume the run saved in the directory passed
+        config = Config(config_path, savepath=str(sys.argv[2]))
+        config.resume()
+    else:
+        config = Config(config_path)
+        config.run()
 
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+
+
+class WorkQueue:
+    """
+    Durable queue of the experiment units of a sweep, stored in a SQLite file (usually `work_queue.db` in the config `savepath`).
+
+    A unit is the list of step counts run by one execution of the walk. Each unit records its status (pending, running,
+    completed or failed), the worker that claimed it, its timing and its output location. Workers claim pending units in a
+    transaction, so any number of PBS jobs, local processes or notebooks can share one queue. A running unit whose worker
+    stopped without completing it (e.g a PBS job hitting its walltime) becomes claimable again after `stale_after` seconds.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+    def __init__(self, path: str, stale_after = None) -> None:
+        """
+        Args:
+            path (str): the SQLite file of the queue, created if it does not exist\n
+            stale_after (float): seconds after which a running unit is assumed lost and may be claimed again. Never by default
+        """
+        self.path = path
+        self.stale_after = stale_after
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        self._execute("""CREATE TABLE IF NOT EXISTS units (
+                unit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                step_numbers TEXT UNIQUE NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL,
+                finished_at REAL,
+                elapsed_time REAL,
+                output_path TEXT,
+                error TEXT)""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, transactions are opened explicitly with `BEGIN IMMEDIATE`
+        return sqlite3.connect(self.path, timeout = 60, isolation_level = None)
+
+    def _execute(self, query: str, parameters = (), many = False):
+        """runs a single statement in its own connection, returns its rows and the number of rows it changed"""
+        connection = self._connect()
+        try:
+            cursor = connection.executemany(query, parameters) if many else connection.execute(query, parameters)
+            return cursor.fetchall(), cursor.rowcount
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _key(step_numbers) -> str:
+        return json.dumps(sorted(int(n_steps) for n_steps in step_numbers))
+
+    @staticmethod
+    def default_worker() -> str:
+        """identifies the calling process by its PBS job ID if it has one, its host and its PID"""
+        worker = "{}:{}".format(socket.gethostname(), os.getpid())
+        if os.environ.get("PBS_JOBID"):
+            worker = os.environ["PBS_JOBID"] + "@" + worker
+        return worker
+
+    def add_units(self, units: list, output_path: str = None) -> None:
+        """adds each list of step counts in `units` as a pending unit, units already in the queue keep their status"""
+        self._execute("INSERT OR IGNORE INTO units (step_numbers, status, output_path) VALUES (?, ?, ?)",
+            [(self._key(step_numbers), self.PENDING, output_path) for step_numbers in units], many = True)
+
+    def _claimable(self, now) -> tuple:
+        """the SQL condition and parameters of the units that may be claimed at time `now`"""
+        if self.stale_after is None:
+            return "status = ?", [self.PENDING]
+        return "(status = ? OR (status = ? AND claimed_at < ?))", [self.PENDING, self.RUNNING, now - self.stale_after]
+
+    def claim(self, worker: str = None, step_numbers = None):
+        """
+        claims the oldest claimable unit, or the unit of `step_numbers` only, for `worker`.
+        Returns its (unit_id, step_numbers), or None if there is nothing left to claim
+        """
+        worker = worker or self.default_worker()
+        now = time.time()
+        condition, parameters = self._claimable(now)
+        if step_numbers is not None:
+            condition += " AND step_numbers = ?"
+            parameters.append(self._key(step_numbers))
+
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT unit_id, step_numbers FROM units WHERE {} ORDER BY unit_id LIMIT 1".format(condition), parameters).fetchone()
+            if row is not None:
+                connection.execute("UPDATE units SET status = ?, worker = ?, attempts = attempts + 1, claimed_at = ?, finished_at = NULL, elapsed_time = NULL, error = NULL WHERE unit_id = ?",
+                    (self.RUNNING, worker, now, row[0]))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _finish(self, unit_id, status, output_path = None, error = None) -> None:
+        now = time.time()
+        self._execute("UPDATE units SET status = ?, finished_at = ?, elapsed_time = ? - claimed_at, output_path = COALESCE(?, output_path), error = ? WHERE unit_id = ?",
+            (status, now, now, output_path, error, unit_id))
+
+    def complete(self, unit_id, output_path: str = None) -> None:
+        """marks a claimed unit as completed, optionally recording where its results were written"""
+        self._finish(unit_id, self.COMPLETED, output_path)
+
+    def fail(self, unit_id, error) -> None:
+        """marks a claimed unit as failed with `error`, failed units are not claimed again until `retry_failed`"""
+        self._finish(unit_id, self.FAILED, error = str(error))
+
+    def retry_failed(self) -> int:
+        """returns every failed unit to the queue, returns the number of units requeued"""
+        return self._execute("UPDATE units SET status = ? WHERE status = ?", (self.PENDING, self.FAILED))[1]
+
+    def requeue_running(self) -> int:
+        """
+        returns every running unit to the queue, for resuming after a crash when no worker is still running.
+        Returns the number of units requeued
+        """
+        return self._execute("UPDATE units SET status = ? WHERE status = ?", (self.PENDING, self.RUNNING))[1]
+
+    def units(self, status: str = None) -> list:
+        """the step counts of every unit, or of the units with `status` only, in the order they were added"""
+        query, parameters = "SELECT step_numbers FROM units", []
+        if status is not None:
+            query, parameters = query + " WHERE status = ?", [status]
+        rows = self._execute(query + " ORDER BY unit_id", parameters)[0]
+        return [json.loads(row[0]) for row in rows]
+
+    def is_completed(self, step_numbers) -> bool:
+        rows = self._execute("SELECT status FROM units WHERE step_numbers = ?", (self._key(step_numbers),))[0]
+        return len(rows) > 0 and rows[0][0] == self.COMPLETED
+
+    def status(self) -> dict:
+        """the number of units with each status"""
+        status = {status: 0 for status in (self.PENDING, self.RUNNING, self.COMPLETED, self.FAILED)}
+        status.update(self._execute("SELECT status, COUNT(*) FROM units GROUP BY status")[0])
+        return status
+
+    def report(self) -> str:
+        return ", ".join("{} {}".format(count, status) for status, count in self.status().items())
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import yaml
+import argparse
+from DiffusionProject.Backends.backend import Backend
+from DiffusionProject.Backends.transpile_cache import transpile_cache
+from DiffusionProject.JobManager.config import Config
+from DiffusionProject.Utils.configCodes import backend_dict
+from DiffusionProject.Utils.timer import Timer
+
+
+class WarmWorker:
+    """
+    Runs many experiment units in one Python process, so qiskit, Aer and the plotting libraries are imported once.
+
+    Backends are shared between every config with the same backend settings, and each config keeps one experiment (and walk)
+    for all of its units, so the walk's circuits and the `transpile_cache` stay warm between units.
+    """
+
+    def __init__(self, n_threads = None, verbose = True) -> None:
+        """
+        Args:
+            n_threads (int): the number of threads of each Aer simulator, Aer's default if not set\n
+            verbose (bool): print the time taken by each unit as it completes
+        """
+        self.n_threads = n_threads
+        self.verbose = verbose
+        self._backends = {}
+        self._experiments = {}
+        self.timings = []
+
+    def backend(self, config: Config) -> Backend:
+        """the backend described by the `JobParams` of `config`, created once per distinct set of backend settings"""
+        job_params = config.job_params
+        execution_profile = config.execution_profile
+        key = (job_params.get("UseGPU", False), job_params.get("IBMDeviceName"), job_params.get("Backend"), json.dumps(execution_profile, sort_keys=True))
+        if key not in self._backends:
+            backend = backend_dict.get(job_params.get("Backend"))
+            self._backends[key] = Backend(use_GPU=key[0], IBMQ_device_name=key[1], backend=backend() if backend else None, execution_profile=execution_profile)
+            if self.n_threads and not self._backends[key].is_on_IBM:
+                self._backends[key].backend.set_options(max_parallel_threads=self.n_threads)
+        return self._backends[key]
+
+    def experiment(self, config: Config, savepath: str):
+        """the experiment of `config` saving to `savepath`, generated once and reused for every unit"""
+        key = (os.path.abspath(config.path), savepath)
+        if key not in self._experiments:
+            self._experiments[key] = config.gen_experiment_from_config(n_steps=0, directory_path=savepath, backend=self.backend(config))
+        return self._experiments[key]
+
+    def run_unit(self, config: Config, step_numbers: list, savepath: str) -> float:
+        """runs the experiments of `step_numbers` in a single execution if `SweepInOneExecution` is set, returns the wall time taken"""
+        experiment = self.experiment(config, savepath)
+        start_time = time.perf_counter()
+        if config.job_params.get("SweepInOneExecution", False):
+            experiment.run_sweep_locally(step_numbers)
+        else:
+            for n_steps in step_numbers:
+                experiment.n_steps = n_steps
+                experiment.run_locally()
+        elapsed_time = time.perf_counter() - start_time
+
+        self.timings.append((config.path, list(step_numbers), elapsed_time))
+        if self.verbose:
+            print("WORKER: {} steps {} took {}".format(config.path, step_numbers, Timer.seconds_to_hms(elapsed_time)))
+        return elapsed_time
+
+    def _run_claimed(self, work_queue, unit, config: Config, savepath: str) -> bool:
+        unit_id, step_numbers = unit
+        try:
+            self.run_unit(config, step_numbers, savepath)
+            # the unit is only completed once its results are saved under the savepath
+            experiment = self.experiment(config, savepath)
+            missing_steps = [n_steps for n_steps in step_numbers if not experiment.has_results(n_steps)]
+            assert not missing_steps, "no results saved in {} for steps {}".format(experiment.path, missing_steps)
+        except Exception as error:
+            work_queue.fail(unit_id, repr(error))
+            print("WORKER: {} steps {} failed: {}".format(config.path, step_numbers, repr(error)))
+            return False
+        work_queue.complete(unit_id)
+        return True
+
+    def run_config(self, config: Config, step_numbers: list = None) -> list:
+        """
+        runs the units of `config` through its work queue, saving to the config `savepath` and skipping units that are completed
+        or claimed by another worker. If `step_numbers` is passed only its units are run, otherwise units are claimed until the
+        queue is empty. Returns the step numbers of the completed units
+        """
+        savepath = os.path.expandvars(config.savepath)
+        work_queue = config.work_queue
+        completed_units = []
+
+        if step_numbers is None:
+            while True:
+                unit = work_queue.claim()
+                if unit is None:
+                    return completed_units
+                if self._run_claimed(work_queue, unit, config, savepath):
+                    completed_units.append(unit[1])
+
+        if config.job_params.get("SweepInOneExecution", False):
+            units = [list(step_numbers)]
+        else:
+            units = [[n_steps] for n_steps in step_numbers]
+        work_queue.add_units(units, output_path=savepath)
+        for step_numbers in units:
+            unit = work_queue.claim(step_numbers=step_numbers)
+            if unit is None:
+                print("WORKER: {} steps {} is completed or claimed by another worker, skipping".format(config.path, step_numbers))
+            elif self._run_claimed(work_queue, unit, config, savepath):
+                completed_units.append(step_numbers)
+        return completed_units
+
+    def run_spec_file(self, path: str) -> list:
+        """
+        runs every entry of the `.yml` spec file at `path`, a list of entries of the form
+
+            - Config: path/to/config.yml
+              SavePath: path/to/results   # optional, the savepath of the config is generated if not set
+              Steps: [0, 20, 40]          # optional, every unit of the config by default
+        """
+        with open(path, "r") as yamlfile:
+            specs = yaml.load(yamlfile, Loader = yaml.FullLoader)
+
+        completed_units = []
+        for spec in specs:
+            config = Config(spec["Config"], spec.get("SavePath"))
+            config.build_local_save_directory()
+            completed_units += self.run_config(config, spec.get("Steps"))
+        return completed_units
+
+    def report(self) -> str:
+        lines = ["{} steps {}: {}".format(config_path, step_numbers, Timer.seconds_to_hms(elapsed_time)) for config_path, step_numbers, elapsed_time in self.timings]
+        total_time = sum(timing[2] for timing in self.timings)
+        lines.append("{} units in {}".format(len(self.timings), Timer.seconds_to_hms(total_time)))
+        lines.append(transpile_cache.report())
+        return "\n".join(lines)
+
+
+class WorkerParser:
+    def __init__(self) -> None:
+        self.__parser = argparse.ArgumentParser(description='Run many Quantum Walk experiments in one process')
+        self.__parser.add_argument('--config', action='store', type=str)
+        self.__parser.add_argument('--savepath', action='store', type=str)
+        self.__parser.add_argument('--steps', action='store', type=int, nargs='+')
+        self.__parser.add_argument('--spec', action='store', type=str)
+        self.__parser.add_argument('--threads', action='store', type=int)
+
+    def parse_args(self) -> dict:
+        return vars(self.__parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = WorkerParser().parse_args()
+    assert args.get("config") or args.get("spec"), "pass a config with --config or a spec file with --spec"
+    worker = WarmWorker(n_threads=args.get("threads"))
+
+    if args.get("spec"):
+        worker.run_spec_file(args["spec"])
+    else:
+        config = Config(args["config"], args.get("savepath"))
+        config.build_local_save_directory()
+        worker.run_config(config, args.get("steps"))
+
+    print(worker.report())
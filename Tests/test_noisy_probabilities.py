@@ -0,0 +1,34 @@
+import io
+import contextlib
+import numpy as np
+from qiskit.providers.fake_provider import FakeToronto
+from DiffusionProject.Algorithms.Walks import QuantumWalk1D
+from DiffusionProject.Backends.backend import Backend
+
+
+def noisy_walk() -> QuantumWalk1D:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return QuantumWalk1D(Backend(backend=FakeToronto()), 3, "010")
+
+
+def test_noisy_probabilities_are_exact():
+    """probabilities on a noisy backend are simulated as a density matrix, not sampled from a single noise trajectory"""
+    walk = noisy_walk()
+    assert walk.backend.has_noise_model
+    assert walk._exact_simulation_method(walk.build_template(3, "probabilities"))[0] == "density_matrix"
+
+    runs = [walk.run_experiment(3, mode="probabilities").result().data(0)["probabilities"] for _ in range(3)]
+    for probabilities in runs:
+        assert np.allclose(probabilities, runs[0])
+    assert np.isclose(np.sum(runs[0]), 1)
+    # noise spreads the walk over every site
+    assert np.count_nonzero(runs[0]) == len(runs[0])
+
+    dense = walk.run_dense(3)
+    assert np.allclose(dense, runs[0], atol=1e-6)
+
+    # the sweep circuit is transpiled on its own, so it is only compared with itself
+    sweeps = [walk.run_sweep([3])[3] for _ in range(3)]
+    for sweep in sweeps:
+        assert np.allclose(sweep["probability_density"], sweeps[0]["probability_density"])
+    assert np.isclose(np.sum(sweeps[0]["probability_density"]), 1)
@@ -1,6 +1,6 @@
 from DiffusionProject.Utils.binaryMethods import binary_step_up, binary_step_down
 from DiffusionProject.Algorithms.Coins import HadamardCoin
-from DiffusionProject.Algorithms.Boundaries import Boundary, OneWayBoundaryControl, BoundaryControl
+from DiffusionProject.Algorithms.Boundaries import Boundary, BoundaryControl
 from DiffusionProject.Utils.configCodes import coin_class_dict
 
 
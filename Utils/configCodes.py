@@ -1,6 +1,5 @@
 from DiffusionProject.Algorithms.Coins import HadamardCoin, GroverCoin, CylicController, DFTCoin, PhaseKickbackCoin, RightKickBackCoin, LeftKickBackCoin, RightMinusKickBackCoin, RightPlusKickBackCoin, LeftMinusKickBackCoin, LeftPlusKickBackCoin, SU2Coin
 from DiffusionProject.Algorithms.Walks import QuantumWalk1D, QuantumWalk2D, QuantumWalk2DIndependant, QuantumWalk3D
-from qiskit.test.mock import FakeToronto
 
 walk_type_dict = {
     1: QuantumWalk1D,
@@ -32,6 +31,12 @@ coin_class_dict = {
     "Cyclic_controller": CylicController
 }
 
+def FakeToronto():
+    """creates the fake Toronto backend, importing the fake backends only when one is used"""
+    from qiskit.test.mock import FakeToronto
+    return FakeToronto()
+
+
 backend_dict = {
     "FakeToronto": FakeToronto
 
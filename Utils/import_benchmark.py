@@ -0,0 +1,78 @@
+import sys
+import json
+import argparse
+import subprocess
+
+# the modules a compute-only run (no plots, local backend) imports
+HEADLESS_MODULES = [
+    "DiffusionProject.Algorithms.Walks",
+    "DiffusionProject.Evaluation.Experiments",
+    "DiffusionProject.JobManager.config",
+    "DiffusionProject.JobManager.worker",
+]
+
+# modules only imported on first use, importing any of them in a headless module is a regression
+LAZY_MODULES = [
+    "matplotlib",
+    "seaborn",
+    "mpl_toolkits.mplot3d",
+    "DiffusionProject.Evaluation.Plotter",
+    "qiskit.providers.ibmq",
+    "qiskit.test.mock",
+]
+
+_MEASURE = """
+import sys, time, json
+start_time = time.perf_counter()
+import {module}
+elapsed_time = time.perf_counter() - start_time
+print(json.dumps({{"seconds": elapsed_time, "lazy_modules_loaded": [module for module in {lazy_modules!r} if module in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, repeats = 3, lazy_modules: list = LAZY_MODULES) -> dict:
+    """
+    imports `module` in `repeats` fresh interpreters, returns the fastest import time in seconds and the `lazy_modules` it loaded.
+    The fastest time is reported as it is the least disturbed by other load on the machine
+    """
+    times = []
+    for _ in range(repeats):
+        process = subprocess.run([sys.executable, "-c", _MEASURE.format(module=module, lazy_modules=list(lazy_modules))], capture_output=True, text=True)
+        if process.returncode != 0:
+            return {"module": module, "seconds": None, "lazy_modules_loaded": [], "error": process.stderr.strip().splitlines()[-1]}
+        measurement = json.loads(process.stdout.strip().splitlines()[-1])
+        times.append(measurement["seconds"])
+    return {"module": module, "seconds": min(times), "lazy_modules_loaded": measurement["lazy_modules_loaded"], "error": None}
+
+
+def run_benchmark(modules: list = HEADLESS_MODULES, repeats = 3, budget = None, verbose = True) -> bool:
+    """
+    measures the import time of each of `modules`, returns False if any failed to import, loaded a lazy module or took longer
+    than `budget` seconds
+    """
+    passed = True
+    for module in modules:
+        measurement = measure_import(module, repeats)
+        if measurement["error"]:
+            status = "ERROR {}".format(measurement["error"])
+        elif measurement["lazy_modules_loaded"]:
+            status = "LOADED {}".format(", ".join(measurement["lazy_modules_loaded"]))
+        elif budget is not None and measurement["seconds"] > budget:
+            status = "OVER BUDGET"
+        else:
+            status = "OK"
+        passed = passed and status == "OK"
+
+        if verbose:
+            seconds = "-" if measurement["seconds"] is None else "{:.3f}s".format(measurement["seconds"])
+            print("{:<45} {:>8}  {}".format(module, seconds, status))
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the import time of the headless execution path')
+    parser.add_argument('--modules', action='store', type=str, nargs='+', default=HEADLESS_MODULES)
+    parser.add_argument('--repeats', action='store', type=int, default=3)
+    parser.add_argument('--budget', action='store', type=float, help='maximum import time of each module in seconds')
+    args = parser.parse_args()
+    sys.exit(0 if run_benchmark(args.modules, args.repeats, args.budget) else 1)
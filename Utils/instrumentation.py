@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import resource
+import itertools
+import contextlib
+from collections import deque
+
+# the run-level and per-experiment Aer result metadata recorded on spans
+AER_METADATA_KEYS = ["parallel_experiments", "max_memory_mb", "max_gpu_memory_mb", "omp_enabled", "num_mpi_processes", "time_taken_execute"]
+AER_EXPERIMENT_METADATA_KEYS = ["method", "device", "fusion", "parallel_state_update", "parallel_shots", "batched_shots_optimization", "num_qubits"]
+
+
+def peak_rss_mb() -> float:
+    """the peak resident memory of this process in MB"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kB, macOS reports bytes
+    return peak_rss/1024**2 if sys.platform == "darwin" else peak_rss/1024
+
+
+def aer_metadata(result) -> dict:
+    """the simulator time, method, fusion, threads and memory of a qiskit `Result`. Native engine results only have a time"""
+    metadata = {"time_taken": getattr(result, "time_taken", None)}
+    result_metadata = getattr(result, "metadata", None) or {}
+    metadata.update({key: result_metadata[key] for key in AER_METADATA_KEYS if key in result_metadata})
+
+    experiment_results = getattr(result, "results", None) or []
+    if experiment_results:
+        metadata["n_experiments"] = len(experiment_results)
+        experiment_metadata = getattr(experiment_results[0], "metadata", None) or {}
+        metadata.update({key: experiment_metadata[key] for key in AER_EXPERIMENT_METADATA_KEYS if key in experiment_metadata})
+    return metadata
+
+
+class Span:
+    """A timed phase of a run, nested inside the span that was open when it started"""
+
+    def __init__(self, name: str, span_id: int, parent, path: str, attributes: dict) -> None:
+        self.name = name
+        self.span_id = span_id
+        self.parent = parent
+        self.path = path
+        self.attributes = dict(attributes)
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.start_time = time.time()
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss_mb = None
+
+    def set(self, **attributes) -> None:
+        """adds `attributes` to the span, e.g results only known once the phase has run"""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "id": self.span_id,
+            "parent": self.parent.span_id if self.parent is not None else None,
+            "depth": self.depth,
+            "start": self.start_time,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_rss_mb": self.peak_rss_mb,
+            "attributes": self.attributes,
+        }
+
+
+class Instrumentation:
+    """
+    Records nested spans around the phases of a run (build, transpile, run, post-process, plot, write) with their wall time,
+    the CPU time of the process (including simulator threads) and the peak RSS when they end.
+
+    A span started with a `path` writes itself and every span nested inside it to that file as JSON lines, one line per span
+    as it ends. The most recent spans are also kept in `finished`.
+    """
+
+    def __init__(self, enabled = True, history = 1000) -> None:
+        """
+        Args:
+            enabled (bool): record spans, disabled spans cost a single check\n
+            history (int): the number of finished spans kept in `finished`
+        """
+        self.enabled = enabled
+        self.finished = deque(maxlen = history)
+        self._stack = []
+        self._ids = itertools.count()
+
+    @property
+    def current(self) -> Span:
+        """the innermost open span, or None"""
+        return self._stack[-1] if self._stack else None
+
+    @contextlib.contextmanager
+    def span(self, name: str, path: str = None, **attributes):
+        """
+        times the block as a span named `name` nested in the current span, yielding the `Span` so attributes can be added.
+        Spans are written to `path`, by default the file of the span they are nested in
+        """
+        parent = self.current
+        if path is None and parent is not None:
+            path = parent.path
+        span = Span(name, next(self._ids), parent, path, attributes)
+        if not self.enabled:
+            yield span
+            return
+
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        self._stack.append(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.set(error = repr(error))
+            raise
+        finally:
+            self._stack.pop()
+            span.wall_time = time.perf_counter() - start_wall
+            span.cpu_time = time.process_time() - start_cpu
+            span.peak_rss_mb = peak_rss_mb()
+            self._emit(span)
+
+    def _emit(self, span: Span) -> None:
+        record = span.to_dict()
+        self.finished.append(record)
+        if span.path is None:
+            return
+        directory = os.path.dirname(span.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(span.path, "a") as file:
+            file.write(json.dumps(record, default = str) + "\n")
+
+    @staticmethod
+    def load(path: str) -> list:
+        """reads the spans written to the JSON lines file at `path`"""
+        with open(path, "r") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    @staticmethod
+    def summary(spans: list) -> dict:
+        """the number of spans, total wall time and total CPU time of each span name"""
+        totals = {}
+        for span in spans:
+            total = totals.setdefault(span["name"], {"count": 0, "wall_time": 0.0, "cpu_time": 0.0})
+            total["count"] += 1
+            total["wall_time"] += span["wall_time"]
+            total["cpu_time"] += span["cpu_time"]
+        return totals
+
+
+# shared by every walk and experiment in the process
+instrumentation = Instrumentation()